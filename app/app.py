@@ -1,14 +1,35 @@
 import os
-from flask import Flask, request, jsonify, send_file
-import tempfile
-import shutil
+from flask import Flask, request, jsonify, send_file, Response
+import time
+import threading
+import hashlib
+import hmac
+import json
+import re
+import uuid
+import heapq
+import atexit
+import itertools
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 from datetime import datetime
 import numpy as np
 import soundfile as sf
 from kokoro_onnx import Kokoro
-from misaki import espeak
 from misaki.espeak import EspeakG2P
 import io
+import urllib.parse
+from rpc import start_rpc_server, RpcError
+from shm_ring import ShmRingWriter, ShmRingError
+
+# MessagePack es opcional: solo habilita el sobre application/msgpack en /synthesize_json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Configuración del servicio
 HOST = os.getenv("FLASK_HOST", "0.0.0.0")
@@ -17,27 +38,162 @@ DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "es")  # Español por defecto
 DEFAULT_VOICE = os.getenv("DEFAULT_VOICE", "ef_dora")  # Voz por defecto para español
 DEBUG_AUDIO = os.getenv("DEBUG_AUDIO", "true").lower() == "true"  # Guardar audio para debug
 
-# Rutas de los modelos
-MODEL_PATH = "/app/models/kokoro-v1.0.onnx"
-VOICES_PATH = "/app/models/voices-v1.0.bin"
+# Configuración de caché HTTP y de respuestas de audio
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", 86400))  # Segundos (Cache-Control max-age)
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", 256))  # 0 desactiva la caché en memoria
+PHONEME_CACHE_MAX_MB = float(os.getenv("PHONEME_CACHE_MAX_MB", 16))  # Caché de resultados G2P
+
+# G2P en procesos dedicados, pre-arrancados por idioma
+G2P_WORKERS = int(os.getenv("G2P_WORKERS", 2))  # Procesos por idioma (0 = G2P dentro del proceso web)
+G2P_LANGUAGES = [lang.strip() for lang in os.getenv("G2P_LANGUAGES", DEFAULT_LANGUAGE).split(",") if lang.strip()]
+G2P_BATCH_SENTENCES = int(os.getenv("G2P_BATCH_SENTENCES", 8))  # Frases por lote enviado a un proceso
+G2P_TIMEOUT = float(os.getenv("G2P_TIMEOUT", 30))  # Segundos máximos por lote
+
+# Caché de audio por segmento (frases/cláusulas) para plantillas donde solo cambia una parte
+SEGMENT_CACHE = os.getenv("SEGMENT_CACHE", "false").lower() == "true"  # Valor por defecto por petición
+SEGMENT_CACHE_MAX_MB = float(os.getenv("SEGMENT_CACHE_MAX_MB", 128))
+SEGMENT_CROSSFADE_MS = float(os.getenv("SEGMENT_CROSSFADE_MS", 10))  # Fundido cruzado entre segmentos
+
+# Postproceso del audio tras la inferencia (opcional por petición con el campo 'postprocess')
+POSTPROCESS = os.getenv("POSTPROCESS", "false").lower() == "true"  # Valor por defecto por petición
+POSTPROCESS_TRIM = os.getenv("POSTPROCESS_TRIM", "true").lower() == "true"  # Recortar silencio inicial/final
+POSTPROCESS_SILENCE_DB = float(os.getenv("POSTPROCESS_SILENCE_DB", -50))  # Umbral de silencio (dBFS de pico)
+POSTPROCESS_NORMALIZE = os.getenv("POSTPROCESS_NORMALIZE", "peak").lower()  # peak, lufs o none
+POSTPROCESS_PEAK_DB = float(os.getenv("POSTPROCESS_PEAK_DB", -1))  # Pico objetivo y techo de la normalización LUFS
+POSTPROCESS_LUFS = float(os.getenv("POSTPROCESS_LUFS", -16))  # Sonoridad objetivo con normalize=lufs
+POSTPROCESS_FADE_MS = float(os.getenv("POSTPROCESS_FADE_MS", 5))  # Fundido de entrada/salida
+POSTPROCESS_PAUSE_MS = float(os.getenv("POSTPROCESS_PAUSE_MS", 0))  # Pausa máxima entre frases (0 = sin cambios)
+
+# Directorio generado por prerender.py que se importa como caché caliente al arrancar
+WARM_CACHE_DIR = os.getenv("WARM_CACHE_DIR", "")
+
+# Endpoints /admin/*: exigen la cabecera X-Admin-Token con este valor (vacío = desactivados)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Almacenamiento de artefactos de audio largos (servidos con HTTP Range)
+STORAGE_DIR = os.getenv("STORAGE_DIR", "/app/storage")
+ARTIFACTS_DIR = os.path.join(STORAGE_DIR, "artifacts")
+LONGFORM_CHUNK_CHARS = int(os.getenv("LONGFORM_CHUNK_CHARS", 400))  # Tamaño máximo de cada fragmento de texto
+
+# Trabajos asíncronos de texto largo (fragmentos persistidos en disco para reanudar)
+JOBS_DIR = os.path.join(STORAGE_DIR, "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # Hilos del pool de trabajos en segundo plano
+RESUME_JOBS = os.getenv("RESUME_JOBS", "true").lower() == "true"  # Reanudar trabajos pendientes al arrancar
+
+# Léxicos de pronunciación por idioma: <LEXICON_DIR>/<idioma>.json con {"palabra o frase": "fonemas"}
+LEXICON_DIR = os.getenv("LEXICON_DIR", os.path.join(STORAGE_DIR, "lexicons"))
+
+# Interfaz RPC binaria (rpc.py) junto a REST, para llamadas internas (0 = desactivada)
+RPC_PORT = int(os.getenv("RPC_PORT", 0))
+RPC_WORKERS = int(os.getenv("RPC_WORKERS", 8))  # Peticiones RPC atendidas en paralelo
+
+# Canal de audio en memoria compartida (shm_ring.py) para consumidores del mismo host
+SHM_RING_SIZE_MB = float(os.getenv("SHM_RING_SIZE_MB", 0))  # Tamaño del buffer circular (0 = desactivado)
+SHM_RING_NAME = os.getenv("SHM_RING_NAME", "kokoro_audio")  # Prefijo del segmento (/dev/shm/<nombre>_<pid>)
+
+# Rutas de los modelos (las mismas variables lee quantize_model.py)
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/models/kokoro-v1.0.onnx")
+VOICES_PATH = os.getenv("VOICES_PATH", "/app/models/voices-v1.0.bin")
+
+# Variantes de precisión del modelo (mismo grafo exportado con distinta precisión numérica).
+# int8 (cuantización dinámica) reduce memoria y acelera la inferencia en nodos solo-CPU.
+# Se generan con: python quantize_model.py quantize
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")  # Variante por defecto del despliegue
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "true").lower() == "true"  # Cargar el modelo al importar el módulo
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))  # 0 = valor por defecto de ONNX Runtime
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 0))  # Segundos entre comprobaciones de archivos (0 = sin recarga automática)
+MODEL_VARIANTS = {
+    "fp32": MODEL_PATH,
+    "fp16": os.getenv("MODEL_PATH_FP16", "/app/models/kokoro-v1.0.fp16.onnx"),
+    "int8": os.getenv("MODEL_PATH_INT8", "/app/models/kokoro-v1.0.int8.onnx"),
+}
+
+# Registro de modelos: además de las variantes de precisión se pueden servir otros modelos
+# (versiones, cuantizaciones o exportaciones especializadas por idioma) desde el mismo proceso.
+# MODELS_CONFIG apunta a un JSON:
+#   {"nombre": {"model_path": "...", "voices_path": "...", "languages": ["es"]}}
+MODELS_CONFIG = os.getenv("MODELS_CONFIG", "")
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))  # Memoria para modelos cargados (0 = sin límite)
+MODEL_IDLE_TIMEOUT = float(os.getenv("MODEL_IDLE_TIMEOUT", 0))  # Segundos sin uso antes de descargar un modelo (0 = nunca)
+MODEL_VOICES = {name: VOICES_PATH for name in MODEL_VARIANTS}
+MODEL_LANGUAGES = {}  # Idioma -> modelo especializado usado cuando la petición no elige modelo
+MODEL_SUPPORTED_LANGUAGES = {}  # Modelo -> idiomas declarados (sin entrada = todos)
+if MODELS_CONFIG:
+    with open(MODELS_CONFIG) as f:
+        for name, entry in json.load(f).items():
+            MODEL_VARIANTS[name] = entry["model_path"]
+            MODEL_VOICES[name] = entry.get("voices_path", VOICES_PATH)
+            if entry.get("languages"):
+                MODEL_SUPPORTED_LANGUAGES[name] = list(entry["languages"])
+            for language in entry.get("languages", []):
+                MODEL_LANGUAGES.setdefault(language, name)
+
+# Circuit breaker de Kokoro: tras N fallos seguidos se usa directamente el fallback
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))  # Segundos hasta la petición de prueba
+
+# Control de admisión: límites por petición y presupuesto de cómputo por tenant
+MAX_TEXT_CHARS = int(os.getenv("MAX_TEXT_CHARS", 5000))  # Texto máximo en endpoints interactivos
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 50))  # Textos máximos en /batch_synthesize
+MAX_REQUEST_SECONDS = float(os.getenv("MAX_REQUEST_SECONDS", 60))  # Cómputo estimado máximo por petición
+MAX_REQUEST_MEMORY_MB = float(os.getenv("MAX_REQUEST_MEMORY_MB", 2048))  # Memoria pico estimada máxima
+TENANT_BUDGET_SECONDS = float(os.getenv("TENANT_BUDGET_SECONDS", 0))  # Segundos de cómputo por minuto y tenant (0 = sin límite)
+LONGFORM_DOWNGRADE = os.getenv("LONGFORM_DOWNGRADE", "false").lower() == "true"  # Derivar a /jobs en vez de rechazar
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", 2))  # Inferencias simultáneas (0 = sin límite)
+
+# Valores a priori del modelo de coste (se recalibran con las ejecuciones observadas)
+COST_BASE_SECONDS = float(os.getenv("COST_BASE_SECONDS", 0.05))
+COST_SECONDS_PER_PHONEME = float(os.getenv("COST_SECONDS_PER_PHONEME", 0.003))
+COST_BASE_MEMORY_MB = float(os.getenv("COST_BASE_MEMORY_MB", 50))
+COST_BYTES_PER_SAMPLE = float(os.getenv("COST_BYTES_PER_SAMPLE", 256))  # Activaciones por muestra de audio
 
 # Crear directorio para audio de debug
 DEBUG_DIR = "/app/debug_audio"
 if DEBUG_AUDIO and not os.path.exists(DEBUG_DIR):
     os.makedirs(DEBUG_DIR, exist_ok=True)
 
+# Crear directorios de artefactos y trabajos
+os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+os.makedirs(JOBS_DIR, exist_ok=True)
+
 print(f"[*] Iniciando Kokoro TTS v1.0 optimizado para español")
 print(f"[*] Idioma por defecto: {DEFAULT_LANGUAGE}")
 print(f"[*] Voz por defecto: {DEFAULT_VOICE}")
+print(f"[*] Precisión del modelo: {MODEL_PRECISION}")
 print(f"[*] Debug de audio: {'ACTIVADO' if DEBUG_AUDIO else 'DESACTIVADO'}")
 if DEBUG_AUDIO:
     print(f"[*] Directorio de debug: {DEBUG_DIR}")
 
-# Cargar modelo Kokoro v1.0
-try:
+# Modelos Kokoro cargados, indexados por nombre en el registro (MODEL_VARIANTS)
+kokoro_models = {}
+kokoro_model_versions = {}
+kokoro_model_sizes = {}  # MB estimados (tamaño de pesos + voces) de cada modelo cargado
+kokoro_model_last_used = {}
+kokoro_models_lock = threading.Lock()
+
+def get_files_version(*paths):
+    """Huella barata (tamaño + mtime) de los archivos de un modelo"""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}-{int(stat.st_mtime)}")
+        except (OSError, TypeError):
+            parts.append("missing")
+    return ":".join(parts)
+
+def get_model_version(precision=None):
+    """Versión del modelo usada en ETags y claves de caché"""
+    precision = precision or MODEL_PRECISION
+    version = kokoro_model_versions.get(precision)
+    if version is None:
+        version = get_files_version(MODEL_VARIANTS.get(precision), MODEL_VOICES.get(precision))
+    return f"kokoro-v1.0:{precision}:{version}"
+
+def load_kokoro_model(model_path, voices_path=VOICES_PATH):
+    """Carga una instancia de Kokoro v1.0 usando GPU si está disponible"""
     # Configurar GPU para ONNX Runtime si está disponible
     import onnxruntime as ort
-    import os
     
     # Verificar si CUDA está disponible
     cuda_available = 'CUDAExecutionProvider' in ort.get_available_providers()
@@ -46,49 +202,652 @@ try:
         print(f"[*] GPU/CUDA detectada, configurando ONNX Runtime para GPU")
         # Configurar variable de entorno para kokoro-onnx
         os.environ['ONNX_PROVIDER'] = 'CUDAExecutionProvider'
-        kokoro = Kokoro(MODEL_PATH, VOICES_PATH)
-        print(f"[*] Kokoro v1.0 cargado exitosamente con GPU desde {MODEL_PATH}")
     else:
         print(f"[*] GPU/CUDA no disponible, usando CPU")
         # Asegurar que use CPU
         os.environ['ONNX_PROVIDER'] = 'CPUExecutionProvider'
-        kokoro = Kokoro(MODEL_PATH, VOICES_PATH)
-        print(f"[*] Kokoro v1.0 cargado exitosamente con CPU desde {MODEL_PATH}")
+    
+    if ONNX_INTRA_OP_THREADS > 0:
+        # Sesión propia para limitar los hilos de ONNX Runtime (varios procesos por nodo)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        session = ort.InferenceSession(model_path, sess_options=options, providers=[os.environ['ONNX_PROVIDER']])
+        model = Kokoro.from_session(session, voices_path)
+    else:
+        model = Kokoro(model_path, voices_path)
+    print(f"[*] Kokoro v1.0 cargado exitosamente con {'GPU' if cuda_available else 'CPU'} desde {model_path}")
+    return model
+
+def get_kokoro(precision=None):
+    """Obtiene (cargando bajo demanda) un modelo Kokoro del registro
+    
+    Si cargarlo supera MODEL_MEMORY_BUDGET_MB se descargan antes los
+    modelos usados hace más tiempo.
+    """
+    precision = precision or MODEL_PRECISION
+    if precision not in MODEL_VARIANTS:
+        raise ValueError(f"Modelo no soportado: {precision}")
+    
+    model = kokoro_models.get(precision)
+    if model is None:
+        with kokoro_models_lock:
+            model = kokoro_models.get(precision)
+            if model is None:
+                model_path = MODEL_VARIANTS[precision]
+                voices_path = MODEL_VOICES[precision]
+                if not os.path.exists(model_path):
+                    raise FileNotFoundError(f"Modelo {precision} no encontrado: {model_path}")
+                make_room_for_model(estimate_model_size_mb(model_path, voices_path))
+                model = load_kokoro_model(model_path, voices_path)
+                register_kokoro_model(precision, model, get_files_version(model_path, voices_path))
+    kokoro_model_last_used[precision] = time.time()
+    return model
+
+def estimate_model_size_mb(model_path, voices_path):
+    """Memoria aproximada de un modelo cargado: los pesos y las voces residen en memoria"""
+    return sum(os.path.getsize(path) for path in (model_path, voices_path) if os.path.exists(path)) / (1024 * 1024)
+
+def register_kokoro_model(precision, model, version):
+    """Publica un modelo cargado para las peticiones nuevas (requiere kokoro_models_lock)"""
+    kokoro_models[precision] = model
+    kokoro_model_versions[precision] = version
+    kokoro_model_sizes[precision] = estimate_model_size_mb(MODEL_VARIANTS[precision], MODEL_VOICES[precision])
+    kokoro_model_last_used[precision] = time.time()
+
+def unload_kokoro_model(precision, reason):
+    """Descarga un modelo (requiere kokoro_models_lock)
+    
+    Las peticiones en curso conservan su referencia y lo terminan de usar;
+    la memoria se libera al acabar. La versión se conserva para que las
+    claves de caché no cambien si se vuelve a cargar.
+    """
+    kokoro_models.pop(precision, None)
+    size = kokoro_model_sizes.pop(precision, 0)
+    increment_metric("model_evictions")
+    print(f"[*] Modelo {precision} descargado ({reason}, {size:.0f}MB)")
+
+def make_room_for_model(required_mb):
+    """Descarga modelos por orden de uso (LRU) hasta que quepa uno nuevo (requiere kokoro_models_lock)
+    
+    El modelo por defecto del despliegue nunca se descarga. Si aun así no
+    cabe, se carga igualmente y se avisa en el log.
+    """
+    if MODEL_MEMORY_BUDGET_MB <= 0:
+        return
+    candidates = sorted(
+        (name for name in kokoro_models if name != MODEL_PRECISION),
+        key=lambda name: kokoro_model_last_used.get(name, 0)
+    )
+    while candidates and sum(kokoro_model_sizes.values()) + required_mb > MODEL_MEMORY_BUDGET_MB:
+        unload_kokoro_model(candidates.pop(0), "presupuesto de memoria")
+    if sum(kokoro_model_sizes.values()) + required_mb > MODEL_MEMORY_BUDGET_MB:
+        print(f"[!] Presupuesto de memoria de modelos excedido: "
+              f"{sum(kokoro_model_sizes.values()) + required_mb:.0f}MB > {MODEL_MEMORY_BUDGET_MB:.0f}MB")
+
+def evict_idle_models():
+    """Hilo que descarga los modelos sin uso durante MODEL_IDLE_TIMEOUT segundos"""
+    while True:
+        time.sleep(max(1.0, MODEL_IDLE_TIMEOUT / 4))
+        now = time.time()
+        with kokoro_models_lock:
+            for name in list(kokoro_models):
+                if name != MODEL_PRECISION and now - kokoro_model_last_used.get(name, now) > MODEL_IDLE_TIMEOUT:
+                    unload_kokoro_model(name, f"sin uso durante {MODEL_IDLE_TIMEOUT:g}s")
+
+def resolve_model(data, language):
+    """Modelo de una petición: campo 'model' (o 'precision', por compatibilidad),
+    el modelo especializado del idioma si lo hay, o el de por defecto
+    """
+    return data.get("model") or data.get("precision") or MODEL_LANGUAGES.get(language, MODEL_PRECISION)
+
+# Recargas en caliente: una a la vez, con su último estado por variante
+model_reload_lock = threading.Lock()
+model_reload_status = {}
+
+def warmup_kokoro_model(model, precision):
+    """Inferencia de prueba con un idioma declarado para el modelo y una voz de su archivo de voces"""
+    languages = MODEL_SUPPORTED_LANGUAGES.get(precision) or [DEFAULT_LANGUAGE]
+    language = DEFAULT_LANGUAGE if DEFAULT_LANGUAGE in languages else languages[0]
+    
+    voices = model.get_voices()
+    if not voices:
+        raise ValueError(f"El modelo {precision} no tiene voces")
+    voice = get_optimal_voice_for_language(language)
+    if voice not in voices:
+        # Primera voz del idioma en el archivo de voces del modelo, o cualquiera si no hay
+        voice = next((v for v in voices if v in AVAILABLE_VOICES.get(language, [])), voices[0])
+    
+    model.create(phonemize_text(WARMUP_TEXTS.get(language, "Hola."), language), voice, is_phonemes=True)
+    return language, voice
+
+def reload_kokoro_model(precision=None):
+    """Carga de nuevo un modelo desde disco y la sustituye sin detener el servicio
+    
+    El modelo nuevo se carga y se calienta con una inferencia de prueba
+    mientras el anterior sigue atendiendo peticiones. La sustitución es
+    atómica para las peticiones nuevas; las que están en curso conservan su
+    referencia al modelo anterior, que se libera cuando terminan. Si la carga
+    o el calentamiento fallan se mantiene el modelo anterior.
+    """
+    global kokoro
+    precision = precision or MODEL_PRECISION
+    if precision not in MODEL_VARIANTS:
+        raise ValueError(f"Modelo no soportado: {precision}")
+    model_path = MODEL_VARIANTS[precision]
+    voices_path = MODEL_VOICES[precision]
+    
+    with model_reload_lock:
+        start = time.time()
+        version = get_files_version(model_path, voices_path)
+        previous_version = kokoro_model_versions.get(precision)
+        model_reload_status[precision] = {"status": "loading", "version": version, "started_at": start}
+        print(f"[*] Recargando Kokoro ({precision}) desde {model_path}")
+        
+        try:
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Modelo {precision} no encontrado: {model_path}")
+            model = load_kokoro_model(model_path, voices_path)
+            # Calentamiento: valida los archivos nuevos e inicializa kernels antes de recibir tráfico
+            warmup_kokoro_model(model, precision)
+        except Exception as e:
+            increment_metric("model_reload_failures")
+            model_reload_status[precision] = {
+                "status": "failed",
+                "version": version,
+                "error": str(e),
+                "started_at": start
+            }
+            print(f"[!] Error recargando Kokoro ({precision}), se mantiene el modelo anterior: {e}")
+            raise
+        
+        with kokoro_models_lock:
+            register_kokoro_model(precision, model, version)
+        if precision == MODEL_PRECISION:
+            kokoro = model
         
-except Exception as e:
-    print(f"[!] Error al cargar Kokoro v1.0: {e}")
-    kokoro = None
+        # Las claves de caché incluyen la versión del modelo: el audio anterior ya no es alcanzable
+        audio_cache.clear()
+        segment_cache.clear()
+        kokoro_breakers[precision].record_success()
+        increment_metric("model_reloads")
+        
+        model_reload_status[precision] = {
+            "status": "loaded",
+            "version": version,
+            "previous_version": previous_version,
+            "started_at": start,
+            "elapsed": time.time() - start
+        }
+        print(f"[*] Kokoro ({precision}) recargado en {time.time() - start:.1f}s (versión {version})")
+        return model_reload_status[precision]
+
+def watch_model_files():
+    """Recarga las variantes cargadas cuando cambian sus archivos (o el de voces) en disco
+    
+    Un cambio se aplica cuando la huella se repite en dos comprobaciones
+    seguidas, para no cargar un archivo a medio copiar. Una versión que ya
+    falló no se reintenta hasta que los archivos vuelvan a cambiar.
+    """
+    pending = {}
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        for precision in list(kokoro_models):
+            version = get_files_version(MODEL_VARIANTS[precision], MODEL_VOICES[precision])
+            last = model_reload_status.get(precision, {})
+            if version == kokoro_model_versions.get(precision) or (
+                    last.get("status") == "failed" and last.get("version") == version):
+                pending.pop(precision, None)
+                continue
+            if pending.get(precision) != version:
+                pending[precision] = version
+                print(f"[*] Cambio detectado en los archivos de {precision}, esperando a que se estabilicen")
+                continue
+            
+            pending.pop(precision, None)
+            try:
+                reload_kokoro_model(precision)
+            except Exception:
+                pass
 
 # Configurar G2P (Grapheme-to-Phoneme) para diferentes idiomas
+G2P_LANGUAGE_CODES = {"es": "es", "en": "en", "fr": "fr", "it": "it"}  # Otros idiomas usan inglés
+
 g2p_processors = {}
+g2p_processors_lock = threading.Lock()
+g2p_locks = {}  # EspeakG2P no es seguro entre hilos: un G2P a la vez por idioma en este proceso
+
+def create_g2p_processor(language):
+    """Crea el procesador G2P de un idioma (inglés si el idioma no está soportado)"""
+    try:
+        return EspeakG2P(language=G2P_LANGUAGE_CODES.get(language, "en"))
+    except Exception as e:
+        print(f"[!] Error creando G2P para {language}: {e}")
+        return EspeakG2P(language="en")
 
 def get_g2p_processor(language):
-    """Obtiene o crea el procesador G2P para un idioma específico"""
-    if language not in g2p_processors:
+    """Obtiene o crea (una sola vez, aunque lleguen peticiones simultáneas) el G2P de un idioma"""
+    processor = g2p_processors.get(language)
+    if processor is None:
+        with g2p_processors_lock:
+            processor = g2p_processors.get(language)
+            if processor is None:
+                g2p_locks[language] = threading.Lock()
+                processor = create_g2p_processor(language)
+                g2p_processors[language] = processor
+    return processor
+
+def phonemize_in_process(texts, language):
+    g2p = get_g2p_processor(language)
+    with g2p_locks[language]:
+        return [g2p(text)[0] for text in texts]
+
+# Procesos G2P dedicados: el G2P de textos largos no compite por el GIL con las peticiones
+g2p_pools = {}
+worker_g2p = None  # Procesador G2P dentro de cada proceso del pool
+
+def init_g2p_worker(language):
+    global worker_g2p
+    worker_g2p = create_g2p_processor(language)
+
+def g2p_worker_phonemize(text):
+    return worker_g2p(text)[0]
+
+def start_g2p_workers():
+    """Pre-arranca G2P_WORKERS procesos por idioma de G2P_LANGUAGES
+    
+    Se usa fork antes de cargar el modelo y de arrancar hilos, para que los
+    procesos sean ligeros y no vuelvan a ejecutar el módulo principal.
+    """
+    context = multiprocessing.get_context("fork")
+    for language in G2P_LANGUAGES:
         try:
-            if language == "es":
-                fallback = espeak.EspeakFallback(british=False)
-                g2p_processors[language] = EspeakG2P(language="es")
-            elif language == "en":
-                fallback = espeak.EspeakFallback(british=False)
-                g2p_processors[language] = EspeakG2P(language="en")
-            elif language == "fr":
-                fallback = espeak.EspeakFallback(british=False)
-                g2p_processors[language] = EspeakG2P(language="fr")
-            elif language == "it":
-                fallback = espeak.EspeakFallback(british=False)
-                g2p_processors[language] = EspeakG2P(language="it")
-            else:
-                # Fallback para otros idiomas
-                fallback = espeak.EspeakFallback(british=False)
-                g2p_processors[language] = EspeakG2P(language="en")
+            pool = ProcessPoolExecutor(max_workers=G2P_WORKERS, mp_context=context,
+                                       initializer=init_g2p_worker, initargs=(language,))
+            # Con fork todos los procesos se crean en el primer envío. No se espera al
+            # resultado: la tarea no puede serializarse hasta que termine de importarse app.py
+            pool.submit(g2p_worker_phonemize, "Hola.")
+            g2p_pools[language] = pool
+            print(f"[*] G2P ({language}): {G2P_WORKERS} procesos dedicados")
+        except Exception as e:
+            print(f"[!] No se pudieron arrancar los procesos G2P ({language}), se usará G2P en proceso: {e}")
+
+def phonemize_batches(chunks, language):
+    """Fonemas de varios fragmentos de texto, repartidos entre los procesos G2P del idioma"""
+    pool = g2p_pools.get(language)
+    if pool is None:
+        return phonemize_in_process(chunks, language)
+    
+    try:
+        increment_metric("g2p_worker_batches", len(chunks))
+        return list(pool.map(g2p_worker_phonemize, chunks, timeout=G2P_TIMEOUT))
+    except FuturesTimeoutError:
+        print(f"[!] G2P ({language}) superó {G2P_TIMEOUT}s en los procesos dedicados, se repite en proceso")
+        increment_metric("g2p_worker_errors")
+        return phonemize_in_process(chunks, language)
+    except BrokenProcessPool as e:
+        # No se vuelve a hacer fork desde un proceso con hilos: G2P en proceso a partir de aquí
+        print(f"[!] Procesos G2P ({language}) caídos, se usará G2P en proceso: {e}")
+        g2p_pools.pop(language, None)
+        increment_metric("g2p_worker_errors")
+        return phonemize_in_process(chunks, language)
+
+if G2P_WORKERS > 0:
+    start_g2p_workers()
+
+# Cargar modelo Kokoro v1.0 (variante por defecto del despliegue).
+# Después de arrancar los procesos G2P, que se crean con fork y no deben heredar el modelo.
+kokoro = None
+if PRELOAD_MODEL:
+    try:
+        kokoro = get_kokoro(MODEL_PRECISION)
+    except Exception as e:
+        print(f"[!] Error al cargar Kokoro v1.0 ({MODEL_PRECISION}): {e}")
+
+# Métricas del servicio (contadores expuestos en /metrics)
+metrics = {}
+metrics_lock = threading.Lock()
+
+def increment_metric(name, value=1):
+    """Incrementa un contador de métricas de forma segura entre hilos"""
+    with metrics_lock:
+        metrics[name] = metrics.get(name, 0) + value
+
+class LRUCache:
+    """Caché LRU segura entre hilos con límite de tamaño en bytes"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            self.entries.move_to_end(key)
+            return item[0]
+    
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+# Caché de respuestas de audio codificado, indexada por clave de síntesis
+audio_cache = LRUCache(int(AUDIO_CACHE_MAX_MB * 1024 * 1024))
+
+class SingleFlight:
+    """Coalescencia de cálculos en curso: llamadas concurrentes con la misma clave
+    esperan al primer cálculo y reciben su mismo resultado (o excepción)"""
+    
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+    
+    def do(self, key, func):
+        """Ejecuta func() una sola vez por clave en curso; devuelve (resultado, compartido)"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+        
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        
+        try:
+            call["result"] = func()
         except Exception as e:
-            print(f"[!] Error creando G2P para {language}: {e}")
-            # Fallback a inglés
-            fallback = espeak.EspeakFallback(british=False)
-            g2p_processors[language] = EspeakG2P(language="en")
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+        
+        return call["result"], False
+    
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+# Síntesis en curso indexadas por clave de síntesis
+synthesis_flight = SingleFlight()
+
+# Buffer circular en memoria compartida: con output=shm la respuesta lleva solo el handle del audio
+shm_ring = None
+if SHM_RING_SIZE_MB > 0:
+    try:
+        # Un segmento por proceso: varios workers o réplicas en el mismo host no comparten buffer
+        shm_ring = ShmRingWriter(f"{SHM_RING_NAME}_{os.getpid()}", int(SHM_RING_SIZE_MB * 1024 * 1024))
+        atexit.register(shm_ring.close)
+        print(f"[*] Canal de audio en memoria compartida: /dev/shm/{shm_ring.name} ({SHM_RING_SIZE_MB:g} MB)")
+    except Exception as e:
+        print(f"[!] No se pudo crear el canal de memoria compartida: {e}")
+
+def write_to_shm_ring(result):
+    """Copia el audio codificado al buffer circular y devuelve su handle"""
+    handle = shm_ring.write(result["data"])
+    increment_metric("shm_ring_writes")
+    increment_metric("shm_ring_bytes", len(result["data"]))
+    return handle
+
+# Caché de fonemas: evita repetir G2P (espeak) para textos ya procesados
+phoneme_cache = LRUCache(int(PHONEME_CACHE_MAX_MB * 1024 * 1024))
+
+def lexicon_key(phrase):
+    return " ".join(str(phrase).lower().split())
+
+class PronunciationLexicon:
+    """Léxico de pronunciación de un idioma compilado en un trie de caracteres
+    
+    Las entradas (palabra o frase -> fonemas) se comparan sin distinguir
+    mayúsculas y solo en límites de palabra; dentro de una frase cualquier
+    secuencia de espacios equivale a uno. Gana siempre la coincidencia más larga.
+    """
+    
+    def __init__(self, entries):
+        self.entries = {}
+        self.root = {}
+        for phrase, phonemes in entries.items():
+            key = lexicon_key(phrase)
+            phonemes = str(phonemes).strip()
+            if not key or not phonemes:
+                continue
+            self.entries[key] = phonemes
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            node[None] = phonemes  # Fin de entrada
+        payload = json.dumps(self.entries, ensure_ascii=False, sort_keys=True)
+        self.version = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+    
+    def match(self, text, start):
+        """Coincidencia más larga desde start que acaba en límite de palabra: (fin, fonemas) o None"""
+        node = self.root
+        best = None
+        i = start
+        while i < len(text):
+            if text[i].isspace():
+                node = node.get(" ")
+                while i < len(text) and text[i].isspace():
+                    i += 1
+            else:
+                node = node.get(text[i].lower())
+                i += 1
+            if node is None:
+                break
+            if None in node and not text[i - 1].isspace() and (i == len(text) or not text[i].isalnum()):
+                best = (i, node[None])
+        return best
+    
+    def split(self, text):
+        """Divide el texto en una pasada: lista de (fragmento, None) sin entradas y (fragmento, fonemas)"""
+        segments = []
+        plain_start = i = 0
+        while i < len(text):
+            if not text[i].isspace() and (i == 0 or not text[i - 1].isalnum()):
+                found = self.match(text, i)
+                if found:
+                    end, phonemes = found
+                    if plain_start < i:
+                        segments.append((text[plain_start:i], None))
+                    segments.append((text[i:end], phonemes))
+                    i = plain_start = end
+                    continue
+            i += 1
+        if plain_start < len(text):
+            segments.append((text[plain_start:], None))
+        return segments
+
+# Léxicos compilados por idioma; se sustituyen completos al recargar (lectura sin locks)
+lexicons = {}
+lexicons_lock = threading.Lock()
+
+def get_lexicon_path(language):
+    return os.path.join(LEXICON_DIR, f"{os.path.basename(language)}.json")
+
+def load_lexicons():
+    """Carga y compila todos los léxicos de LEXICON_DIR; devuelve {idioma: entradas}"""
+    loaded = {}
+    if os.path.isdir(LEXICON_DIR):
+        for filename in sorted(os.listdir(LEXICON_DIR)):
+            if not filename.endswith(".json"):
+                continue
+            language = filename[:-len(".json")]
+            try:
+                with open(os.path.join(LEXICON_DIR, filename), encoding="utf-8") as f:
+                    lexicon = PronunciationLexicon(json.load(f))
+                if lexicon.entries:
+                    loaded[language] = lexicon
+            except Exception as e:
+                print(f"[!] Error cargando léxico {filename}: {e}")
+    
+    with lexicons_lock:
+        for language in set(lexicons) - set(loaded):
+            lexicons.pop(language, None)
+        lexicons.update(loaded)
+    for language, lexicon in loaded.items():
+        print(f"[*] Léxico de pronunciación ({language}): {len(lexicon.entries)} entradas, versión {lexicon.version}")
+    return {language: len(lexicon.entries) for language, lexicon in loaded.items()}
+
+def update_lexicon(language, entries, replace=False):
+    """Añade (o sustituye) entradas del léxico de un idioma y lo persiste en LEXICON_DIR"""
+    with lexicons_lock:
+        current = lexicons.get(language)
+        merged = {} if replace or current is None else dict(current.entries)
+        # Una entrada con fonemas vacíos elimina la palabra del léxico
+        merged.update((lexicon_key(phrase), phonemes) for phrase, phonemes in entries.items())
+        lexicon = PronunciationLexicon(merged)
+        
+        os.makedirs(LEXICON_DIR, exist_ok=True)
+        path = get_lexicon_path(language)
+        with open(f"{path}.part", "w", encoding="utf-8") as f:
+            json.dump(lexicon.entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(f"{path}.part", path)
+        if lexicon.entries:
+            lexicons[language] = lexicon
+        else:
+            lexicons.pop(language, None)
+    
+    increment_metric("lexicon_updates")
+    return lexicon
+
+def get_lexicon_version(language):
+    lexicon = lexicons.get(language)
+    return lexicon.version if lexicon else None
+
+def g2p_text(text, language):
+    """G2P de un texto; los largos van en lotes de G2P_BATCH_SENTENCES frases a los procesos G2P"""
+    sentences = [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+    if g2p_pools.get(language) and len(sentences) > G2P_BATCH_SENTENCES:
+        chunks = [" ".join(sentences[i:i + G2P_BATCH_SENTENCES])
+                  for i in range(0, len(sentences), G2P_BATCH_SENTENCES)]
+    else:
+        chunks = [text]
+    return " ".join(p for p in phonemize_batches(chunks, language) if p)
+
+def phonemize_text(text, language):
+    """Convierte texto a fonemas con el léxico y el G2P del idioma, usando la caché de fonemas
     
-    return g2p_processors[language]
+    Las palabras y frases del léxico se sustituyen por sus fonemas y nunca
+    llegan a espeak; la versión del léxico forma parte de la clave de caché.
+    """
+    lexicon = lexicons.get(language)
+    key = (language, text, lexicon.version if lexicon else None)
+    phonemes = phoneme_cache.get(key)
+    if phonemes is not None:
+        increment_metric("phoneme_cache_hits")
+        return phonemes
+    increment_metric("phoneme_cache_misses")
+    
+    phonemes = ""
+    previous = ""
+    for segment, segment_phonemes in (lexicon.split(text) if lexicon else [(text, None)]):
+        if segment_phonemes is not None:
+            increment_metric("lexicon_matches")
+        elif segment.strip():
+            segment_phonemes = g2p_text(segment.strip(), language)
+        # Se respeta la separación del texto: "Kokoro." no lleva espacio antes del punto
+        if segment_phonemes:
+            if phonemes and (previous[-1:].isspace() or segment[:1].isspace()):
+                phonemes += " "
+            phonemes += segment_phonemes
+        previous = segment
+    phoneme_cache.put(key, phonemes, len(text.encode("utf-8")) + len(phonemes.encode("utf-8")))
+    return phonemes
+
+load_lexicons()
+
+# Caché de audio (float32) por segmento, indexada por segmento + voz + velocidad + contexto
+segment_cache = LRUCache(int(SEGMENT_CACHE_MAX_MB * 1024 * 1024))
+
+# Caché caliente en disco: clave de síntesis -> audio prerenderizado (prerender.py)
+warm_cache_index = {}
+
+def resolve_inside(base, path):
+    """Ruta absoluta de path relativa a base, o None si sale de base (.., rutas absolutas o enlaces)"""
+    base = os.path.realpath(base)
+    resolved = os.path.realpath(os.path.join(base, path))
+    return resolved if os.path.commonpath([base, resolved]) == base else None
+
+def load_warm_cache(directory):
+    """Importa el índice de un directorio de prerender.py como caché caliente"""
+    index_path = os.path.join(directory, "index.jsonl")
+    loaded = 0
+    with open(index_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            # Un índice manipulado no puede servir archivos de fuera del directorio
+            path = resolve_inside(directory, entry["file"])
+            if path is None:
+                print(f"[!] Caché caliente: se ignora {entry['file']} (fuera de {directory})")
+                continue
+            if os.path.exists(path):
+                warm_cache_index[entry["key"]] = dict(entry, path=path)
+                loaded += 1
+    print(f"[*] Caché caliente: {loaded} audios importados desde {directory}")
+    return loaded
+
+def get_warm_cached_audio(key):
+    """Lee un audio prerenderizado de la caché caliente (None si no existe)"""
+    entry = warm_cache_index.get(key)
+    if entry is None:
+        return None
+    try:
+        with open(entry["path"], "rb") as f:
+            audio_bytes = f.read()
+    except OSError:
+        warm_cache_index.pop(key, None)
+        return None
+    return {
+        "data": audio_bytes,
+        "sample_rate": entry["sample_rate"],
+        "duration": entry["duration"],
+        "format": entry["format"],
+        "cacheable": True
+    }
+
+# Formatos de salida soportados: formato de soundfile, tipo MIME y subtipo de muestra
+# 'pcm' es PCM crudo 16-bit little-endian mono, sin cabecera (útil por RPC)
+AUDIO_FORMATS = {
+    'wav': ('WAV', 'audio/wav', None),
+    'flac': ('FLAC', 'audio/flac', None),
+    'ogg': ('OGG', 'audio/ogg', None),
+    'pcm': ('RAW', 'application/octet-stream', 'PCM_16')
+}
+
+# Formatos cuyo codificador no produce bytes idénticos entre ejecuciones (OGG usa un número de
+# serie de stream aleatorio): su ETag es débil, equivalente semánticamente pero no byte a byte
+WEAK_ETAG_FORMATS = {'ogg'}
 
 app = Flask(__name__)
 
@@ -104,6 +863,18 @@ LANGUAGE_MAP = {
     'zh': 'z'   # Mandarin Chinese
 }
 
+# Frases de calentamiento de los modelos recargados, en el idioma que soportan
+WARMUP_TEXTS = {
+    'es': 'Hola.',
+    'en': 'Hello.',
+    'fr': 'Bonjour.',
+    'it': 'Ciao.',
+    'pt': 'Olá.',
+    'hi': 'नमस्ते।',
+    'ja': 'こんにちは。',
+    'zh': '你好。'
+}
+
 # Voces disponibles en Kokoro v1.0 organizadas por idioma
 AVAILABLE_VOICES = {
     'es': [  # Español
@@ -217,189 +988,1639 @@ def get_optimal_voice_for_language(language, voice=None, gender_preference=None)
     # Fallback final
     return DEFAULT_VOICE
 
-def synthesize_with_kokoro_v1(text, language="es", voice="ef_dora", speed=1.0):
-    """Sintetiza audio usando Kokoro v1.0 con ONNX Runtime"""
-    try:
-        if kokoro is None:
-            raise Exception("Kokoro v1.0 no disponible")
-        
-        print(f"[DEBUG] Sintetizando con Kokoro v1.0: lang={language}, voice={voice}, speed={speed}")
+class CostModel:
+    """Modelo de coste de la inferencia calibrado con las ejecuciones observadas
+    
+    Tiempo de cómputo: regresión lineal segundos = base + pendiente * (fonemas / speed),
+    ajustada por mínimos cuadrados con estadísticos que decaen exponencialmente
+    (las observaciones recientes pesan más). Hasta tener datos suficientes se
+    usan los valores a priori de la configuración.
+    Memoria pico: base + activaciones de un lote de inferencia (kokoro_onnx
+    infiere en lotes de como máximo BATCH_PHONEMES fonemas) + el audio
+    completo en float32.
+    """
+    
+    DECAY = 0.98
+    MIN_OBSERVATIONS = 5
+    BATCH_PHONEMES = 510
+    
+    def __init__(self, base_seconds, seconds_per_phoneme):
+        self.prior_base = base_seconds
+        self.prior_slope = seconds_per_phoneme
+        self.phonemes_per_char = 1.0
+        self.samples_per_phoneme = 1500.0  # ~62ms por fonema a 24kHz
+        self.sums = [0.0] * 5  # n, x, y, xx, xy
+        self.observations = 0
+        self.lock = threading.Lock()
+    
+    def estimate_phonemes(self, text=None, phonemes=None):
+        """Número de fonemas (exacto si ya hay fonemas, estimado desde el texto si no)"""
+        if phonemes:
+            return len(phonemes)
+        with self.lock:
+            return int(len(text or "") * self.phonemes_per_char)
+    
+    def coefficients(self):
+        with self.lock:
+            n, x, y, xx, xy = self.sums
+            variance = n * xx - x * x
+            if self.observations < self.MIN_OBSERVATIONS or variance <= 1e-9:
+                return self.prior_base, self.prior_slope
+            slope = (n * xy - x * y) / variance
+            base = (y - slope * x) / n
+            if slope <= 0:
+                return self.prior_base, self.prior_slope
+            return max(0.0, base), slope
+    
+    def estimate(self, n_phonemes, speed=1.0):
+        """Predicción de segundos de cómputo y memoria pico (MB) para una inferencia"""
+        base, slope = self.coefficients()
+        effective = n_phonemes / max(speed, 0.1)
+        samples = effective * self.samples_per_phoneme
+        # Las activaciones solo dependen del lote más largo, no del texto completo
+        batch_samples = min(n_phonemes, self.BATCH_PHONEMES) / max(speed, 0.1) * self.samples_per_phoneme
+        return {
+            "phonemes": n_phonemes,
+            "seconds": base + slope * effective,
+            "memory_mb": COST_BASE_MEMORY_MB + (batch_samples * COST_BYTES_PER_SAMPLE + samples * 4) / (1024 * 1024)
+        }
+    
+    def observe_g2p(self, n_chars, n_phonemes):
+        if n_chars:
+            with self.lock:
+                self.phonemes_per_char = 0.9 * self.phonemes_per_char + 0.1 * (n_phonemes / n_chars)
+    
+    def observe_inference(self, n_phonemes, speed, seconds, n_samples):
+        effective = n_phonemes / max(speed, 0.1)
+        with self.lock:
+            self.sums = [value * self.DECAY for value in self.sums]
+            n, x, y, xx, xy = self.sums
+            self.sums = [n + 1, x + effective, y + seconds, xx + effective * effective, xy + effective * seconds]
+            self.observations += 1
+            if effective:
+                self.samples_per_phoneme = 0.9 * self.samples_per_phoneme + 0.1 * (n_samples / effective)
+    
+    def stats(self):
+        base, slope = self.coefficients()
+        with self.lock:
+            return {
+                "observations": self.observations,
+                "base_seconds": base,
+                "seconds_per_phoneme": slope,
+                "phonemes_per_char": self.phonemes_per_char,
+                "samples_per_phoneme": self.samples_per_phoneme
+            }
+
+class InferenceScheduler:
+    """Cola de inferencias con prioridad shortest-job-first
+    
+    Limita las inferencias simultáneas a `slots`. Las peticiones esperan en un
+    heap ordenado por (clase, coste estimado): el tráfico interactivo (clase 0)
+    pasa antes que los trabajos en segundo plano (clase 1) y, dentro de cada
+    clase, las inferencias más cortas primero.
+    """
+    
+    def __init__(self, slots):
+        self.slots = slots
+        self.active = 0
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def slot(self, cost, background=False):
+        if self.slots <= 0:
+            yield
+            return
         
-        # Obtener procesador G2P para el idioma
-        g2p = get_g2p_processor(language)
+        entry = (1 if background else 0, cost, next(self.sequence))
+        start = time.time()
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+            while self.active >= self.slots or self.queue[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.queue)
+            self.active += 1
+            # Puede quedar hueco para el siguiente de la cola
+            self.condition.notify_all()
+        increment_metric("scheduler_wait_ms", int((time.time() - start) * 1000))
         
-        # Convertir texto a fonemas
-        phonemes, _ = g2p(text)
-        print(f"[DEBUG] Fonemas generados: {phonemes[:100]}...")
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+    
+    def stats(self):
+        with self.condition:
+            return {
+                "slots": self.slots,
+                "active": self.active,
+                "queued": len(self.queue)
+            }
+
+class TenantBudgets:
+    """Presupuesto de cómputo por tenant (token bucket de segundos estimados por minuto)"""
+    
+    def __init__(self, seconds_per_minute):
+        self.capacity = seconds_per_minute
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_prune = time.time()
+    
+    def prune(self, now, refill_rate):
+        """Elimina los cubos ya rellenados (equivalen a un tenant sin cubo); llamar con el lock"""
+        self.buckets = {
+            tenant: (tokens, last) for tenant, (tokens, last) in self.buckets.items()
+            if tokens + (now - last) * refill_rate < self.capacity
+        }
+        self.last_prune = now
+    
+    def consume(self, tenant, cost):
+        """Descuenta el coste; devuelve (permitido, segundos hasta poder reintentar)"""
+        if self.capacity <= 0:
+            return True, 0
         
-        # Generar audio usando Kokoro v1.0
-        samples, sample_rate = kokoro.create(phonemes, voice, is_phonemes=True, speed=speed)
+        now = time.time()
+        refill_rate = self.capacity / 60.0
+        with self.lock:
+            # Sin esto el dict crecería con cada tenant visto (p. ej. X-Tenant-Id arbitrarios)
+            if now - self.last_prune >= 60:
+                self.prune(now, refill_rate)
+            tokens, last = self.buckets.get(tenant, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * refill_rate)
+            # Una petición más cara que el presupuesto completo solo pasa con el cubo lleno
+            required = min(cost, self.capacity)
+            if tokens < required:
+                self.buckets[tenant] = (tokens, now)
+                return False, (required - tokens) / refill_rate
+            self.buckets[tenant] = (tokens - cost, now)
+            return True, 0
+
+cost_model = CostModel(COST_BASE_SECONDS, COST_SECONDS_PER_PHONEME)
+inference_scheduler = InferenceScheduler(INFERENCE_CONCURRENCY)
+tenant_budgets = TenantBudgets(TENANT_BUDGET_SECONDS)
+
+# Marca los hilos de trabajos en segundo plano (menor prioridad en el planificador)
+scheduling_context = threading.local()
+
+class CircuitOpenError(Exception):
+    """El circuito de Kokoro está abierto: se usa el fallback sin intentar la inferencia"""
+
+class CircuitBreaker:
+    """Circuit breaker alrededor de la inferencia de Kokoro
+    
+    closed: las peticiones pasan; tras failure_threshold fallos seguidos se abre.
+    open: las peticiones se rechazan (fallback inmediato) durante reset_timeout.
+    half_open: se deja pasar una única petición de prueba; si funciona se cierra,
+    si falla se vuelve a abrir.
+    """
+    
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.last_error = None
+        self.lock = threading.Lock()
+    
+    def refresh_state(self):
+        """Pasa de open a half_open cuando vence reset_timeout (llamar con el lock tomado)"""
+        if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+    
+    def allow_request(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            self.refresh_state()
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print(f"[*] Circuito {self.name} cerrado: Kokoro recuperado")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+    
+    def record_failure(self, error):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[!] Circuito {self.name} abierto tras {self.consecutive_failures} fallos: {error}")
+                self.state = "open"
+                self.opened_at = time.time()
+    
+    def status(self):
+        # Sin peticiones el circuito no saldría de open: /health refleja que ya admite una prueba
+        with self.lock:
+            self.refresh_state()
+            data = {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "last_error": self.last_error
+            }
+            if self.state == "open":
+                data["retry_in"] = max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+            return data
+
+# Un circuito por variante de modelo: un fallo de fp16 no degrada fp32
+kokoro_breakers = {
+    name: CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+    for name in MODEL_VARIANTS
+}
+
+def synthesize_kokoro(text, language="es", voice="ef_dora", speed=1.0, precision=None, phonemes=None):
+    """Sintetiza audio con Kokoro v1.0 sin fallback (propaga los errores)
+    
+    Si se proporcionan fonemas se omite el G2P (espeak) por completo.
+    Con el circuito abierto lanza CircuitOpenError sin intentar la inferencia.
+    """
+    precision = precision or MODEL_PRECISION
+    breaker = kokoro_breakers[precision]
+    if not breaker.allow_request():
+        increment_metric("circuit_breaker_rejections")
+        raise CircuitOpenError(f"Circuito de Kokoro ({precision}) abierto")
+    
+    try:
+        # Si el modelo no se cargó, las pruebas del circuito reintentan la carga
+        model = get_kokoro(precision)
         
-        print(f"[DEBUG] Audio generado: {len(samples)} muestras a {sample_rate}Hz")
+        print(f"[DEBUG] Sintetizando con Kokoro v1.0: lang={language}, voice={voice}, speed={speed}, precision={precision}")
         
-        return samples, sample_rate
+        if phonemes is None:
+            # Convertir texto a fonemas con el G2P del idioma
+            phonemes = phonemize_text(text, language)
+            cost_model.observe_g2p(len(text), len(phonemes))
+            print(f"[DEBUG] Fonemas generados: {phonemes[:100]}...")
+        else:
+            print(f"[DEBUG] Fonemas recibidos: {phonemes[:100]}...")
         
+        # Esperar turno en la cola shortest-job-first y generar audio usando Kokoro v1.0
+        estimate = cost_model.estimate(len(phonemes), speed)
+        background = getattr(scheduling_context, "background", False)
+        with inference_scheduler.slot(estimate["seconds"], background):
+            start = time.time()
+            samples, sample_rate = model.create(phonemes, voice, is_phonemes=True, speed=speed)
+            elapsed = time.time() - start
+        cost_model.observe_inference(len(phonemes), speed, elapsed, len(samples))
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    
+    breaker.record_success()
+    print(f"[DEBUG] Audio generado: {len(samples)} muestras a {sample_rate}Hz")
+    
+    return samples, sample_rate
+
+def synthesize_with_kokoro_v1(text, language="es", voice="ef_dora", speed=1.0, precision=None, phonemes=None):
+    """Sintetiza audio usando Kokoro v1.0 con ONNX Runtime"""
+    try:
+        return synthesize_kokoro(text, language, voice, speed, precision, phonemes)
     except Exception as e:
         print(f"[!] Error en Kokoro v1.0: {e}")
         # Fallback a síntesis simple
-        return synthesize_fallback(text, speed)
+        return synthesize_fallback(text, speed, language)
 
-def synthesize_fallback(text, speed=1.0):
-    """Síntesis de respaldo usando espeak (más básica pero funcional)"""
-    import subprocess
+# Voces de espeak-ng para cada idioma del servicio
+ESPEAK_VOICES = {
+    'es': 'es',
+    'en': 'en-us',
+    'fr': 'fr',
+    'it': 'it',
+    'pt': 'pt-br',
+    'hi': 'hi',
+    'ja': 'ja',
+    'zh': 'cmn'
+}
+
+class EspeakFallbackEngine:
+    """Motor espeak-ng persistente dentro del proceso (libespeak-ng vía ctypes)
     
-    try:
-        # Usar espeak como fallback
-        temp_file = tempfile.mktemp(suffix=".wav")
-        cmd = [
-            "espeak", 
-            "-s", str(int(175 * speed)),  # Velocidad
-            "-v", "es",  # Idioma español
-            "-w", temp_file,  # Output file
-            text
-        ]
+    Se inicializa una sola vez y sintetiza en memoria, sin lanzar procesos ni
+    escribir archivos temporales. libespeak-ng no es reentrante, así que las
+    síntesis se serializan con un lock.
+    """
+    
+    AUDIO_OUTPUT_SYNCHRONOUS = 0x02
+    ESPEAK_CHARS_UTF8 = 1
+    ESPEAK_RATE = 1
+    
+    def __init__(self):
+        self.lib = None
+        self.sample_rate = None
+        self.init_error = None
+        self.chunks = []
+        self.lock = threading.Lock()
+    
+    def initialize(self):
+        import ctypes
+        import ctypes.util
+        
+        library = ctypes.util.find_library("espeak-ng") or "libespeak-ng.so.1"
+        lib = ctypes.CDLL(library)
         
-        subprocess.run(cmd, check=True, capture_output=True)
+        sample_rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, None, 0)
+        if sample_rate <= 0:
+            raise RuntimeError(f"espeak_Initialize falló ({sample_rate})")
         
-        # Leer el archivo generado
-        audio_data, sample_rate = sf.read(temp_file)
-        os.unlink(temp_file)
+        # Mantener referencia al callback para que no lo libere el recolector
+        callback_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+        self.callback = callback_type(self.on_audio)
+        lib.espeak_SetSynthCallback(self.callback)
+        
+        lib.espeak_Synth.argtypes = [
+            ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p
+        ]
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        
+        self.lib = lib
+        self.sample_rate = sample_rate
+        print(f"[*] Fallback espeak-ng en proceso inicializado ({library}, {sample_rate}Hz)")
+    
+    def on_audio(self, wav, num_samples, events):
+        if num_samples > 0:
+            self.chunks.append(np.ctypeslib.as_array(wav, shape=(num_samples,)).copy())
+        return 0
+    
+    def synthesize(self, text, language="es", speed=1.0):
+        with self.lock:
+            if self.lib is None:
+                # Un fallo de inicialización se recuerda: no se reintenta en cada petición
+                if self.init_error is not None:
+                    raise RuntimeError(self.init_error)
+                try:
+                    self.initialize()
+                except Exception as e:
+                    self.init_error = f"libespeak-ng no disponible: {e}"
+                    raise
+            
+            self.lib.espeak_SetVoiceByName(ESPEAK_VOICES.get(language, 'es').encode())
+            self.lib.espeak_SetParameter(self.ESPEAK_RATE, int(175 * speed), 0)
+            
+            self.chunks = []
+            data = text.encode("utf-8")
+            self.lib.espeak_Synth(data, len(data) + 1, 0, 0, 0, self.ESPEAK_CHARS_UTF8, None, None)
+            chunks, self.chunks = self.chunks, []
         
-        return audio_data, sample_rate
+        if not chunks:
+            return np.zeros(0, dtype=np.float32), self.sample_rate
+        return np.concatenate(chunks).astype(np.float32) / 32768.0, self.sample_rate
+    
+    def status(self):
+        return {
+            "engine": "espeak-ng (in-process)",
+            "initialized": self.lib is not None,
+            "sample_rate": self.sample_rate,
+            "error": self.init_error
+        }
+
+fallback_engine = EspeakFallbackEngine()
+
+def synthesize_fallback(text, speed=1.0, language="es"):
+    """Síntesis de respaldo usando espeak-ng en proceso (más básica pero funcional)"""
+    increment_metric("fallback_syntheses")
+    try:
+        return fallback_engine.synthesize(text, language, speed)
     except Exception as e:
         print(f"[!] Error en fallback: {e}")
         # Generar silencio como último recurso
         duration = len(text.split()) * 0.5  # ~0.5s por palabra
         sample_rate = 22050
-        silence = np.zeros(int(duration * sample_rate))
+        silence = np.zeros(int(duration * sample_rate), dtype=np.float32)
         return silence, sample_rate
 
-@app.route("/synthesize", methods=["POST"])
-def synthesize():
-    data = request.get_json()
+def parse_bool(value):
+    """Interpreta un booleano de JSON o de query string"""
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+def check_model_available(data, precision):
+    """Error (respuesta, código) si el modelo pedido no está en el registro o no tiene archivo
     
-    if not data or "text" not in data:
-        return jsonify({"error": "No text provided"}), 400
+    Una variante sin archivo no debe responder con audio de fallback ni
+    contar como fallo de su circuito. El modelo por defecto conserva el
+    fallback (servicio degradado).
+    """
+    if precision not in MODEL_VARIANTS:
+        field = "model" if data.get("model") else "precision"
+        return jsonify({"error": f"Unsupported {field}: {precision}"}), 400
+    if precision != MODEL_PRECISION and precision not in kokoro_models \
+            and not os.path.exists(MODEL_VARIANTS[precision]):
+        return jsonify({"error": f"Model not available: {precision}"}), 503
+    return None
+
+def parse_output(data, allow_shm=False):
+    """Salida del audio: en la respuesta (inline) o en el buffer de memoria compartida (shm)
+    
+    Solo /synthesize_json y RPC synthesize/batch entregan handles (allow_shm);
+    el resto de endpoints rechazan output=shm en lugar de ignorarlo.
+    Devuelve (salida, None) o (None, respuesta_de_error)
+    """
+    output = str(data.get("output", "inline")).lower()
+    if output not in ("inline", "shm"):
+        return None, (jsonify({"error": f"Unsupported output: {output}"}), 400)
+    if output == "shm" and not allow_shm:
+        return None, (jsonify({"error": "Shared memory output is only supported by /synthesize_json and RPC synthesize/batch"}), 400)
+    if output == "shm" and shm_ring is None:
+        return None, (jsonify({"error": "Shared memory output disabled (SHM_RING_SIZE_MB=0)"}), 400)
+    return output, None
+
+def parse_synthesis_params(data, allow_shm=False):
+    """Valida y normaliza los parámetros de síntesis (cuerpo JSON o query string)
+    
+    Devuelve (params, None) o (None, respuesta_de_error)
+    """
+    if not data or ("text" not in data and "phonemes" not in data):
+        return None, (jsonify({"error": "No text provided"}), 400)
 
-    text = data.get("text", "").strip()
-    if not text:
-        return jsonify({"error": "Empty text"}), 400
+    # Fonemas precalculados (p. ej. con /phonemize): evitan el G2P en cada síntesis
+    phonemes = data.get("phonemes")
+    if phonemes is not None:
+        if not isinstance(phonemes, str) or not phonemes.strip():
+            return None, (jsonify({"error": "Empty phonemes"}), 400)
+        phonemes = phonemes.strip()
+
+    text = (data.get("text") or "").strip()
+    if not text and phonemes is None:
+        return None, (jsonify({"error": "Empty text"}), 400)
 
     # Obtener parámetros
     language = data.get("language", DEFAULT_LANGUAGE)
     requested_voice = data.get("voice")
-    speed = float(data.get("speed", 1.0))
     gender_preference = data.get("gender_preference")  # 'female', 'male', o None
+    try:
+        speed = float(data.get("speed", 1.0))
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": f"Invalid speed: {data.get('speed')}"}), 400)
+    
+    # Modelo del registro: 'fp32', 'fp16', 'int8' o los definidos en MODELS_CONFIG
+    precision = resolve_model(data, language)
+    model_error = check_model_available(data, precision)
+    if model_error:
+        return None, model_error
+    
+    audio_format = str(data.get("format", "wav")).lower()
+    if audio_format not in AUDIO_FORMATS:
+        return None, (jsonify({"error": f"Unsupported format: {audio_format}"}), 400)
     
     # Seleccionar voz óptima para el idioma
     voice = get_optimal_voice_for_language(language, requested_voice, gender_preference)
     
-    print(f"[*] Sintetizando (Kokoro v1.0): '{text[:50]}...' [Lang: {language}, Voz: {voice}, Speed: {speed}]")
+    # Caché por segmentos (solo aplica a entrada de texto)
+    segment_cache_enabled = parse_bool(data.get("segment_cache", SEGMENT_CACHE)) and phonemes is None
+    
+    postprocess, postprocess_error = parse_postprocess(data.get("postprocess"))
+    if postprocess_error:
+        return None, (jsonify({"error": postprocess_error}), 400)
+    
+    output, output_error = parse_output(data, allow_shm)
+    if output_error:
+        return None, output_error
+    
+    return {
+        "text": text,
+        "phonemes": phonemes,
+        "language": language,
+        "voice": voice,
+        "speed": speed,
+        "precision": precision,
+        "format": audio_format,
+        "segment_cache": segment_cache_enabled,
+        "postprocess": postprocess,
+        "output": output
+    }, None
+
+def synthesis_cache_key(params):
+    """Clave determinista de una síntesis: mismo texto/voz/velocidad/formato/modelo -> mismo audio"""
+    fields = [
+        params["text"],
+        params.get("phonemes"),
+        params["language"],
+        params["voice"],
+        round(params["speed"], 3),
+        params["format"],
+        params.get("segment_cache", False),
+        get_model_version(params["precision"])
+    ]
+    # Sin postproceso ni léxico la clave no cambia (claves existentes de la caché caliente siguen siendo válidas)
+    if params.get("postprocess"):
+        fields.append(params["postprocess"])
+    if params.get("phonemes") is None and get_lexicon_version(params["language"]):
+        fields.append({"lexicon": get_lexicon_version(params["language"])})
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def synthesize_chunk(chunk, params):
+    """Sintetiza un fragmento que es texto o fonemas según la petición"""
+    if params.get("phonemes"):
+        return synthesize_kokoro(None, params["language"], params["voice"], params["speed"],
+                                 params["precision"], phonemes=chunk)
+    return synthesize_kokoro(chunk, params["language"], params["voice"], params["speed"], params["precision"])
+
+def split_text_into_segments(text):
+    """Divide un texto en segmentos de frase/cláusula con su contexto de puntuación
+    
+    Devuelve una lista de (segmento, contexto), donde el contexto es la
+    puntuación que cierra el segmento anterior: la entonación de un segmento
+    depende de ella, así que forma parte de la clave de caché.
+    """
+    segments = []
+    previous_punctuation = ""
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        for clause in CLAUSE_BOUNDARY.split(sentence.strip()):
+            clause = clause.strip()
+            if not clause:
+                continue
+            segments.append((clause, previous_punctuation))
+            previous_punctuation = clause[-1] if clause[-1] in ".!?;:,…" else ""
+    return segments
+
+def splice_segments(segments, sample_rate, crossfade_ms=SEGMENT_CROSSFADE_MS):
+    """Une segmentos de audio con un fundido cruzado lineal corto en cada unión"""
+    crossfade = int(sample_rate * crossfade_ms / 1000)
+    output = np.empty(sum(len(segment) for segment in segments), dtype=np.float32)
+    position = 0
+    
+    for segment in segments:
+        overlap = min(crossfade, position, len(segment))
+        if overlap:
+            fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            tail = output[position - overlap:position]
+            tail *= 1.0 - fade_in
+            tail += segment[:overlap] * fade_in
+        output[position:position + len(segment) - overlap] = segment[overlap:]
+        position += len(segment) - overlap
+    
+    return output[:position]
+
+# Postproceso vectorizado: opera sobre el buffer float32 in situ (vistas y operaciones con out=)
+NORMALIZE_MODES = ("peak", "lufs", "none")
+POSTPROCESS_FRAME_MS = 10  # Resolución de la detección de silencio
+LOUDNESS_BLOCK_MS = 100  # Bloques de 400 ms con solape del 75% = 4 bloques de 100 ms
+
+fade_ramps = {}
+
+def parse_postprocess(value):
+    """Opciones de postproceso de una petición: bool, dict con sobrescrituras o None (valor por defecto)
+    
+    Devuelve (opciones o None si no se aplica, error o None)
+    """
+    if value is None:
+        value = POSTPROCESS
+    if not isinstance(value, dict):
+        value = {} if parse_bool(value) else None
+    if value is None:
+        return None, None
+    
+    normalize = str(value.get("normalize", POSTPROCESS_NORMALIZE) or "none").lower()
+    if normalize not in NORMALIZE_MODES:
+        return None, f"Unsupported normalize: {normalize}"
+    try:
+        options = {
+            "trim": parse_bool(value.get("trim", POSTPROCESS_TRIM)),
+            "normalize": normalize,
+            "target": float(value.get("target", POSTPROCESS_LUFS if normalize == "lufs" else POSTPROCESS_PEAK_DB)),
+            "fade_ms": float(value.get("fade_ms", POSTPROCESS_FADE_MS)),
+            "pause_ms": float(value.get("pause_ms", POSTPROCESS_PAUSE_MS))
+        }
+    except (TypeError, ValueError):
+        return None, "Invalid postprocess options"
+    if not 0 <= options["fade_ms"] <= 1000 or options["pause_ms"] < 0:
+        return None, "Invalid postprocess options"
+    return options, None
+
+def frame_peaks(audio, frame):
+    """Pico absoluto por trama (un valor por trama, sin copiar el buffer)"""
+    count = len(audio) // frame
+    frames = audio[:count * frame].reshape(count, frame)
+    peaks = np.maximum(frames.max(axis=1), -frames.min(axis=1))
+    if len(audio) > count * frame:
+        tail = audio[count * frame:]
+        peaks = np.append(peaks, max(tail.max(), -tail.min()))
+    return peaks
+
+def move_samples(audio, destination, source, count):
+    """Desplaza muestras hacia el inicio por bloques sin solape (NumPy no necesita buffer temporal)"""
+    shift = source - destination
+    while count > 0:
+        step = min(shift, count)
+        audio[destination:destination + step] = audio[source:source + step]
+        destination += step
+        source += step
+        count -= step
+
+def limit_pauses(audio, silent, frame, max_frames):
+    """Acorta a max_frames tramas los silencios internos más largos; devuelve la nueva longitud"""
+    # Inicio y fin (en tramas) de cada racha de silencio
+    edges = np.flatnonzero(silent[1:] != silent[:-1]) + 1
+    starts = edges[silent[edges]]
+    ends = edges[~silent[edges]]
+    if len(starts):
+        ends = ends[ends > starts[0]]  # Silencio inicial: no es una pausa entre frases
+    
+    write = read = 0
+    for start, end in zip(starts, ends):  # Un silencio final sin cierre queda fuera
+        if end - start <= max_frames:
+            continue
+        keep = (start + max_frames) * frame
+        if write != read:
+            move_samples(audio, write, read, keep - read)
+        write += keep - read
+        read = end * frame
+    
+    if write != read:
+        move_samples(audio, write, read, len(audio) - read)
+    return write + len(audio) - read
+
+def block_powers(audio, sample_rate):
+    """Potencia media por bloque de LOUDNESS_BLOCK_MS (un valor por bloque, sin copiar el buffer)"""
+    block = int(sample_rate * LOUDNESS_BLOCK_MS / 1000)
+    count = len(audio) // block
+    frames = audio[:count * block].reshape(count, block)
+    return np.einsum("ij,ij->i", frames, frames) / block
+
+def loudness_from_powers(powers):
+    """Sonoridad integrada aproximada (LUFS) con la puerta de ITU-R BS.1770, sin filtro K"""
+    if len(powers) < 4:
+        power = float(np.mean(powers)) if len(powers) else 0.0
+        return -0.691 + 10 * np.log10(power) if power > 0 else None
+    
+    powers = np.convolve(powers, np.full(4, 0.25), mode="valid")
+    loudness = -0.691 + 10 * np.log10(np.maximum(powers, 1e-12))
+    
+    # Puerta absoluta (-70 LUFS) y relativa (-10 LU bajo la media de los bloques que la superan)
+    gated = powers[loudness > -70]
+    if not len(gated):
+        return None
+    gated = powers[loudness > -0.691 + 10 * np.log10(gated.mean()) - 10]
+    return -0.691 + 10 * np.log10(gated.mean())
+
+def integrated_loudness(audio, sample_rate):
+    if len(audio) < int(sample_rate * LOUDNESS_BLOCK_MS / 1000):
+        return loudness_from_powers([float(np.dot(audio, audio)) / len(audio)] if len(audio) else [])
+    return loudness_from_powers(block_powers(audio, sample_rate))
+
+def shape_audio(audio, sample_rate, options, trim_start=True, trim_end=True):
+    """Recorte del silencio inicial/final y control de pausas; devuelve una vista del buffer"""
+    frame = max(1, int(sample_rate * POSTPROCESS_FRAME_MS / 1000))
+    if not len(audio) or not (options["trim"] or options["pause_ms"] > 0):
+        return audio
+    
+    silent = frame_peaks(audio, frame) <= 10 ** (POSTPROCESS_SILENCE_DB / 20)
+    loud = np.flatnonzero(~silent)
+    if not len(loud):
+        return audio
+    
+    # Una trama de margen a cada lado: los fundidos actúan sobre ella
+    first, last = 0, len(silent) - 1
+    if options["trim"]:
+        if trim_start:
+            first = max(loud[0] - 1, 0)
+        if trim_end:
+            last = min(loud[-1] + 1, len(silent) - 1)
+        audio = audio[first * frame:(last + 1) * frame]
+    if options["pause_ms"] > 0:
+        max_frames = max(1, int(options["pause_ms"] / POSTPROCESS_FRAME_MS))
+        audio = audio[:limit_pauses(audio, silent[first:last + 1], frame, max_frames)]
+    return audio
+
+def normalization_gain(options, peak, loudness):
+    """Ganancia lineal de la normalización pedida a partir del pico y la sonoridad del audio"""
+    if options["normalize"] == "peak":
+        return 10 ** (options["target"] / 20) / peak if peak > 0 else 1.0
+    if options["normalize"] == "lufs":
+        gain = 10 ** ((options["target"] - loudness) / 20) if loudness is not None else 1.0
+        # El pico nunca supera POSTPROCESS_PEAK_DB
+        return min(gain, 10 ** (POSTPROCESS_PEAK_DB / 20) / peak) if peak > 0 else gain
+    return 1.0
+
+def apply_fades(audio, sample_rate, fade_ms, fade_in=True, fade_out=True):
+    fade = min(int(sample_rate * fade_ms / 1000), len(audio) // 2)
+    if fade <= 0:
+        return
+    ramp = fade_ramps.get(fade)
+    if ramp is None:
+        ramp = fade_ramps.setdefault(fade, np.linspace(0.0, 1.0, fade, dtype=np.float32))
+    if fade_in:
+        audio[:fade] *= ramp
+    if fade_out:
+        audio[-fade:] *= ramp[::-1]
+
+def writable_float32(audio):
+    audio = np.asarray(audio, dtype=np.float32)
+    return audio if audio.flags.writeable else audio.copy()
+
+def record_postprocess(start_time, removed_samples, sample_rate):
+    elapsed_ms = (time.time() - start_time) * 1000
+    increment_metric("postprocess_runs")
+    increment_metric("postprocess_ms", elapsed_ms)
+    increment_metric("postprocess_removed_seconds", removed_samples / sample_rate)
+    return elapsed_ms
+
+def postprocess_audio(audio, sample_rate, options):
+    """Recorte de silencio, control de pausas, normalización y fundidos sobre el buffer float32
+    
+    Devuelve (audio, milisegundos del postproceso). El audio resultante es
+    una vista del buffer original, modificado in situ.
+    """
+    start_time = time.time()
+    audio = writable_float32(audio)
+    original_length = len(audio)
+    
+    audio = shape_audio(audio, sample_rate, options)
+    if len(audio) and options["normalize"] != "none":
+        peak = float(max(audio.max(), -audio.min()))
+        loudness = integrated_loudness(audio, sample_rate) if options["normalize"] == "lufs" else None
+        np.multiply(audio, np.float32(normalization_gain(options, peak, loudness)), out=audio)
+    apply_fades(audio, sample_rate, options["fade_ms"])
+    
+    return audio, record_postprocess(start_time, original_length - len(audio), sample_rate)
+
+def segment_cache_key(segment, context, params):
+    payload = json.dumps([
+        segment,
+        context,
+        params["language"],
+        params["voice"],
+        round(params["speed"], 3),
+        get_model_version(params["precision"]),
+        get_lexicon_version(params["language"])
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def synthesize_segmented(params):
+    """Sintetiza solo los segmentos que no están en caché y los une con fundidos cruzados"""
+    audio_segments = []
+    sample_rate = None
+    
+    for segment, context in split_text_into_segments(params["text"]):
+        key = segment_cache_key(segment, context, params)
+        cached = segment_cache.get(key)
+        if cached is not None:
+            increment_metric("segment_cache_hits")
+            audio_data, segment_rate = cached
+        else:
+            increment_metric("segment_cache_misses")
+            audio_data, segment_rate = synthesize_chunk(segment, params)
+            audio_data = np.asarray(audio_data, dtype=np.float32)
+            segment_cache.put(key, (audio_data, segment_rate), audio_data.nbytes)
+        
+        sample_rate = sample_rate or segment_rate
+        audio_segments.append(audio_data)
+    
+    return splice_segments(audio_segments, sample_rate), sample_rate
+
+def encode_audio(audio_data, sample_rate, audio_format="wav"):
+    """Codifica muestras de audio en el formato de salida solicitado"""
+    audio_buffer = io.BytesIO()
+    sf.write(audio_buffer, audio_data, sample_rate, format=AUDIO_FORMATS[audio_format][0],
+             subtype=AUDIO_FORMATS[audio_format][2])
+    return audio_buffer.getvalue()
+
+def save_debug_audio(audio_bytes, prefix="kokoro_v1", extension="wav"):
+    """Guarda una copia del audio en el directorio de debug y devuelve su nombre"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    debug_filename = f"{prefix}_{timestamp}.{extension}"
+    with open(os.path.join(DEBUG_DIR, debug_filename), "wb") as f:
+        f.write(audio_bytes)
+    print(f"[DEBUG] Audio guardado: {debug_filename}")
+    return debug_filename
+
+def get_synthesized_audio(params, key=None):
+    """Devuelve el audio codificado para unos parámetros, usando la caché de respuestas
+    
+    El resultado es un dict con data, sample_rate, duration, format y cacheable.
+    El audio generado por el fallback no se cachea (no es el audio definitivo).
+    """
+    key = key or synthesis_cache_key(params)
+    
+    cached = audio_cache.get(key)
+    if cached is not None:
+        increment_metric("audio_cache_hits")
+        return cached
+    increment_metric("audio_cache_misses")
+    
+    # Audio prerenderizado offline (prerender.py)
+    warm = get_warm_cached_audio(key)
+    if warm is not None:
+        increment_metric("warm_cache_hits")
+        audio_cache.put(key, warm, len(warm["data"]))
+        return warm
+    
+    # Peticiones idénticas simultáneas esperan a una única inferencia
+    result, shared = synthesis_flight.do(key, lambda: render_audio(params, key))
+    if shared:
+        increment_metric("inferences_saved")
+    return result
+
+def render_audio(params, key):
+    """Sintetiza y codifica el audio de una petición, guardándolo en la caché si procede"""
+    cacheable = True
+    try:
+        if params.get("segment_cache"):
+            audio_data, sample_rate = synthesize_segmented(params)
+        else:
+            audio_data, sample_rate = synthesize_chunk(params.get("phonemes") or params["text"], params)
+    except Exception as e:
+        print(f"[!] Error en Kokoro v1.0: {e}")
+        # El fallback necesita texto: una petición solo con fonemas no tiene respaldo
+        if not params["text"]:
+            raise
+        audio_data, sample_rate = synthesize_fallback(params["text"], params["speed"], params["language"])
+        cacheable = False
+    
+    postprocess_ms = None
+    if params.get("postprocess"):
+        audio_data, postprocess_ms = postprocess_audio(audio_data, sample_rate, params["postprocess"])
+    
+    audio_bytes = encode_audio(audio_data, sample_rate, params["format"])
+    result = {
+        "data": audio_bytes,
+        "sample_rate": sample_rate,
+        "duration": len(audio_data) / sample_rate,
+        "format": params["format"],
+        "cacheable": cacheable,
+        "postprocess_ms": postprocess_ms
+    }
+    
+    if cacheable:
+        audio_cache.put(key, result, len(audio_bytes))
+    
+    if DEBUG_AUDIO:
+        result = dict(result, debug_filename=save_debug_audio(audio_bytes, extension=params["format"]))
+    
+    return result
+
+# Separadores de frase: puntuación final seguida de espacio, o saltos de párrafo
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:…])\s+|\n\s*\n')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:])\s+')
+
+def split_text_into_sentences(text, max_chars=LONGFORM_CHUNK_CHARS, merge=True):
+    """Divide un texto en fragmentos por frases, agrupando frases cortas hasta max_chars
+    
+    Las frases que superan max_chars se dividen por cláusulas y, en último
+    caso, por palabras. Con merge=False no se agrupan: cada frase es un
+    fragmento (streaming, donde importa la latencia del primer audio).
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in CLAUSE_BOUNDARY.split(sentence):
+            while len(clause) > max_chars:
+                cut = clause.rfind(' ', 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                pieces.append(clause[:cut].strip())
+                clause = clause[cut:].strip()
+            if clause:
+                pieces.append(clause)
+    if not merge:
+        return pieces
+    
+    # Agrupar fragmentos cortos para reducir el número de inferencias
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+def synthesize_file_chunk(chunk, params):
+    """Audio float32 de un fragmento de artefacto, con caché de segmentos si está activa"""
+    if params.get("segment_cache"):
+        return synthesize_segmented(dict(params, text=chunk))
+    return synthesize_chunk(chunk, params)
+
+def synthesize_to_file(params, path):
+    """Sintetiza un texto largo fragmento a fragmento, escribiendo el audio de forma progresiva"""
+    chunks = split_text_into_sentences(params.get("phonemes") or params["text"])
+    result = write_audio_chunks(params, path, (synthesize_file_chunk(chunk, params) for chunk in chunks), len(chunks))
+    return dict(result, chunks=len(chunks))
+
+def write_audio_chunks(params, path, audio_chunks, total):
+    """Escribe una secuencia de fragmentos (audio float32, sample_rate) en un archivo con el postproceso pedido
+    
+    Solo hay un fragmento en memoria a la vez. El archivo se escribe en
+    path + '.part' y se renombra al terminar, de modo que nunca se sirve
+    un archivo incompleto. Con postproceso se hacen dos pasadas: la
+    primera recorta cada fragmento y guarda las muestras float32 en
+    path + '.part.f32' midiendo pico y sonoridad del conjunto; la segunda
+    aplica la ganancia y los fundidos y codifica el archivo final.
+    """
+    options = params.get("postprocess")
+    partial_path = f"{path}.part"
+    raw_path = f"{partial_path}.f32"
+    audio_file = None
+    raw_file = None
+    frames = 0
+    removed = 0
+    peak = 0.0
+    powers = []
+    pending = np.zeros(0, dtype=np.float32)
+    postprocess_seconds = 0.0
+    sample_rate = None
+    
+    def open_audio_file():
+        return sf.SoundFile(partial_path, mode='w', samplerate=sample_rate, channels=1,
+                            format=AUDIO_FORMATS[params["format"]][0],
+                            subtype=AUDIO_FORMATS[params["format"]][2])
+    
+    try:
+        for i, (audio_data, sample_rate) in enumerate(audio_chunks):
+            
+            if options:
+                start_time = time.time()
+                audio_data = writable_float32(audio_data)
+                original_length = len(audio_data)
+                # Solo se recorta el silencio inicial del primer fragmento y el final del último
+                audio_data = shape_audio(audio_data, sample_rate, options,
+                                         trim_start=i == 0, trim_end=i == total - 1)
+                removed += original_length - len(audio_data)
+                if len(audio_data):
+                    peak = max(peak, float(max(audio_data.max(), -audio_data.min())))
+                if options["normalize"] == "lufs":
+                    # Los bloques de sonoridad continúan entre fragmentos
+                    pending = np.concatenate([pending, audio_data])
+                    block = int(sample_rate * LOUDNESS_BLOCK_MS / 1000)
+                    complete = len(pending) // block * block
+                    powers.append(block_powers(pending[:complete], sample_rate))
+                    pending = pending[complete:]
+                if raw_file is None:
+                    raw_file = open(raw_path, "wb")
+                audio_data.tofile(raw_file)
+                postprocess_seconds += time.time() - start_time
+            else:
+                if audio_file is None:
+                    audio_file = open_audio_file()
+                audio_file.write(audio_data)
+            
+            frames += len(audio_data)
+            print(f"[DEBUG] Fragmento {i + 1}/{total} escrito ({len(audio_data)} muestras)")
+        
+        if options:
+            start_time = time.time()
+            raw_file.close()
+            audio_file = open_audio_file()
+            if frames:
+                if len(pending):
+                    powers.append([float(np.dot(pending, pending)) / len(pending)])
+                loudness = loudness_from_powers(np.concatenate(powers)) if powers else None
+                gain = np.float32(normalization_gain(options, peak, loudness))
+                
+                raw = np.memmap(raw_path, dtype=np.float32, mode="r+")
+                apply_fades(raw, sample_rate, options["fade_ms"])
+                step = sample_rate * 10
+                for start in range(0, frames, step):
+                    audio_file.write(raw[start:start + step] * gain)
+                del raw
+            os.unlink(raw_path)
+            postprocess_seconds += time.time() - start_time
+            record_postprocess(time.time() - postprocess_seconds, removed, sample_rate)
+        
+        audio_file.close()
+        os.replace(partial_path, path)
+    except Exception:
+        if audio_file is not None and not audio_file.closed:
+            audio_file.close()
+        if raw_file is not None and not raw_file.closed:
+            raw_file.close()
+        for leftover in (partial_path, raw_path):
+            if os.path.exists(leftover):
+                os.unlink(leftover)
+        raise
+    
+    return {
+        "sample_rate": sample_rate,
+        "duration": frames / sample_rate
+    }
+
+def consume_tenant_budget(tenant, seconds):
+    """Descuenta segundos estimados del presupuesto del tenant; None o la respuesta 429"""
+    allowed, retry_after = tenant_budgets.consume(tenant, seconds)
+    if allowed:
+        return None
+    
+    increment_metric("admission_throttled")
+    response = jsonify({
+        "error": "Tenant compute budget exceeded",
+        "tenant": tenant,
+        "retry_after": retry_after
+    })
+    response.headers["Retry-After"] = str(int(retry_after) + 1)
+    return response, 429
+
+def check_admission(params, key, data, tenant=None):
+    """Control de admisión por coste estimado y presupuesto del tenant
+    
+    Devuelve None si la petición puede continuar, o la respuesta a enviar:
+    202 (derivada a un trabajo asíncrono), 413 (excede los límites) o
+    429 (presupuesto del tenant agotado). Las respuestas ya cacheadas no
+    consumen presupuesto. Sin tenant se usa la cabecera X-Tenant-Id.
+    """
+    if audio_cache.get(key) is not None or key in warm_cache_index:
+        return None
+    
+    estimate = cost_model.estimate(
+        cost_model.estimate_phonemes(params["text"], params.get("phonemes")), params["speed"]
+    )
+    
+    exceeded = []
+    # Las peticiones con fonemas llegan con text vacío: el límite se aplica a la entrada real
+    source = params.get("phonemes") or params["text"]
+    if len(source) > MAX_TEXT_CHARS:
+        exceeded.append(f"{'phonemes' if params.get('phonemes') else 'text'} length {len(source)} > {MAX_TEXT_CHARS}")
+    if estimate["seconds"] > MAX_REQUEST_SECONDS:
+        exceeded.append(f"estimated compute {estimate['seconds']:.1f}s > {MAX_REQUEST_SECONDS}s")
+    if estimate["memory_mb"] > MAX_REQUEST_MEMORY_MB:
+        exceeded.append(f"estimated memory {estimate['memory_mb']:.0f}MB > {MAX_REQUEST_MEMORY_MB}MB")
+    
+    if exceeded:
+        # Derivar al API de trabajos largos si el cliente lo acepta (o por configuración)
+        if parse_bool(data.get("allow_async", LONGFORM_DOWNGRADE)):
+            job = create_job(params)
+            increment_metric("admission_downgraded")
+            return jsonify(dict(job_status_data(job), estimate=estimate, reason=exceeded)), 202
+        
+        increment_metric("admission_rejected")
+        return jsonify({
+            "error": "Request exceeds limits",
+            "reason": exceeded,
+            "estimate": estimate,
+            "hint": "Use /jobs or set allow_async=true for long texts"
+        }), 413
+    
+    return consume_tenant_budget(tenant or request.headers.get("X-Tenant-Id", "default"), estimate["seconds"])
+
+def apply_cache_headers(response, etag, cacheable=True, weak=False):
+    """Añade ETag y Cache-Control a una respuesta de audio"""
+    if cacheable:
+        response.set_etag(etag, weak=weak)
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    else:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/synthesize", methods=["GET", "POST"])
+def synthesize():
+    """Devuelve el archivo de audio; GET permite que CDNs y proxies cacheen la respuesta"""
+    data = request.args.to_dict() if request.method == "GET" else request.get_json()
+    
+    params, error = parse_synthesis_params(data)
+    if error:
+        return error
+    
+    print(f"[*] Sintetizando (Kokoro v1.0): '{params['text'][:50]}...' [Lang: {params['language']}, Voz: {params['voice']}, Speed: {params['speed']}]")
+
+    # El ETag depende solo de los parámetros: un 304 no requiere sintetizar
+    key = synthesis_cache_key(params)
+    etag = key[:32]
+    weak_etag = params["format"] in WEAK_ETAG_FORMATS
+    # If-None-Match usa comparación débil (RFC 9110)
+    if request.if_none_match.contains_weak(etag):
+        increment_metric("not_modified_responses")
+        return apply_cache_headers(Response(status=304), etag, weak=weak_etag)
+    
+    rejection = check_admission(params, key, data)
+    if rejection:
+        return rejection
 
     try:
-        # Síntesis con Kokoro v1.0
-        audio_data, sample_rate = synthesize_with_kokoro_v1(text, language, voice, speed)
-        
-        # Generar archivo temporal
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        temp_path = tempfile.mktemp(suffix=".wav")
-        
-        # Guardar audio
-        sf.write(temp_path, audio_data, sample_rate)
-
-        # Guardar audio para debug si está activado
-        debug_filename = None
-        if DEBUG_AUDIO:
-            debug_filename = f"kokoro_v1_{timestamp}.wav"
-            debug_path = os.path.join(DEBUG_DIR, debug_filename)
-            shutil.copy2(temp_path, debug_path)
-            print(f"[DEBUG] Audio guardado: {debug_filename}")
-
-        # Enviar el archivo de audio
-        return send_file(temp_path, 
-                        mimetype="audio/wav", 
-                        as_attachment=True,
-                        download_name=f"kokoro_v1_{timestamp}.wav")
+        # Síntesis con Kokoro v1.0 (o desde caché)
+        result = get_synthesized_audio(params, key)
+        
+        audio_format = params["format"]
+        response = Response(result["data"], mimetype=AUDIO_FORMATS[audio_format][1])
+        response.headers["Content-Disposition"] = f"attachment; filename=kokoro_v1_{key[:16]}.{audio_format}"
+        return apply_cache_headers(response, etag, result["cacheable"], weak_etag)
 
     except Exception as e:
         print(f"[!] Error en síntesis: {e}")
         return jsonify({"error": str(e)}), 500
 
+ENVELOPE_METRICS = {
+    "application/json": "json",
+    "multipart/mixed": "multipart",
+    "application/octet-stream": "raw"
+}
+
+# Metadatos enviados como cabeceras cuando el cuerpo es el audio crudo
+ENVELOPE_HEADERS = {
+    "text": "X-Audio-Text",
+    "language": "X-Audio-Language",
+    "voice": "X-Audio-Voice",
+    "audio_duration": "X-Audio-Duration",
+    "sample_rate": "X-Audio-Sample-Rate",
+    "model": "X-Audio-Model",
+    "precision": "X-Audio-Precision",
+    "speed": "X-Audio-Speed",
+    "synthesis_ms": "X-Audio-Synthesis-Ms",
+    "postprocess_ms": "X-Audio-Postprocess-Ms",
+    "debug_audio_file": "X-Audio-Debug-File"
+}
+
+def negotiate_envelope(audio_format):
+    """Elige el sobre de respuesta de /synthesize_json según la cabecera Accept
+    
+    JSON con el audio en Base64 sigue siendo el valor por defecto (Accept
+    ausente o */*). Los sobres binarios evitan el +33% de Base64 y sus copias.
+    """
+    offers = ["application/json", "multipart/mixed", AUDIO_FORMATS[audio_format][1], "application/octet-stream"]
+    if msgpack is not None:
+        offers += ["application/msgpack", "application/x-msgpack"]
+    envelope = request.accept_mimetypes.best_match(offers, default="application/json")
+    return "application/octet-stream" if envelope == AUDIO_FORMATS[audio_format][1] else envelope
+
+def build_envelope_response(envelope, metadata, audio_bytes, audio_format):
+    """Construye la respuesta de /synthesize_json en el sobre negociado
+    
+    - application/json: metadatos + audio_data en Base64 (compatibilidad)
+    - multipart/mixed: parte JSON con metadatos + parte binaria con el audio
+    - audio crudo: el audio como cuerpo y los metadatos en cabeceras X-Audio-*
+    - application/msgpack: mapa con los metadatos y audio_data como bytes
+    
+    Los cuerpos binarios se envían como secuencia de fragmentos para no
+    copiar el audio en un único buffer.
+    """
+    mimetype = AUDIO_FORMATS[audio_format][1]
+    
+    if envelope == "multipart/mixed":
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\n"
+            f"Content-Type: application/json\r\n\r\n"
+            f"{json.dumps(metadata, ensure_ascii=False)}\r\n"
+            f"--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Length: {len(audio_bytes)}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        response = Response([head, audio_bytes, tail], content_type=f"multipart/mixed; boundary={boundary}")
+        response.headers["Content-Length"] = str(len(head) + len(audio_bytes) + len(tail))
+        return response
+    
+    if envelope == "application/octet-stream":
+        response = Response([audio_bytes], mimetype=mimetype)
+        response.headers["Content-Length"] = str(len(audio_bytes))
+        for field, header in ENVELOPE_HEADERS.items():
+            if metadata.get(field) is not None:
+                response.headers[header] = quote_header_value(metadata[field])
+        return response
+    
+    if envelope in ("application/msgpack", "application/x-msgpack"):
+        return Response(msgpack.packb(dict(metadata, audio_data=audio_bytes), use_bin_type=True),
+                        mimetype=envelope)
+    
+    import base64
+    return jsonify(dict(metadata, audio_data=base64.b64encode(audio_bytes).decode('utf-8')))
+
+def quote_header_value(value):
+    """Codifica un valor para una cabecera HTTP (percent-encoding si no es ASCII imprimible)"""
+    value = str(value)
+    return value if value.isascii() and value.isprintable() else urllib.parse.quote(value)
+
 @app.route("/synthesize_json", methods=["POST"])
 def synthesize_json():
     """Endpoint que devuelve respuesta JSON con metadata en lugar del archivo"""
     data = request.get_json()
     
-    if not data or "text" not in data:
-        return jsonify({"error": "No text provided"}), 400
+    params, error = parse_synthesis_params(data, allow_shm=True)
+    if error:
+        return error
+    
+    print(f"[*] Sintetizando JSON (Kokoro v1.0): '{params['text'][:50]}...' [Lang: {params['language']}, Voice: {params['voice']}]")
 
-    text = data.get("text", "").strip()
-    if not text:
-        return jsonify({"error": "Empty text"}), 400
+    key = synthesis_cache_key(params)
+    rejection = check_admission(params, key, data)
+    if rejection:
+        return rejection
 
-    # Obtener parámetros
-    language = data.get("language", DEFAULT_LANGUAGE)
-    requested_voice = data.get("voice")
-    speed = float(data.get("speed", 1.0))
-    gender_preference = data.get("gender_preference")
-    
-    # Seleccionar voz óptima
-    voice = get_optimal_voice_for_language(language, requested_voice, gender_preference)
-    
-    print(f"[*] Sintetizando JSON (Kokoro v1.0): '{text[:50]}...' [Lang: {language}, Voice: {voice}]")
+    envelope = negotiate_envelope(params["format"])
 
     try:
-        # Síntesis con Kokoro v1.0
-        audio_data, sample_rate = synthesize_with_kokoro_v1(text, language, voice, speed)
-        
-        # Calcular duración
-        duration = len(audio_data) / sample_rate
-
-        # Guardar audio para debug si está activado
-        debug_filename = None
-        if DEBUG_AUDIO:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-            debug_filename = f"kokoro_v1_{timestamp}.wav"
-            debug_path = os.path.join(DEBUG_DIR, debug_filename)
-            sf.write(debug_path, audio_data, sample_rate)
-            print(f"[DEBUG] Audio guardado: {debug_filename}")
-
-        # Convertir audio a Base64 para incluir en la respuesta JSON
-        import base64
-        import io
-        
-        # Guardar audio en buffer de memoria
-        audio_buffer = io.BytesIO()
-        sf.write(audio_buffer, audio_data, sample_rate, format='WAV')
-        audio_buffer.seek(0)
-        
-        # Convertir a Base64
-        audio_base64 = base64.b64encode(audio_buffer.getvalue()).decode('utf-8')
-        
-        response_data = {
+        # Síntesis con Kokoro v1.0 (o desde caché)
+        synthesis_start = time.time()
+        result = get_synthesized_audio(params, key)
+        synthesis_ms = (time.time() - synthesis_start) * 1000
+        
+        metadata = {
             "success": True,
-            "text": text,
-            "language": language,
-            "voice": voice,
-            "audio_duration": duration,
-            "sample_rate": sample_rate,
+            "text": params["text"],
+            "phonemes": params["phonemes"],
+            "language": params["language"],
+            "voice": params["voice"],
+            "audio_duration": result["duration"],
+            "sample_rate": result["sample_rate"],
             "model": "kokoro-v1.0",
-            "speed": speed,
-            "audio_data": audio_base64,  # Audio en Base64
-            "audio_format": "wav",
-            "audio_size_bytes": len(audio_buffer.getvalue())
+            "precision": params["precision"],
+            "speed": params["speed"],
+            "audio_format": result["format"],
+            "audio_size_bytes": len(result["data"]),
+            "synthesis_ms": synthesis_ms
         }
+        if result.get("postprocess_ms") is not None:
+            metadata["postprocess_ms"] = result["postprocess_ms"]
         
-        if DEBUG_AUDIO and debug_filename:
-            response_data["debug_audio_file"] = debug_filename
-            response_data["debug_audio_url"] = f"/debug/audio/{debug_filename}"
+        if DEBUG_AUDIO and result.get("debug_filename"):
+            metadata["debug_audio_file"] = result["debug_filename"]
+            metadata["debug_audio_url"] = f"/debug/audio/{result['debug_filename']}"
+        
+        # Solo el handle: el consumidor lee el audio del buffer de memoria compartida
+        if params["output"] == "shm":
+            try:
+                metadata["shm"] = write_to_shm_ring(result)
+            except ShmRingError as e:
+                return jsonify({"error": str(e)}), 413
+            return jsonify(metadata)
 
-        return jsonify(response_data)
+        increment_metric(f"envelope_{ENVELOPE_METRICS.get(envelope, 'msgpack')}_responses")
+        response = build_envelope_response(envelope, metadata, result["data"], params["format"])
+        response.headers["Vary"] = "Accept"
+        return response
 
     except Exception as e:
         print(f"[!] Error en síntesis: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/phonemize", methods=["POST"])
+def phonemize():
+    """Devuelve la salida G2P de uno o varios textos, para reutilizarla con el campo 'phonemes'"""
+    data = request.get_json()
+    
+    if not data or ("text" not in data and "texts" not in data):
+        return jsonify({"error": "No text provided"}), 400
+    
+    language = data.get("language", DEFAULT_LANGUAGE)
+    
+    try:
+        if "texts" in data:
+            texts = data.get("texts") or []
+            if not texts:
+                return jsonify({"error": "Empty texts array"}), 400
+            phonemes = [phonemize_text(text.strip(), language) for text in texts]
+            return jsonify({
+                "phonemes": phonemes,
+                "language": language,
+                "total_texts": len(texts)
+            })
+        
+        text = (data.get("text") or "").strip()
+        if not text:
+            return jsonify({"error": "Empty text"}), 400
+        
+        return jsonify({
+            "text": text,
+            "phonemes": phonemize_text(text, language),
+            "language": language
+        })
+    
+    except Exception as e:
+        print(f"[!] Error en G2P: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Bloqueos por artefacto para no sintetizar dos veces el mismo texto largo
+artifact_locks = {}
+artifact_locks_lock = threading.Lock()
+
+ARTIFACT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def get_artifact_paths(artifact_id, audio_format=None):
+    """Rutas del audio y de los metadatos de un artefacto"""
+    meta_path = os.path.join(ARTIFACTS_DIR, f"{artifact_id}.json")
+    audio_path = os.path.join(ARTIFACTS_DIR, f"{artifact_id}.{audio_format}") if audio_format else None
+    return audio_path, meta_path
+
+def artifact_response_data(metadata):
+    """Metadata pública de un artefacto"""
+    return dict(metadata, url=f"/artifacts/{metadata['artifact_id']}")
+
+@app.route("/artifacts", methods=["POST"])
+def create_artifact():
+    """Sintetiza un texto largo en un artefacto almacenado, descargable con HTTP Range"""
+    data = request.get_json()
+    
+    params, error = parse_synthesis_params(data)
+    if error:
+        return error
+    
+    artifact_id = synthesis_cache_key(params)[:32]
+    audio_path, meta_path = get_artifact_paths(artifact_id, params["format"])
+    
+    with artifact_locks_lock:
+        lock = artifact_locks.setdefault(artifact_id, threading.Lock())
+    
+    with lock:
+        # Reutilizar el artefacto si ya existe (sin volver a sintetizar)
+        if os.path.exists(meta_path) and os.path.exists(audio_path):
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            increment_metric("artifact_hits")
+            return jsonify(artifact_response_data(metadata))
+        
+        print(f"[*] Sintetizando artefacto {artifact_id}: {len(params['phonemes'] or params['text'])} caracteres [Lang: {params['language']}, Voz: {params['voice']}]")
+        
+        try:
+            result = synthesize_to_file(params, audio_path)
+        except Exception as e:
+            print(f"[!] Error en síntesis de artefacto: {e}")
+            return jsonify({"error": str(e)}), 500
+        
+        metadata = {
+            "artifact_id": artifact_id,
+            "format": params["format"],
+            "language": params["language"],
+            "voice": params["voice"],
+            "speed": params["speed"],
+            "precision": params["precision"],
+            "model_version": get_model_version(params["precision"]),
+            "chunks": result["chunks"],
+            "sample_rate": result["sample_rate"],
+            "duration": result["duration"],
+            "size_bytes": os.path.getsize(audio_path),
+            "created": datetime.now().isoformat()
+        }
+        # Metadata atómica: el artefacto solo existe cuando audio y metadata están en su sitio
+        with open(f"{meta_path}.part", "w") as f:
+            json.dump(metadata, f)
+        os.replace(f"{meta_path}.part", meta_path)
+        
+        # El lock se libera solo con el artefacto completo; si falla, las peticiones siguientes
+        # se serializan sobre el mismo lock en lugar de escribir a la vez en el mismo .part
+        with artifact_locks_lock:
+            artifact_locks.pop(artifact_id, None)
+        
+        increment_metric("artifacts_created")
+        return jsonify(artifact_response_data(metadata)), 201
+
+@app.route("/artifacts/<artifact_id>", methods=["GET"])
+def get_artifact(artifact_id):
+    """Sirve un artefacto con soporte de Range (206), Content-Length exacto y ETag"""
+    if not ARTIFACT_ID_PATTERN.match(artifact_id):
+        return jsonify({"error": "Invalid artifact id"}), 400
+    
+    _, meta_path = get_artifact_paths(artifact_id)
+    if not os.path.exists(meta_path):
+        return jsonify({"error": "Artifact not found"}), 404
+    
+    with open(meta_path) as f:
+        metadata = json.load(f)
+    
+    audio_format = metadata["format"]
+    audio_path, _ = get_artifact_paths(artifact_id, audio_format)
+    
+    # conditional=True: Werkzeug gestiona Range/If-Range/If-None-Match sobre el archivo
+    return send_file(audio_path,
+                     mimetype=AUDIO_FORMATS[audio_format][1],
+                     conditional=True,
+                     etag=artifact_id,
+                     max_age=CACHE_MAX_AGE,
+                     download_name=f"kokoro_v1_{artifact_id}.{audio_format}")
+
+# Pool de trabajos asíncronos y bloqueos por trabajo
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="kokoro-job")
+job_locks = {}
+job_locks_lock = threading.Lock()
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def get_job_lock(job_id):
+    with job_locks_lock:
+        return job_locks.setdefault(job_id, threading.Lock())
+
+def get_job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+def load_job(job_id):
+    """Lee el estado persistido de un trabajo (None si no existe)"""
+    job_path = os.path.join(get_job_dir(job_id), "job.json")
+    if not os.path.exists(job_path):
+        return None
+    with open(job_path) as f:
+        return json.load(f)
+
+def save_job(job):
+    """Persiste el estado de un trabajo de forma atómica"""
+    job["updated"] = datetime.now().isoformat()
+    job_path = os.path.join(get_job_dir(job["job_id"]), "job.json")
+    with open(f"{job_path}.tmp", "w") as f:
+        json.dump(job, f)
+    os.replace(f"{job_path}.tmp", job_path)
+
+def get_chunk_path(job_id, index):
+    return os.path.join(get_job_dir(job_id), f"chunk_{index:05d}.wav")
+
+def job_status_data(job):
+    """Estado público de un trabajo (sin el texto de los fragmentos)"""
+    total = len(job["chunks"])
+    data = {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "total_chunks": total,
+        "completed_chunks": job["completed_chunks"],
+        "progress": job["completed_chunks"] / total if total else 1.0,
+        "created": job["created"],
+        "updated": job["updated"],
+        "status_url": f"/jobs/{job['job_id']}"
+    }
+    if job.get("error"):
+        data["error"] = job["error"]
+    if job["status"] == "completed":
+        data["result"] = job["result"]
+        data["audio_url"] = f"/jobs/{job['job_id']}/audio"
+    return data
+
+def concatenate_job_chunks(job):
+    """Une los fragmentos terminados en el audio final (con el postproceso pedido), sin cargarlos todos en memoria"""
+    params = job["params"]
+    output_path = os.path.join(get_job_dir(job["job_id"]), f"output.{params['format']}")
+    total = len(job["chunks"])
+    audio_chunks = (sf.read(get_chunk_path(job["job_id"], index), dtype='float32') for index in range(total))
+    result = write_audio_chunks(params, output_path, audio_chunks, total)
+    return dict(result, size_bytes=os.path.getsize(output_path), format=params["format"])
+
+def run_job(job_id):
+    """Procesa los fragmentos pendientes de un trabajo y concatena el resultado
+    
+    Los fragmentos ya persistidos se omiten, así que volver a ejecutar un
+    trabajo interrumpido continúa donde se quedó.
+    """
+    # Los trabajos largos ceden el turno al tráfico interactivo en el planificador
+    scheduling_context.background = True
+    
+    with get_job_lock(job_id):
+        job = load_job(job_id)
+        if job is None or job["status"] == "completed":
+            return
+        
+        job["status"] = "running"
+        job.pop("error", None)
+        save_job(job)
+        params = job["params"]
+        
+        try:
+            for index, chunk in enumerate(job["chunks"]):
+                chunk_path = get_chunk_path(job_id, index)
+                if os.path.exists(chunk_path):
+                    continue
+                
+                audio_data, sample_rate = synthesize_file_chunk(chunk, params)
+                # Escritura atómica: un fragmento a medias nunca cuenta como terminado
+                sf.write(f"{chunk_path}.part", audio_data, sample_rate, format='WAV', subtype='FLOAT')
+                os.replace(f"{chunk_path}.part", chunk_path)
+                
+                job["completed_chunks"] = sum(
+                    1 for i in range(len(job["chunks"])) if os.path.exists(get_chunk_path(job_id, i))
+                )
+                save_job(job)
+                increment_metric("job_chunks_synthesized")
+            
+            job["result"] = concatenate_job_chunks(job)
+            job["status"] = "completed"
+            save_job(job)
+            increment_metric("jobs_completed")
+            print(f"[*] Trabajo {job_id} completado: {job['result']['duration']:.1f}s de audio")
+        
+        except Exception as e:
+            print(f"[!] Error en trabajo {job_id}: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+            save_job(job)
+            increment_metric("jobs_failed")
+
+def resume_pending_jobs():
+    """Vuelve a encolar los trabajos que quedaron a medias (caída o reinicio del servicio)"""
+    resumed = 0
+    for job_id in os.listdir(JOBS_DIR):
+        if not JOB_ID_PATTERN.match(job_id):
+            continue
+        job = load_job(job_id)
+        if job and job["status"] in ("queued", "running"):
+            job_executor.submit(run_job, job_id)
+            resumed += 1
+    if resumed:
+        print(f"[*] Reanudando {resumed} trabajos pendientes")
+
+def create_job(params):
+    """Crea y encola un trabajo de síntesis de texto largo"""
+    job_id = uuid.uuid4().hex
+    os.makedirs(get_job_dir(job_id), exist_ok=True)
+    
+    job = {
+        "job_id": job_id,
+        "status": "queued",
+        "params": params,
+        "chunks": split_text_into_sentences(params.get("phonemes") or params["text"]),
+        "completed_chunks": 0,
+        "created": datetime.now().isoformat()
+    }
+    save_job(job)
+    job_executor.submit(run_job, job_id)
+    increment_metric("jobs_submitted")
+    return job
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Envía un documento largo para síntesis asíncrona; devuelve el id del trabajo"""
+    data = request.get_json()
+    
+    params, error = parse_synthesis_params(data)
+    if error:
+        return error
+    
+    job = create_job(params)
+    print(f"[*] Trabajo {job['job_id']} encolado: {len(job['chunks'])} fragmentos [Lang: {params['language']}, Voz: {params['voice']}]")
+    
+    return jsonify(job_status_data(job)), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Estado y progreso de un trabajo"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({"error": "Invalid job id"}), 400
+    
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify(job_status_data(job))
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+def resume_job(job_id):
+    """Reintenta un trabajo fallido conservando los fragmentos ya sintetizados"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({"error": "Invalid job id"}), 400
+    
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if job["status"] == "failed":
+        # Marcado como encolado antes de responder: el cliente no debe ver aún el fallo anterior
+        with get_job_lock(job_id):
+            job["status"] = "queued"
+            job.pop("error", None)
+            save_job(job)
+        job_executor.submit(run_job, job_id)
+    
+    return jsonify(job_status_data(job)), 202
+
+@app.route("/jobs/<job_id>/audio", methods=["GET"])
+def get_job_audio(job_id):
+    """Descarga el audio de un trabajo terminado (con soporte de Range)"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({"error": "Invalid job id"}), 400
+    
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if job["status"] != "completed":
+        return jsonify(job_status_data(job)), 409
+    
+    audio_format = job["params"]["format"]
+    return send_file(os.path.join(get_job_dir(job_id), f"output.{audio_format}"),
+                     mimetype=AUDIO_FORMATS[audio_format][1],
+                     conditional=True,
+                     etag=job_id,
+                     max_age=CACHE_MAX_AGE,
+                     download_name=f"kokoro_v1_{job_id}.{audio_format}")
+
+if RESUME_JOBS:
+    resume_pending_jobs()
+
+if WARM_CACHE_DIR:
+    try:
+        load_warm_cache(WARM_CACHE_DIR)
+    except Exception as e:
+        print(f"[!] Error importando caché caliente: {e}")
+
+if MODEL_IDLE_TIMEOUT > 0:
+    threading.Thread(target=evict_idle_models, name="kokoro-model-evictor", daemon=True).start()
+
+if MODEL_WATCH_INTERVAL > 0:
+    threading.Thread(target=watch_model_files, name="kokoro-model-watcher", daemon=True).start()
+    print(f"[*] Vigilando archivos del modelo cada {MODEL_WATCH_INTERVAL:g}s para recarga en caliente")
+
 @app.route("/voices", methods=["GET"])
 def list_voices():
     """Lista las voces disponibles en Kokoro v1.0 organizadas por idioma"""
@@ -457,16 +2678,43 @@ def batch_synthesize():
     texts = data.get("texts", [])
     if not texts:
         return jsonify({"error": "Empty texts array"}), 400
+    
+    if len(texts) > MAX_BATCH_SIZE:
+        increment_metric("admission_rejected")
+        return jsonify({"error": f"Batch too large: {len(texts)} > {MAX_BATCH_SIZE}"}), 413
 
     # Parámetros comunes
     language = data.get("language", DEFAULT_LANGUAGE)
     requested_voice = data.get("voice")
     speed = float(data.get("speed", 1.0))
     gender_preference = data.get("gender_preference")
+    precision = resolve_model(data, language)
+    model_error = check_model_available(data, precision)
+    if model_error:
+        return model_error
+    _, output_error = parse_output(data)
+    if output_error:
+        return output_error
     
     # Seleccionar voz óptima
     voice = get_optimal_voice_for_language(language, requested_voice, gender_preference)
 
+    # Coste estimado del lote completo frente a los límites y al presupuesto del tenant
+    estimated_seconds = sum(
+        cost_model.estimate(cost_model.estimate_phonemes(text), speed)["seconds"] for text in texts
+    )
+    if estimated_seconds > MAX_REQUEST_SECONDS or any(len(text) > MAX_TEXT_CHARS for text in texts):
+        increment_metric("admission_rejected")
+        return jsonify({
+            "error": "Request exceeds limits",
+            "estimated_seconds": estimated_seconds,
+            "hint": "Use /jobs for long texts"
+        }), 413
+    
+    rejection = consume_tenant_budget(request.headers.get("X-Tenant-Id", "default"), estimated_seconds)
+    if rejection:
+        return rejection
+
     print(f"[*] Síntesis por lotes: {len(texts)} textos")
 
     results = []
@@ -480,7 +2728,7 @@ def batch_synthesize():
 
         try:
             # Síntesis
-            audio_data, sample_rate = synthesize_with_kokoro_v1(text, language, voice, speed)
+            audio_data, sample_rate = synthesize_with_kokoro_v1(text, language, voice, speed, precision)
             duration = len(audio_data) / sample_rate
             total_duration += duration
 
@@ -522,6 +2770,7 @@ def batch_synthesize():
         "successful": successful,
         "total_duration": total_duration,
         "model": "kokoro-v1.0",
+        "precision": precision,
         "voice": voice,
         "language": language
     })
@@ -534,7 +2783,8 @@ def get_debug_audio(filename):
     
     file_path = os.path.join(DEBUG_DIR, filename)
     if os.path.exists(file_path):
-        return send_file(file_path, mimetype="audio/wav")
+        extension = filename.rsplit('.', 1)[-1].lower()
+        return send_file(file_path, mimetype=AUDIO_FORMATS.get(extension, AUDIO_FORMATS['wav'])[1])
     else:
         return jsonify({"error": "File not found"}), 404
 
@@ -547,7 +2797,7 @@ def list_debug_audio():
     try:
         files = []
         for filename in os.listdir(DEBUG_DIR):
-            if filename.endswith('.wav'):
+            if filename.rsplit('.', 1)[-1].lower() in AUDIO_FORMATS:
                 file_path = os.path.join(DEBUG_DIR, filename)
                 stat = os.stat(file_path)
                 files.append({
@@ -564,15 +2814,231 @@ def list_debug_audio():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def admin_auth_error():
+    """Error de los endpoints /admin/* si ADMIN_TOKEN no está configurado o no coincide (None si autorizado)"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints disabled (set ADMIN_TOKEN)"}), 403
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"error": "Invalid or missing X-Admin-Token"}), 401
+    return None
+
+@app.route("/admin/warm_cache", methods=["POST"])
+def import_warm_cache():
+    """Importa un directorio generado por prerender.py como caché caliente
+    
+    El directorio de la petición es relativo a STORAGE_DIR y no puede salir de
+    él; sin directorio se usa WARM_CACHE_DIR.
+    """
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    data = request.get_json(silent=True) or {}
+    if data.get("directory"):
+        directory = resolve_inside(STORAGE_DIR, str(data["directory"]))
+        if directory is None:
+            return jsonify({"error": f"Directory must be inside {STORAGE_DIR}"}), 400
+    else:
+        directory = WARM_CACHE_DIR
+    if not directory:
+        return jsonify({"error": "No directory provided"}), 400
+    
+    try:
+        loaded = load_warm_cache(directory)
+    except Exception as e:
+        print(f"[!] Error importando caché caliente: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({
+        "directory": directory,
+        "loaded": loaded,
+        "total_entries": len(warm_cache_index)
+    })
+
+@app.route("/lexicon", methods=["GET"])
+def list_lexicons():
+    """Léxicos de pronunciación cargados; con ?language= incluye las entradas de ese idioma"""
+    language = request.args.get("language")
+    if language:
+        lexicon = lexicons.get(language)
+        if lexicon is None:
+            return jsonify({"error": f"No lexicon for language: {language}"}), 404
+        return jsonify({"language": language, "version": lexicon.version, "entries": lexicon.entries})
+    
+    return jsonify({
+        "directory": LEXICON_DIR,
+        "lexicons": {
+            language: {"entries": len(lexicon.entries), "version": lexicon.version}
+            for language, lexicon in lexicons.items()
+        }
+    })
+
+@app.route("/admin/lexicon", methods=["POST"])
+def reload_lexicon():
+    """Recarga los léxicos desde LEXICON_DIR, o añade entradas al léxico de un idioma
+    
+    Con {"language": "es", "entries": {"Kokoro": "kokˈoɾo"}} las entradas se
+    añaden (o sustituyen el léxico con "replace": true) y se guardan en disco;
+    una entrada con fonemas vacíos se elimina.
+    Sin cuerpo se releen todos los archivos. No hace falta vaciar cachés: la
+    versión del léxico forma parte de sus claves.
+    """
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    data = request.get_json(silent=True) or {}
+    if "entries" not in data:
+        try:
+            loaded = load_lexicons()
+        except Exception as e:
+            print(f"[!] Error recargando léxicos: {e}")
+            return jsonify({"error": str(e)}), 500
+        increment_metric("lexicon_reloads")
+        return jsonify({"status": "reloaded", "lexicons": loaded})
+    
+    language = data.get("language") or DEFAULT_LANGUAGE
+    entries = data["entries"]
+    if not isinstance(entries, dict) or not all(isinstance(v, str) for v in entries.values()):
+        return jsonify({"error": "entries must be an object of phrase -> phonemes"}), 400
+    
+    try:
+        lexicon = update_lexicon(language, entries, parse_bool(data.get("replace", False)))
+    except Exception as e:
+        print(f"[!] Error actualizando léxico ({language}): {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({"status": "updated", "language": language,
+                    "entries": len(lexicon.entries), "version": lexicon.version})
+
+@app.route("/models", methods=["GET"])
+def list_models():
+    """Modelos del registro, su estado de carga y la memoria estimada en uso"""
+    now = time.time()
+    return jsonify({
+        "default_model": MODEL_PRECISION,
+        "memory_budget_mb": MODEL_MEMORY_BUDGET_MB,
+        "memory_used_mb": sum(kokoro_model_sizes.values()),
+        "idle_timeout": MODEL_IDLE_TIMEOUT,
+        "language_routes": MODEL_LANGUAGES,
+        "models": {
+            name: {
+                "model_path": path,
+                "voices_path": MODEL_VOICES[name],
+                "available": os.path.exists(path),
+                "loaded": name in kokoro_models,
+                "size_mb": kokoro_model_sizes.get(name),
+                "idle_seconds": now - kokoro_model_last_used[name] if name in kokoro_model_last_used else None,
+                "version": get_model_version(name)
+            }
+            for name, path in MODEL_VARIANTS.items()
+        }
+    })
+
+@app.route("/admin/reload", methods=["POST"])
+def reload_models():
+    """Recarga en caliente los modelos desde disco (por defecto, todos los cargados)
+    
+    Con wait=true responde al terminar; si no, recarga en segundo plano y
+    responde 202 (el progreso se consulta con GET /admin/reload).
+    """
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    data = request.get_json(silent=True) or {}
+    if data.get("model") or data.get("precision"):
+        precisions = [data.get("model") or data["precision"]]
+    else:
+        precisions = list(kokoro_models) or [MODEL_PRECISION]
+    
+    invalid = [p for p in precisions if p not in MODEL_VARIANTS]
+    if invalid:
+        return jsonify({"error": f"Unsupported model: {invalid[0]}"}), 400
+    missing = [p for p in precisions if not os.path.exists(MODEL_VARIANTS[p])]
+    if missing:
+        return jsonify({"error": f"Model file not found: {MODEL_VARIANTS[missing[0]]}"}), 400
+    
+    if not parse_bool(data.get("wait", False)):
+        def reload_all():
+            for precision in precisions:
+                try:
+                    reload_kokoro_model(precision)
+                except Exception:
+                    pass
+        
+        threading.Thread(target=reload_all, name="kokoro-model-reload", daemon=True).start()
+        return jsonify({"status": "reloading", "precisions": precisions, "status_url": "/admin/reload"}), 202
+    
+    results = {}
+    for precision in precisions:
+        try:
+            results[precision] = reload_kokoro_model(precision)
+        except Exception:
+            results[precision] = model_reload_status[precision]
+    
+    success = all(result["status"] == "loaded" for result in results.values())
+    return jsonify({"reloads": results}), 200 if success else 500
+
+@app.route("/admin/reload", methods=["GET"])
+def get_reload_status():
+    """Estado de la última recarga de cada variante y versión en servicio"""
+    auth_error = admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    return jsonify({
+        "reloads": model_reload_status,
+        "model_versions": {name: get_model_version(name) for name in kokoro_models},
+        "watch_interval": MODEL_WATCH_INTERVAL
+    })
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Contadores de rendimiento y estado de las cachés"""
+    with metrics_lock:
+        counters = dict(metrics)
+    
+    return jsonify({
+        "counters": counters,
+        "audio_cache": audio_cache.stats(),
+        "in_flight_syntheses": synthesis_flight.in_flight(),
+        "phoneme_cache": phoneme_cache.stats(),
+        "g2p_workers": {language: G2P_WORKERS for language in g2p_pools},
+        "segment_cache": segment_cache.stats(),
+        "warm_cache_entries": len(warm_cache_index),
+        "cost_model": cost_model.stats(),
+        "scheduler": inference_scheduler.stats(),
+        "shm_ring": shm_ring.stats() if shm_ring else None
+    })
+
 @app.route("/health", methods=["GET"])
 def health():
     """Health check del servicio"""
+    # Con el circuito del modelo por defecto abierto, el servicio responde con el fallback;
+    # en half_open ("recovering") admite la petición de prueba que puede cerrarlo
+    default_breaker = kokoro_breakers[MODEL_PRECISION].status()
+    service_status = {"closed": "healthy", "half_open": "recovering"}.get(default_breaker["state"], "degraded")
+    
     return jsonify({
-        "status": "healthy",
+        "status": service_status,
         "model": "kokoro-v1.0",
-        "model_status": "loaded" if kokoro is not None else "error",
+        "model_status": "loaded" if MODEL_PRECISION in kokoro_models else "error",
         "model_path": MODEL_PATH,
         "voices_path": VOICES_PATH,
+        "model_precision": MODEL_PRECISION,
+        "model_variants": {
+            name: {
+                "path": path,
+                "available": os.path.exists(path),
+                "loaded": name in kokoro_models,
+                "version": kokoro_model_versions.get(name)
+            }
+            for name, path in MODEL_VARIANTS.items()
+        },
+        "circuit_breakers": {name: breaker.status() for name, breaker in kokoro_breakers.items()},
+        "fallback": fallback_engine.status(),
         "available_voices": sum(len(voices) for voices in AVAILABLE_VOICES.values()),
         "supported_languages": len(LANGUAGE_MAP),
         "default_language": DEFAULT_LANGUAGE,
@@ -581,5 +3047,117 @@ def health():
         "version": "1.0"
     })
 
+def rpc_params(data, allow_shm=False):
+    """Valida parámetros RPC con las mismas reglas que REST; lanza ValueError si no son válidos"""
+    with app.app_context():
+        params, error = parse_synthesis_params(data, allow_shm)
+    if error:
+        raise ValueError(error[0].get_json()["error"])
+    return params
+
+def rpc_rejection(rejection, hint=None):
+    """Convierte una respuesta de admisión (413/429) en un RpcError con sus campos"""
+    response, status = rejection
+    meta = dict(response.get_json(), status=status)
+    if hint:
+        meta["hint"] = hint
+    return RpcError(meta.pop("error"), meta)
+
+def rpc_synthesize(data):
+    """RPC synthesize: audio completo, con la misma caché, coalescencia y admisión que /synthesize
+    
+    El tenant va en el campo "tenant" de los metadatos. RPC no deriva a
+    trabajos asíncronos: los textos largos usan synthesize_stream.
+    """
+    params = rpc_params(data, allow_shm=True)
+    key = synthesis_cache_key(params)
+    with app.app_context():
+        rejection = check_admission(params, key, dict(data, allow_async=False),
+                                    tenant=str(data.get("tenant") or "default"))
+    if rejection:
+        raise rpc_rejection(rejection, "Use synthesize_stream for long texts")
+    
+    increment_metric("rpc_requests")
+    result = get_synthesized_audio(params, key)
+    meta = {
+        "key": key,
+        "sample_rate": result["sample_rate"],
+        "duration": result["duration"],
+        "format": result["format"],
+        "voice": params["voice"],
+        "language": params["language"],
+        "model_version": get_model_version(params["precision"]),
+        "cacheable": result["cacheable"]
+    }
+    if params["output"] == "shm":
+        meta["shm"] = write_to_shm_ring(result)
+        return meta, b""
+    return meta, result["data"]
+
+def rpc_synthesize_stream(data):
+    """RPC synthesize_stream: genera el audio frase a frase a medida que se sintetiza
+    
+    Cada fragmento va codificado por separado; con format=pcm los fragmentos
+    se pueden concatenar directamente.
+    """
+    params = rpc_params(data)
+    
+    # Sin límite de longitud (es la vía para textos largos), pero consume presupuesto del tenant
+    estimate = cost_model.estimate(
+        cost_model.estimate_phonemes(params["text"], params.get("phonemes")), params["speed"]
+    )
+    with app.app_context():
+        rejection = consume_tenant_budget(str(data.get("tenant") or "default"), estimate["seconds"])
+    if rejection:
+        raise rpc_rejection(rejection)
+    
+    increment_metric("rpc_requests")
+    start = time.time()
+    # Una trama por frase: el cliente recibe el primer audio tras sintetizar solo la primera
+    chunks = split_text_into_sentences(params.get("phonemes") or params["text"], merge=False)
+    duration = 0.0
+    
+    for i, chunk in enumerate(chunks):
+        audio_data, sample_rate = synthesize_chunk(chunk, params)
+        chunk_duration = len(audio_data) / sample_rate
+        duration += chunk_duration
+        yield {
+            "index": i,
+            "chunks": len(chunks),
+            "sample_rate": sample_rate,
+            "duration": chunk_duration,
+            "format": params["format"]
+        }, encode_audio(audio_data, sample_rate, params["format"])
+    
+    yield {"final": True, "chunks": len(chunks), "duration": duration, "elapsed": time.time() - start}, b""
+
+def rpc_batch(data):
+    """RPC batch: un fragmento por elemento (texto o dict de parámetros) sobre parámetros comunes"""
+    items = data.get("items") or []
+    if not items:
+        raise ValueError("Empty items array")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch too large: {len(items)} > {MAX_BATCH_SIZE}")
+    
+    common = {k: v for k, v in data.items() if k != "items"}
+    successful = 0
+    for i, item in enumerate(items):
+        item_data = dict(common, **item) if isinstance(item, dict) else dict(common, text=item)
+        try:
+            meta, audio_bytes = rpc_synthesize(item_data)
+            successful += 1
+            yield dict(meta, index=i), audio_bytes
+        except Exception as e:
+            yield dict(getattr(e, "meta", {}), index=i, error=str(e)), b""
+    
+    yield {"final": True, "total": len(items), "successful": successful}, b""
+
 if __name__ == "__main__":
+    if RPC_PORT:
+        start_rpc_server(HOST, RPC_PORT, {
+            "synthesize": rpc_synthesize,
+            "synthesize_stream": rpc_synthesize_stream,
+            "batch": rpc_batch
+        }, RPC_WORKERS)
+        print(f"[*] Servidor RPC binario escuchando en {HOST}:{RPC_PORT}")
     app.run(host=HOST, port=PORT, debug=False) 
\ No newline at end of file
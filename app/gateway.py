@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Gateway de Kokoro TTS v1.0 con afinidad de caché
+
+Con varias réplicas detrás de un balanceador round-robin, la caché de
+síntesis de cada proceso solo ve 1/N de las peticiones repetidas. Este
+gateway envía cada síntesis a la réplica que le corresponde por hashing
+consistente de su clave (texto, voz, velocidad, formato, modelo), de modo
+que las repeticiones caen siempre en la misma caché.
+
+Funcionalidades:
+- Anillo de hashing consistente con nodos virtuales: cuando una réplica
+  entra o sale solo se reasigna ~1/N de las claves
+- Conexiones keep-alive reutilizadas por réplica (http.client)
+- Salud de las réplicas vía su /health; una réplica caída o degradada
+  (circuito de Kokoro abierto) sale del anillo y sus peticiones pasan a
+  la siguiente del anillo
+- Afinidad de trabajos y artefactos: el gateway antepone a sus ids la
+  réplica que los creó (<réplica>.<id>), de modo que /jobs/<id> y
+  /artifacts/<id> llegan a ella aunque el gateway se reinicie o haya varios
+- Modo local: varias réplicas dentro del mismo proceso para pruebas
+
+Ejecución:
+    GATEWAY_REPLICAS=kokoro-1:5002,kokoro-2:5002 python3 gateway.py
+    python3 gateway.py --local-replicas 3
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import bisect
+import hashlib
+import argparse
+import threading
+import http.client
+import urllib.parse
+
+from flask import Flask, request, jsonify, Response
+from werkzeug.serving import make_server
+
+# Configuración del gateway
+GATEWAY_HOST = os.getenv("GATEWAY_HOST", "0.0.0.0")
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", 5000))
+GATEWAY_REPLICAS = os.getenv("GATEWAY_REPLICAS", "")  # host:puerto separados por comas
+GATEWAY_VNODES = int(os.getenv("GATEWAY_VNODES", 160))  # Nodos virtuales por réplica
+GATEWAY_HEALTH_INTERVAL = float(os.getenv("GATEWAY_HEALTH_INTERVAL", 5))  # Segundos entre health checks
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", 120))  # Timeout de las peticiones a réplicas
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", 16))  # Conexiones keep-alive inactivas por réplica
+
+# Parámetros que determinan el audio: forman la clave de enrutado
+ROUTING_FIELDS = ("text", "phonemes", "language", "voice", "speed", "format", "model", "precision", "segment_cache")
+
+# Cabeceras que se reenvían a la réplica y cabeceras hop-by-hop que no se devuelven
+FORWARD_HEADERS = ("Content-Type", "Accept", "If-None-Match", "Range", "If-Range", "X-Tenant-Id")
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade",
+                      "proxy-authenticate", "proxy-authorization"}
+
+# Campos de las respuestas JSON con ids de recursos que viven en una réplica concreta
+RESOURCE_FIELDS = ("job_id", "artifact_id")
+RESOURCE_ROUTES = ("jobs", "artifacts")
+
+
+class ReplicaUnavailable(Exception):
+    """No se pudo conectar con la réplica: la petición no llegó a enviarse"""
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+def replica_token(address):
+    """Identificador corto de una réplica, el mismo en todas las instancias del gateway"""
+    return hashlib.md5(address.encode("utf-8")).hexdigest()[:8]
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales"""
+
+    def __init__(self, vnodes=GATEWAY_VNODES):
+        self.vnodes = vnodes
+        self.lock = threading.Lock()
+        self.positions = []
+        self.owners = {}
+
+    def add(self, node):
+        with self.lock:
+            for i in range(self.vnodes):
+                position = ring_hash(f"{node}#{i}")
+                if position not in self.owners:
+                    self.owners[position] = node
+                    bisect.insort(self.positions, position)
+
+    def remove(self, node):
+        with self.lock:
+            self.owners = {position: owner for position, owner in self.owners.items() if owner != node}
+            self.positions = sorted(self.owners)
+
+    def nodes(self):
+        with self.lock:
+            return set(self.owners.values())
+
+    def get_nodes(self, key):
+        """Réplicas en orden de preferencia para una clave (la primera es la propietaria)"""
+        with self.lock:
+            positions = self.positions
+            owners = self.owners
+        if not positions:
+            return []
+
+        start = bisect.bisect(positions, ring_hash(key))
+        ordered = []
+        for i in range(len(positions)):
+            node = owners[positions[(start + i) % len(positions)]]
+            if node not in ordered:
+                ordered.append(node)
+        return ordered
+
+
+class Replica:
+    """Réplica del servicio con un pool de conexiones keep-alive
+
+    Las conexiones se reutilizan mientras la réplica las mantenga abiertas;
+    si responde con Connection: close (servidor de desarrollo de Werkzeug)
+    se abre una nueva por petición.
+    """
+
+    def __init__(self, address, pool_size=GATEWAY_POOL_SIZE, timeout=GATEWAY_TIMEOUT):
+        self.address = address
+        self.host, _, port = address.partition(":")
+        self.port = int(port or 5002)
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.healthy = False
+        self.last_error = None
+        self.forwarded = 0
+        self.failures = 0
+
+    def new_connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Envía una petición y devuelve (status, cabeceras, cuerpo)
+
+        Una conexión reutilizada puede haberla cerrado la réplica: en ese
+        caso se reintenta una vez con una conexión nueva. Si no se puede
+        conectar lanza ReplicaUnavailable; cualquier otro error (p. ej. un
+        timeout de lectura) significa que la réplica pudo recibir la petición.
+        """
+        for attempt in range(2):
+            try:
+                conn = self.pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self.new_connection()
+                reused = False
+                try:
+                    conn.connect()
+                except OSError as e:
+                    conn.close()
+                    raise ReplicaUnavailable(str(e))
+
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # Un timeout de lectura no es una conexión caducada: la réplica tiene la petición
+                if reused and attempt == 0 and not isinstance(e, TimeoutError):
+                    continue
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self.pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, response.getheaders(), data
+
+    def status(self):
+        return {
+            "healthy": self.healthy,
+            "forwarded": self.forwarded,
+            "failures": self.failures,
+            "idle_connections": self.pool.qsize(),
+            "last_error": self.last_error
+        }
+
+
+class Gateway:
+    """Enrutado de peticiones a réplicas por hashing consistente"""
+
+    def __init__(self, addresses, vnodes=GATEWAY_VNODES):
+        self.replicas = {address: Replica(address) for address in addresses}
+        self.ring = HashRing(vnodes)
+        self.tokens = {replica_token(address): address for address in addresses}
+        self.counters = {"forwarded": 0, "failovers": 0, "unavailable": 0, "replica_errors": 0}
+        self.counters_lock = threading.Lock()
+
+    def increment(self, name):
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def mark(self, replica, healthy, error=None):
+        """Cambia el estado de una réplica y la añade o quita del anillo"""
+        replica.last_error = error
+        if replica.healthy == healthy:
+            return
+        replica.healthy = healthy
+        if healthy:
+            self.ring.add(replica.address)
+            print(f"[*] Réplica {replica.address} disponible, añadida al anillo")
+        else:
+            self.ring.remove(replica.address)
+            print(f"[!] Réplica {replica.address} no disponible, retirada del anillo: {error}")
+
+    def check_health(self):
+        for replica in self.replicas.values():
+            try:
+                status, _, data = replica.request("GET", "/health")
+                if status != 200:
+                    self.mark(replica, False, f"HTTP {status}")
+                    continue
+                # Una réplica "degraded" (circuito de Kokoro abierto) respondería con el fallback;
+                # "recovering" vuelve al anillo para recibir la petición de prueba que cierra el circuito
+                state = json.loads(data).get("status")
+                if state in ("healthy", "recovering"):
+                    self.mark(replica, True)
+                else:
+                    self.mark(replica, False, f"status {state}")
+            except Exception as e:
+                self.mark(replica, False, str(e))
+
+    def health_loop(self, interval=GATEWAY_HEALTH_INTERVAL):
+        while True:
+            time.sleep(interval)
+            self.check_health()
+
+    def routing_key(self, path, args, body):
+        """Clave de enrutado: parámetros de síntesis, id de trabajo/artefacto o la ruta"""
+        parts = path.strip("/").split("/")
+        if len(parts) >= 2 and parts[0] in RESOURCE_ROUTES:
+            return f"{parts[0]}:{parts[1]}"
+
+        data = args
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return hashlib.sha256(body).hexdigest()
+        if not isinstance(data, dict) or not ("text" in data or "phonemes" in data or "texts" in data):
+            return path
+
+        fields = {field: data.get(field) for field in ROUTING_FIELDS}
+        try:
+            fields["speed"] = round(float(fields["speed"] or 1.0), 3)
+        except (TypeError, ValueError):
+            pass
+        if "texts" in data:
+            fields["texts"] = data["texts"]
+        return json.dumps(fields, sort_keys=True, ensure_ascii=False)
+
+    def resource_owner(self, path):
+        """Réplica y ruta interna de /jobs/<réplica>.<id>... y /artifacts/<réplica>.<id>...
+
+        Devuelve (dirección o None, ruta); None si la ruta no lleva un id etiquetado.
+        """
+        parts = path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] not in RESOURCE_ROUTES:
+            return None, path
+        token, dot, resource_id = parts[1].partition(".")
+        if not dot:
+            return None, path
+        return self.tokens.get(token, ""), "/" + "/".join([parts[0], resource_id] + parts[2:])
+
+    def forward(self, method, path, query, body, headers):
+        owner, path = self.resource_owner(path)
+        if owner == "":
+            error = json.dumps({"error": "Unknown replica in resource id"}).encode("utf-8")
+            return 404, [("Content-Type", "application/json")], error, None
+        key = self.routing_key(path, dict(urllib.parse.parse_qsl(query)), body)
+        target = f"{path}?{query}" if query else path
+
+        # Un trabajo o artefacto solo existe en la réplica que lo creó: sin reintento en otra
+        for attempt, address in enumerate([owner] if owner else self.ring.get_nodes(key)):
+            replica = self.replicas[address]
+            try:
+                status, response_headers, data = replica.request(method, target, body, headers)
+            except ReplicaUnavailable as e:
+                # Solo se pasa a la siguiente réplica si la petición no llegó a enviarse
+                replica.failures += 1
+                self.mark(replica, False, str(e))
+                continue
+            except Exception as e:
+                # La réplica pudo recibirla (síntesis lenta, POST /jobs...): ni reintento ni baja del anillo
+                replica.failures += 1
+                replica.last_error = str(e)
+                self.increment("replica_errors")
+                status = 504 if isinstance(e, TimeoutError) else 502
+                error = json.dumps({"error": f"Replica {address} failed: {e}"}).encode("utf-8")
+                return status, [("Content-Type", "application/json")], error, address
+
+            replica.forwarded += 1
+            self.increment("forwarded")
+            if attempt:
+                self.increment("failovers")
+            return status, response_headers, self.tag_resources(response_headers, data, address), address
+
+        self.increment("unavailable")
+        return None
+
+    def tag_resources(self, headers, data, address):
+        """Antepone la réplica a los ids de trabajos y artefactos (y a sus URLs) de una respuesta JSON"""
+        content_type = next((value for name, value in headers if name.lower() == "content-type"), "")
+        if "application/json" not in content_type:
+            return data
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return data
+        if not isinstance(payload, dict):
+            return data
+
+        tagged_any = False
+        for field in RESOURCE_FIELDS:
+            resource_id = payload.get(field)
+            if not isinstance(resource_id, str) or not resource_id:
+                continue
+            tagged = f"{replica_token(address)}.{resource_id}"
+            for name, value in payload.items():
+                if name.endswith("url") and isinstance(value, str):
+                    payload[name] = value.replace(f"/{resource_id}", f"/{tagged}")
+            payload[field] = tagged
+            tagged_any = True
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8") if tagged_any else data
+
+    def status(self):
+        with self.counters_lock:
+            counters = dict(self.counters)
+        return {
+            "ring_nodes": sorted(self.ring.nodes()),
+            "vnodes": self.ring.vnodes,
+            "counters": counters,
+            "replicas": {address: replica.status() for address, replica in self.replicas.items()}
+        }
+
+
+def create_gateway_app(gateway):
+    """Aplicación Flask del gateway: /health y /metrics propios, el resto se reenvía"""
+    app = Flask(__name__)
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        healthy = [replica for replica in gateway.replicas.values() if replica.healthy]
+        return jsonify({
+            "status": "healthy" if len(healthy) == len(gateway.replicas) else ("degraded" if healthy else "unavailable"),
+            "mode": "gateway",
+            "replicas_healthy": len(healthy),
+            "replicas_total": len(gateway.replicas),
+            "version": "1.0"
+        }), 200 if healthy else 503
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return jsonify(gateway.status())
+
+    @app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "DELETE", "HEAD"])
+    @app.route("/<path:path>", methods=["GET", "POST", "PUT", "DELETE", "HEAD"])
+    def proxy(path):
+        headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+        body = request.get_data() or None
+        result = gateway.forward(request.method, f"/{path}", request.query_string.decode("latin-1"), body, headers)
+        if result is None:
+            return jsonify({"error": "No healthy replicas available"}), 503
+
+        status, response_headers, data, address = result
+        if address is None:
+            return Response(data, status=status, content_type="application/json")
+        # Content-Type de la réplica (Response pondría text/html por defecto y quedarían dos)
+        content_type = next((value for name, value in response_headers if name.lower() == "content-type"), None)
+        response = Response(data, status=status, content_type=content_type)
+        for name, value in response_headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in ("content-length", "content-type"):
+                response.headers.add(name, value)
+        response.headers["X-Kokoro-Replica"] = address
+        return response
+
+    return app
+
+
+def start_local_replicas(count, base_port):
+    """Arranca réplicas independientes del servicio dentro de este proceso (pruebas locales)
+
+    Cada réplica es una copia separada del módulo app.py, con su propio
+    modelo y sus propias cachés, servida en un puerto consecutivo.
+    """
+    import importlib.util
+
+    os.environ["RESUME_JOBS"] = "false"
+    # Las réplicas se cargan con hilos ya en marcha (sin fork de procesos G2P) y
+    # compartirían el mismo segmento de memoria compartida
+    os.environ["G2P_WORKERS"] = "0"
+    os.environ["SHM_RING_SIZE_MB"] = "0"
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    addresses = []
+    for i in range(count):
+        spec = importlib.util.spec_from_file_location(f"kokoro_replica_{i}", app_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        server = make_server("127.0.0.1", base_port + i, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name=f"kokoro-replica-{i}", daemon=True).start()
+        addresses.append(f"127.0.0.1:{base_port + i}")
+        print(f"[*] Réplica local {i} escuchando en 127.0.0.1:{base_port + i}")
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway con afinidad de caché para Kokoro TTS v1.0")
+    parser.add_argument("--replicas", default=GATEWAY_REPLICAS, help="Réplicas host:puerto separadas por comas")
+    parser.add_argument("--local-replicas", type=int, default=0, help="Arrancar N réplicas dentro de este proceso")
+    parser.add_argument("--local-base-port", type=int, default=5102, help="Primer puerto de las réplicas locales")
+    parser.add_argument("--host", default=GATEWAY_HOST)
+    parser.add_argument("--port", type=int, default=GATEWAY_PORT)
+    args = parser.parse_args()
+
+    addresses = [address.strip() for address in args.replicas.split(",") if address.strip()]
+    if args.local_replicas:
+        addresses += start_local_replicas(args.local_replicas, args.local_base_port)
+    if not addresses:
+        print("[!] No hay réplicas configuradas (GATEWAY_REPLICAS o --local-replicas)")
+        return False
+
+    gateway = Gateway(addresses)
+    gateway.check_health()
+    threading.Thread(target=gateway.health_loop, name="kokoro-gateway-health", daemon=True).start()
+
+    print(f"[*] Gateway Kokoro TTS v1.0 en {args.host}:{args.port} -> {', '.join(addresses)}")
+    create_gateway_app(gateway).run(host=args.host, port=args.port, debug=False, threaded=True)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Prerenderizado offline de Kokoro TTS v1.0
+
+Sintetiza manifiestos de miles de locuciones (p. ej. bibliotecas de
+prompts IVR) usando todos los núcleos, sin pasar por HTTP.
+
+Funcionalidades:
+- Manifiestos JSONL o CSV (text, voice, language, speed, output)
+- Pool multiproceso; cada proceso usa su propia sesión de ONNX Runtime
+  con ONNX_INTRA_OP_THREADS hilos para no sobresuscribir la CPU
+- Reejecuciones incrementales: se omiten los elementos ya renderizados
+  con la misma clave de síntesis
+- Escritura directa en el formato elegido (wav, flac, ogg)
+- Informe de rendimiento y fallos (failures.jsonl); sin fallback de espeak:
+  con el circuito de Kokoro abierto los elementos cuentan como fallos
+- El directorio de salida (index.jsonl) se importa como caché caliente
+  del servicio con WARM_CACHE_DIR o POST /admin/warm_cache
+
+Ejecución:
+    python3 prerender.py prompts.jsonl --output-dir /app/storage/prerender
+    python3 prerender.py prompts.csv --format flac --workers 8
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from functools import partial
+
+# Módulo del servicio, importado de forma diferida en cada proceso
+service = None
+
+
+def import_service(preload_model):
+    """Importa app.py sin reanudar trabajos y cargando (o no) el modelo"""
+    global service
+    os.environ["PRELOAD_MODEL"] = "true" if preload_model else "false"
+    os.environ["RESUME_JOBS"] = "false"
+    os.environ["DEBUG_AUDIO"] = "false"
+    os.environ.setdefault("WARM_CACHE_DIR", "")
+    os.environ["MODEL_WATCH_INTERVAL"] = "0"
+    os.environ["G2P_WORKERS"] = "0"
+    os.environ["SHM_RING_SIZE_MB"] = "0"
+    import app
+    service = app
+    return app
+
+
+def read_manifest(path):
+    """Lee un manifiesto JSONL o CSV como lista de dicts"""
+    items = []
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                items.append({k: v for k, v in row.items() if v not in (None, "")})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    items.append(json.loads(line))
+    return items
+
+
+def prepare_item(index, item, audio_format, output_dir):
+    """Valida un elemento del manifiesto y calcula su clave de síntesis y archivo de salida"""
+    item = dict(item, format=item.get("format", audio_format))
+    with service.app.app_context():
+        # "output" es el archivo de destino en el manifiesto, no la salida del audio del servicio
+        params, error = service.parse_synthesis_params({k: v for k, v in item.items() if k != "output"})
+        if error:
+            return {"index": index, "error": error[0].get_json()["error"], "item": item}
+
+    key = service.synthesis_cache_key(params)
+    name = item.get("output") or item.get("name") or key[:16]
+    extension = f".{params['format']}"
+    if not name.endswith(extension):
+        name += extension
+    # El archivo de salida no puede salir de --output-dir (.. o rutas absolutas)
+    if service.resolve_inside(output_dir, name) is None:
+        return {"index": index, "error": f"Output path escapes --output-dir: {name}", "item": item}
+
+    return {"index": index, "params": params, "key": key, "file": name}
+
+
+def init_worker(threads):
+    """Inicializa un proceso del pool: limita hilos de ONNX Runtime y carga el modelo"""
+    if threads:
+        os.environ["ONNX_INTRA_OP_THREADS"] = str(threads)
+    import_service(preload_model=True)
+
+
+def render_item(task, output_dir):
+    """Sintetiza un elemento y lo escribe de forma atómica en el directorio de salida"""
+    params = task["params"]
+    start = time.time()
+    try:
+        # Misma ruta que el servicio (segmentos si segment_cache): el audio corresponde a su clave de síntesis
+        audio_data, sample_rate = service.synthesize_file_chunk(params.get("phonemes") or params["text"], params)
+        if params.get("postprocess"):
+            audio_data, _ = service.postprocess_audio(audio_data, sample_rate, params["postprocess"])
+        audio_bytes = service.encode_audio(audio_data, sample_rate, params["format"])
+
+        path = os.path.join(output_dir, task["file"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.part", "wb") as f:
+            f.write(audio_bytes)
+        os.replace(f"{path}.part", path)
+
+        return {
+            "index": task["index"],
+            "key": task["key"],
+            "file": task["file"],
+            "format": params["format"],
+            "sample_rate": sample_rate,
+            "duration": len(audio_data) / sample_rate,
+            "elapsed": time.time() - start
+        }
+    except service.CircuitOpenError as e:
+        # Nunca se usa el fallback: el elemento queda como fallo y se reintenta en la próxima ejecución
+        return {"index": task["index"], "file": task["file"], "error": str(e), "circuit_open": True}
+    except Exception as e:
+        return {"index": task["index"], "file": task["file"], "error": str(e)}
+
+
+def load_index(output_dir):
+    """Índice existente: archivo -> entrada (para reejecuciones incrementales)"""
+    index = {}
+    index_path = os.path.join(output_dir, "index.jsonl")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    index[entry["file"]] = entry
+    return index
+
+
+def write_index(output_dir, index):
+    """Reescribe el índice de forma atómica"""
+    index_path = os.path.join(output_dir, "index.jsonl")
+    with open(f"{index_path}.tmp", "w") as f:
+        for entry in index.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prerenderizado offline de Kokoro TTS v1.0")
+    parser.add_argument("manifest", help="Manifiesto JSONL o CSV")
+    parser.add_argument("--output-dir", default="/app/storage/prerender", help="Directorio de salida")
+    parser.add_argument("--format", default="wav", help="Formato por defecto (wav, flac, ogg)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Procesos del pool")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Hilos de ONNX Runtime por proceso")
+    parser.add_argument("--force", action="store_true", help="Renderizar de nuevo todos los elementos")
+    args = parser.parse_args()
+
+    import_service(preload_model=False)
+    if args.format not in service.AUDIO_FORMATS:
+        print(f"[!] Formato no soportado: {args.format}")
+        return False
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    items = read_manifest(args.manifest)
+    index = {} if args.force else load_index(args.output_dir)
+
+    # Validar y descartar lo ya renderizado (mismo archivo y misma clave de síntesis)
+    tasks = []
+    failures = []
+    skipped = 0
+    for i, item in enumerate(items):
+        task = prepare_item(i, item, args.format, args.output_dir)
+        if "error" in task:
+            failures.append(task)
+            continue
+        previous = index.get(task["file"])
+        if (previous and previous["key"] == task["key"]
+                and os.path.exists(os.path.join(args.output_dir, task["file"]))):
+            skipped += 1
+            continue
+        tasks.append(task)
+
+    print(f"[*] Manifiesto: {len(items)} elementos, {len(tasks)} pendientes, "
+          f"{skipped} ya renderizados, {len(failures)} inválidos")
+    print(f"[*] Pool: {args.workers} procesos x {args.threads_per_worker} hilos")
+
+    start = time.time()
+    rendered = 0
+    audio_seconds = 0.0
+    synthesis_seconds = 0.0
+
+    if tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.workers, initializer=init_worker, initargs=(args.threads_per_worker,)) as pool:
+            worker = partial(render_item, output_dir=args.output_dir)
+            for n, result in enumerate(pool.imap_unordered(worker, tasks, chunksize=4), 1):
+                if "error" in result:
+                    failures.append(result)
+                else:
+                    result.pop("index")
+                    synthesis_seconds += result.pop("elapsed")
+                    index[result["file"]] = result
+                    rendered += 1
+                    audio_seconds += result["duration"]
+
+                if n % 100 == 0 or n == len(tasks):
+                    wall = time.time() - start
+                    print(f"[*] {n}/{len(tasks)} ({n / wall:.1f} elementos/s, {len(failures)} fallos)")
+                    # Guardar progreso para que una interrupción no pierda lo renderizado
+                    write_index(args.output_dir, index)
+
+    wall = time.time() - start
+    write_index(args.output_dir, index)
+
+    if failures:
+        with open(os.path.join(args.output_dir, "failures.jsonl"), "w") as f:
+            for failure in failures:
+                f.write(json.dumps(failure, ensure_ascii=False, default=str) + "\n")
+
+    print()
+    print("=" * 50)
+    print(f"Renderizados:      {rendered}")
+    print(f"Omitidos:          {skipped}")
+    print(f"Fallos:            {len(failures)}")
+    circuit_open = sum(1 for failure in failures if failure.get("circuit_open"))
+    if circuit_open:
+        print(f"Circuito abierto:  {circuit_open} (reejecutar cuando el modelo se recupere)")
+    print(f"Tiempo total:      {wall:.1f}s")
+    if rendered:
+        print(f"Rendimiento:       {rendered / wall:.1f} elementos/s")
+        print(f"Audio generado:    {audio_seconds:.1f}s (x{audio_seconds / wall:.1f} tiempo real)")
+        print(f"Síntesis media:    {synthesis_seconds / rendered * 1000:.0f}ms por elemento")
+    print(f"Índice:            {os.path.join(args.output_dir, 'index.jsonl')}")
+    if failures:
+        print(f"Detalle de fallos: {os.path.join(args.output_dir, 'failures.jsonl')}")
+
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Herramienta de variantes de precisión para Kokoro TTS v1.0
+
+Genera variantes reducidas del modelo ONNX y compara su rendimiento
+frente al modelo fp32 original.
+
+Comandos:
+- quantize: genera kokoro-v1.0.int8.onnx (cuantización dinámica) y
+  kokoro-v1.0.fp16.onnx (media precisión) a partir de MODEL_PATH
+- compare: mide velocidad (RTF), memoria pico y similitud de la salida
+  de cada variante respecto a fp32
+
+Ejecución:
+    python3 quantize_model.py quantize
+    python3 quantize_model.py quantize --variants int8
+    python3 quantize_model.py compare --language es --voice ef_dora
+    python3 quantize_model.py compare --json report.json
+
+Dependencias opcionales:
+- onnxruntime (incluye onnxruntime.quantization) para int8
+- onnx + onnxconverter-common para fp16
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from queue import Empty
+
+import numpy as np
+
+# Mismas rutas que usa el servicio (app.py)
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/models/kokoro-v1.0.onnx")
+VOICES_PATH = os.getenv("VOICES_PATH", "/app/models/voices-v1.0.bin")
+MODEL_VARIANTS = {
+    "fp32": MODEL_PATH,
+    "fp16": os.getenv("MODEL_PATH_FP16", "/app/models/kokoro-v1.0.fp16.onnx"),
+    "int8": os.getenv("MODEL_PATH_INT8", "/app/models/kokoro-v1.0.int8.onnx"),
+}
+
+# Frases de referencia para la comparación
+SAMPLE_TEXTS = {
+    "es": [
+        "Hola, esta es una prueba de rendimiento del sistema Kokoro.",
+        "El veloz murciélago hindú comía feliz cardillo y kiwi.",
+        "Su saldo es de ciento veinticinco euros con cuarenta céntimos.",
+    ],
+    "en": [
+        "Hello, this is a performance test of the Kokoro system.",
+        "The quick brown fox jumps over the lazy dog.",
+        "Your balance is one hundred twenty five dollars and forty cents.",
+    ],
+}
+
+
+def quantize_int8(source_path, target_path):
+    """Cuantización dinámica a int8 (pesos int8, activaciones calculadas en ejecución)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(source_path, target_path, weight_type=QuantType.QUInt8)
+
+
+def convert_fp16(source_path, target_path):
+    """Conversión de pesos a float16 manteniendo entradas/salidas en float32"""
+    import onnx
+    from onnxconverter_common import float16
+
+    model = onnx.load(source_path)
+    model_fp16 = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model_fp16, target_path)
+
+
+CONVERTERS = {
+    "int8": quantize_int8,
+    "fp16": convert_fp16,
+}
+
+
+def command_quantize(args):
+    """Genera las variantes solicitadas a partir del modelo fp32"""
+    if not os.path.exists(args.model):
+        print(f"[!] Modelo fuente no encontrado: {args.model}")
+        return False
+
+    source_size = os.path.getsize(args.model)
+    success = True
+
+    for variant in args.variants:
+        target_path = MODEL_VARIANTS[variant]
+        if os.path.exists(target_path) and not args.force:
+            print(f"[*] {variant}: ya existe {target_path} (usar --force para regenerar)")
+            continue
+
+        print(f"[*] Generando variante {variant} -> {target_path}")
+        start = time.time()
+        try:
+            CONVERTERS[variant](args.model, target_path)
+        except ImportError as e:
+            print(f"[!] {variant}: dependencia no instalada ({e})")
+            success = False
+            continue
+        except Exception as e:
+            print(f"[!] {variant}: error en la conversión: {e}")
+            success = False
+            continue
+
+        target_size = os.path.getsize(target_path)
+        print(f"[*] {variant}: {target_size / 1e6:.1f}MB "
+              f"({target_size / source_size * 100:.0f}% de fp32) en {time.time() - start:.1f}s")
+
+    return success
+
+
+def _peak_rss_mb():
+    """Memoria residente pico del proceso actual en MB"""
+    import resource
+
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _benchmark_variant(variant, model_path, voices_path, phonemes_list, voice, repeats, queue):
+    """Mide una variante en un proceso aislado para que la memoria no se mezcle"""
+    try:
+        from kokoro_onnx import Kokoro
+
+        rss_before = _peak_rss_mb()
+        load_start = time.time()
+        model = Kokoro(model_path, voices_path)
+        load_time = time.time() - load_start
+
+        # Calentamiento (la primera inferencia incluye inicialización de kernels)
+        model.create(phonemes_list[0], voice, is_phonemes=True)
+
+        outputs = []
+        inference_time = 0.0
+        audio_seconds = 0.0
+        for phonemes in phonemes_list:
+            for _ in range(repeats):
+                start = time.time()
+                samples, sample_rate = model.create(phonemes, voice, is_phonemes=True)
+                inference_time += time.time() - start
+                audio_seconds += len(samples) / sample_rate
+            outputs.append(np.asarray(samples, dtype=np.float32))
+
+        queue.put({
+            "variant": variant,
+            "load_time": load_time,
+            "inference_time": inference_time,
+            "audio_seconds": audio_seconds,
+            "rtf": inference_time / audio_seconds if audio_seconds else None,
+            "peak_rss_mb": _peak_rss_mb(),
+            "model_rss_mb": _peak_rss_mb() - rss_before,
+            "model_size_mb": os.path.getsize(model_path) / 1e6,
+            "outputs": outputs,
+        })
+    except Exception as e:
+        queue.put({"variant": variant, "error": str(e)})
+
+
+def _log_spectrogram(samples, n_fft=1024, hop=256):
+    """Espectrograma log-magnitud con ventana de Hann"""
+    if len(samples) < n_fft:
+        samples = np.pad(samples, (0, n_fft - len(samples)))
+    window = np.hanning(n_fft).astype(np.float32)
+    n_frames = 1 + (len(samples) - n_fft) // hop
+    frames = np.lib.stride_tricks.as_strided(
+        samples,
+        shape=(n_frames, n_fft),
+        strides=(samples.strides[0] * hop, samples.strides[0])
+    )
+    return np.log(np.abs(np.fft.rfft(frames * window, axis=1)) + 1e-6)
+
+
+def output_similarity(reference, candidate):
+    """Similitud entre dos salidas de audio (correlación y distancia espectral)"""
+    length = min(len(reference), len(candidate))
+    ref = reference[:length]
+    cand = candidate[:length]
+
+    denom = np.linalg.norm(ref) * np.linalg.norm(cand)
+    waveform_corr = float(np.dot(ref, cand) / denom) if denom else 0.0
+
+    spec_ref = _log_spectrogram(ref)
+    spec_cand = _log_spectrogram(cand)
+    spectral_distance = float(np.mean(np.abs(spec_ref - spec_cand)))
+
+    return {
+        "waveform_correlation": waveform_corr,
+        "log_spectral_distance": spectral_distance,
+        "duration_ratio": len(candidate) / len(reference) if len(reference) else None,
+    }
+
+
+def _collect_result(variant, process, queue, timeout):
+    """Resultado de un proceso de benchmark, o un error si muere sin responder o se agota el tiempo"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            pass
+        if not process.is_alive():
+            # Pudo escribir justo antes de terminar
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return {"variant": variant, "error": f"El proceso terminó sin resultado (exitcode={process.exitcode})"}
+        if time.time() > deadline:
+            process.terminate()
+            return {"variant": variant, "error": f"Sin resultado tras {timeout:.0f}s"}
+
+
+def command_compare(args):
+    """Compara velocidad, memoria y similitud de cada variante frente a fp32"""
+    from misaki.espeak import EspeakG2P
+
+    g2p = EspeakG2P(language=args.language)
+    texts = SAMPLE_TEXTS.get(args.language, SAMPLE_TEXTS["en"])
+    phonemes_list = [g2p(text)[0] for text in texts]
+
+    variants = [v for v in MODEL_VARIANTS if os.path.exists(MODEL_VARIANTS[v])]
+    if "fp32" not in variants:
+        print(f"[!] Se requiere el modelo fp32 como referencia: {MODEL_VARIANTS['fp32']}")
+        return False
+
+    print(f"[*] Comparando variantes: {', '.join(variants)}")
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for variant in variants:
+        queue = context.Queue()
+        process = context.Process(
+            target=_benchmark_variant,
+            args=(variant, MODEL_VARIANTS[variant], args.voices, phonemes_list,
+                  args.voice, args.repeats, queue)
+        )
+        process.start()
+        results[variant] = _collect_result(variant, process, queue, args.timeout)
+        process.join()
+        if "error" in results[variant]:
+            print(f"[!] {variant}: {results[variant]['error']}")
+
+    # Sin la referencia fp32 no hay con qué comparar el resto
+    if "error" in results["fp32"]:
+        print(f"[!] Falló la referencia fp32, no se puede comparar: {results['fp32']['error']}")
+        return False
+
+    reference = results["fp32"]["outputs"]
+    report = []
+    for variant in variants:
+        result = results[variant]
+        if "error" in result:
+            report.append({"variant": variant, "error": result["error"]})
+            continue
+
+        similarities = [output_similarity(ref, cand) for ref, cand in zip(reference, result.pop("outputs"))]
+        result["similarity"] = {
+            key: float(np.mean([s[key] for s in similarities]))
+            for key in similarities[0]
+        }
+        result["speedup_vs_fp32"] = results["fp32"]["inference_time"] / result["inference_time"]
+        report.append(result)
+
+    print()
+    print(f"{'Variante':<9}{'Tamaño':>10}{'Carga':>8}{'RTF':>8}{'Speedup':>9}{'RSS pico':>11}{'Corr.':>8}{'Dist. esp.':>12}")
+    for row in report:
+        if "error" in row:
+            print(f"{row['variant']:<9} ERROR: {row['error']}")
+            continue
+        print(f"{row['variant']:<9}"
+              f"{row['model_size_mb']:>8.1f}MB"
+              f"{row['load_time']:>7.2f}s"
+              f"{row['rtf']:>8.3f}"
+              f"{row['speedup_vs_fp32']:>8.2f}x"
+              f"{row['peak_rss_mb']:>9.0f}MB"
+              f"{row['similarity']['waveform_correlation']:>8.3f}"
+              f"{row['similarity']['log_spectral_distance']:>12.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[*] Informe guardado en {args.json}")
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Variantes de precisión del modelo Kokoro TTS v1.0")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = subparsers.add_parser("quantize", help="Generar variantes int8/fp16")
+    quantize_parser.add_argument("--model", default=MODEL_PATH, help="Modelo fp32 de origen")
+    quantize_parser.add_argument("--variants", nargs="+", choices=list(CONVERTERS), default=list(CONVERTERS))
+    quantize_parser.add_argument("--force", action="store_true", help="Regenerar variantes existentes")
+
+    compare_parser = subparsers.add_parser("compare", help="Comparar variantes frente a fp32")
+    compare_parser.add_argument("--voices", default=VOICES_PATH, help="Archivo de voces")
+    compare_parser.add_argument("--language", default="es", help="Idioma de las frases de prueba")
+    compare_parser.add_argument("--voice", default="ef_dora", help="Voz para las pruebas")
+    compare_parser.add_argument("--repeats", type=int, default=3, help="Repeticiones por frase")
+    compare_parser.add_argument("--json", help="Guardar informe en JSON")
+    compare_parser.add_argument("--timeout", type=float, default=1800, help="Segundos máximos por variante")
+
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        return command_quantize(args)
+    return command_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,284 @@
+"""
+Protocolo RPC binario de Kokoro TTS v1.0
+
+Alternativa a REST para llamadas internas: sin JSON+Base64 para el audio,
+una conexión TCP persistente multiplexada y streaming de audio desde el
+servidor.
+
+Formato de trama (big-endian):
+
+    tipo (u8) | método (u8) | stream_id (u32) | meta_len (u32) | data_len (u32)
+    meta: JSON UTF-8 pequeño (parámetros o metadatos)
+    data: bytes crudos (audio PCM o codificado)
+
+Cada petición usa un stream_id distinto; el servidor atiende varias
+peticiones de la misma conexión en paralelo y las respuestas se
+intercalan, identificadas por su stream_id.
+
+Métodos:
+- SYNTHESIZE: una trama RESPONSE con el audio completo
+- SYNTHESIZE_STREAM: tramas CHUNK por frase a medida que se sintetizan, y END
+- BATCH: una trama CHUNK por elemento (meta.index) y END
+
+Este módulo no depende de app.py: el servidor recibe las funciones del motor.
+"""
+
+import json
+import queue
+import socket
+import struct
+import itertools
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+HEADER = struct.Struct("!BBIII")
+
+# Tipos de trama
+REQUEST = 1
+RESPONSE = 2
+CHUNK = 3
+END = 4
+ERROR = 5
+
+# Métodos
+SYNTHESIZE = 1
+SYNTHESIZE_STREAM = 2
+BATCH = 3
+
+METHOD_NAMES = {
+    SYNTHESIZE: "synthesize",
+    SYNTHESIZE_STREAM: "synthesize_stream",
+    BATCH: "batch"
+}
+
+MAX_META_BYTES = 16 * 1024 * 1024
+MAX_DATA_BYTES = 512 * 1024 * 1024  # Audio de una respuesta
+MAX_REQUEST_DATA_BYTES = 1024 * 1024  # Las peticiones solo llevan metadatos
+
+
+class RpcError(Exception):
+    """Error RPC; meta lleva los campos adicionales de la trama ERROR (status, retry_after...)"""
+
+    def __init__(self, message, meta=None):
+        super().__init__(message)
+        self.meta = meta or {}
+
+
+def encode_frame(frame_type, method, stream_id, meta=None, data=b""):
+    meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+    return HEADER.pack(frame_type, method, stream_id, len(meta_bytes), len(data)) + meta_bytes + data
+
+
+def read_exact(sock_file, size):
+    data = sock_file.read(size)
+    if len(data) < size:
+        raise EOFError("Conexión cerrada")
+    return data
+
+
+def read_frame(sock_file, max_data_bytes=MAX_DATA_BYTES):
+    """Lee una trama completa; devuelve (tipo, método, stream_id, meta, data)"""
+    frame_type, method, stream_id, meta_len, data_len = HEADER.unpack(read_exact(sock_file, HEADER.size))
+    if meta_len > MAX_META_BYTES:
+        raise ValueError(f"Metadatos demasiado grandes: {meta_len}")
+    if data_len > max_data_bytes:
+        raise ValueError(f"Datos demasiado grandes: {data_len}")
+    meta = json.loads(read_exact(sock_file, meta_len)) if meta_len else {}
+    data = read_exact(sock_file, data_len) if data_len else b""
+    return frame_type, method, stream_id, meta, data
+
+
+class RpcRequestHandler(socketserver.StreamRequestHandler):
+    """Atiende una conexión: lee peticiones y las despacha en paralelo al pool del servidor"""
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        while True:
+            try:
+                frame_type, method, stream_id, meta, _ = read_frame(self.rfile, MAX_REQUEST_DATA_BYTES)
+            except (EOFError, ConnectionError, OSError):
+                return
+            except ValueError as e:
+                print(f"[!] RPC: trama inválida: {e}")
+                return
+
+            if frame_type != REQUEST or method not in METHOD_NAMES:
+                self.send(ERROR, method, stream_id, {"error": f"Invalid request (type={frame_type}, method={method})"})
+                continue
+
+            self.server.executor.submit(self.dispatch, method, stream_id, meta)
+
+    def send(self, frame_type, method, stream_id, meta=None, data=b""):
+        frame = encode_frame(frame_type, method, stream_id, meta, data)
+        with self.write_lock:
+            self.wfile.write(frame)
+            self.wfile.flush()
+
+    def dispatch(self, method, stream_id, meta):
+        engine = self.server.engine
+        try:
+            if method == SYNTHESIZE:
+                response_meta, data = engine["synthesize"](meta)
+                self.send(RESPONSE, method, stream_id, response_meta, data)
+            else:
+                handler = engine["synthesize_stream"] if method == SYNTHESIZE_STREAM else engine["batch"]
+                summary = {}
+                for chunk_meta, data in handler(meta):
+                    if chunk_meta.get("final"):
+                        summary = chunk_meta
+                        continue
+                    self.send(CHUNK, method, stream_id, chunk_meta, data)
+                self.send(END, method, stream_id, summary)
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            print(f"[!] RPC {METHOD_NAMES[method]}: {e}")
+            try:
+                self.send(ERROR, method, stream_id, dict(getattr(e, "meta", {}), error=str(e)))
+            except (ConnectionError, OSError):
+                pass
+
+
+class RpcServer(socketserver.ThreadingTCPServer):
+    """Servidor RPC; `engine` es un dict con las funciones synthesize, synthesize_stream y batch"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, engine, workers=8):
+        super().__init__(address, RpcRequestHandler)
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kokoro-rpc")
+
+
+def start_rpc_server(host, port, engine, workers=8):
+    """Arranca el servidor RPC en un hilo en segundo plano"""
+    server = RpcServer((host, port), engine, workers)
+    thread = threading.Thread(target=server.serve_forever, name="kokoro-rpc-server", daemon=True)
+    thread.start()
+    return server
+
+
+class RpcClient:
+    """Cliente RPC multiplexado: una conexión compartida por varios hilos
+
+    timeout limita la conexión y la espera de cada trama de respuesta
+    (RpcError si vence); el socket queda en modo bloqueante para el hilo lector.
+
+    Ejemplo:
+        client = RpcClient("localhost", 5003)
+        meta, pcm = client.synthesize(text="Hola", voice="ef_dora", format="pcm")
+        for meta, chunk in client.synthesize_stream(text=documento):
+            ...
+    """
+
+    def __init__(self, host="localhost", port=5003, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        # Sin esto el timeout de conexión cortaría el hilo lector en cuanto la conexión esté inactiva
+        self.sock.settimeout(None)
+        self.timeout = timeout
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        self.write_lock = threading.Lock()
+        self.streams = {}
+        self.streams_lock = threading.Lock()
+        self.stream_ids = itertools.count(1)
+        self.closed = False
+        self.reader = threading.Thread(target=self.read_loop, name="kokoro-rpc-client", daemon=True)
+        self.reader.start()
+
+    def read_loop(self):
+        try:
+            while True:
+                frame_type, method, stream_id, meta, data = read_frame(self.rfile)
+                with self.streams_lock:
+                    stream = self.streams.get(stream_id)
+                if stream is not None:
+                    stream.put((frame_type, meta, data))
+        except (EOFError, ConnectionError, OSError, ValueError) as e:
+            # Bajo el mismo lock que open_stream: ningún stream se registra tras este aviso sin verlo
+            with self.streams_lock:
+                self.closed = True
+                for stream in self.streams.values():
+                    stream.put((ERROR, {"error": f"Conexión cerrada: {e}"}, b""))
+
+    def open_stream(self, method, meta):
+        stream_id = next(self.stream_ids)
+        stream = queue.Queue()
+        with self.streams_lock:
+            if self.closed:
+                raise RpcError("Conexión cerrada")
+            self.streams[stream_id] = stream
+        frame = encode_frame(REQUEST, method, stream_id, meta)
+        try:
+            with self.write_lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            self.close_stream(stream_id)
+            raise RpcError(f"Conexión cerrada: {e}")
+        return stream_id, stream
+
+    def next_frame(self, stream):
+        try:
+            frame_type, meta, data = stream.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RpcError(f"Sin respuesta en {self.timeout}s")
+        if frame_type == ERROR:
+            raise RpcError(meta.get("error"), meta)
+        return frame_type, meta, data
+
+    def close_stream(self, stream_id):
+        with self.streams_lock:
+            self.streams.pop(stream_id, None)
+
+    def synthesize(self, **params):
+        """Síntesis completa; devuelve (metadatos, bytes de audio)"""
+        stream_id, stream = self.open_stream(SYNTHESIZE, params)
+        try:
+            _, meta, data = self.next_frame(stream)
+            return meta, data
+        finally:
+            self.close_stream(stream_id)
+
+    def synthesize_stream(self, **params):
+        """Síntesis en streaming; genera (metadatos, bytes) por frase"""
+        stream_id, stream = self.open_stream(SYNTHESIZE_STREAM, params)
+        try:
+            while True:
+                frame_type, meta, data = self.next_frame(stream)
+                if frame_type == END:
+                    return
+                yield meta, data
+        finally:
+            self.close_stream(stream_id)
+
+    def batch(self, items, **common):
+        """Síntesis por lotes; devuelve una lista de (metadatos, bytes) en el orden de items"""
+        stream_id, stream = self.open_stream(BATCH, dict(common, items=items))
+        results = [None] * len(items)
+        try:
+            while True:
+                frame_type, meta, data = self.next_frame(stream)
+                if frame_type == END:
+                    return results
+                results[meta["index"]] = (meta, data)
+        finally:
+            self.close_stream(stream_id)
+
+    def close(self):
+        with self.streams_lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
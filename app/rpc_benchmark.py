@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la interfaz RPC binaria frente a REST en Kokoro TTS v1.0
+
+Lanza las mismas peticiones por:
+- REST /synthesize (audio binario, conexión keep-alive por hilo)
+- REST /synthesize_json (audio en Base64 dentro de JSON)
+- RPC synthesize (una única conexión multiplexada compartida por todos los hilos)
+
+y compara latencia (p50/p95), rendimiento y bytes recibidos. Por defecto
+cada petición lleva un texto distinto para medir síntesis real; con
+--cached se repite el mismo texto y se mide el coste del transporte.
+
+Ejecución (servicio arrancado con RPC_PORT=5003):
+    python3 rpc_benchmark.py --requests 50 --concurrency 4
+    python3 rpc_benchmark.py --cached --format pcm
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from rpc import RpcClient
+
+SAMPLE_TEXT = "Hola, esta es una prueba de rendimiento de la interfaz binaria del servicio Kokoro."
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def build_texts(count, cached):
+    if cached:
+        return [SAMPLE_TEXT] * count
+    return [f"{SAMPLE_TEXT} Petición número {i}." for i in range(count)]
+
+
+def run(name, texts, concurrency, call):
+    """Ejecuta call(text) -> bytes recibidos con el nivel de concurrencia indicado"""
+    latencies = []
+    received = 0
+    errors = 0
+    lock = threading.Lock()
+
+    def task(text):
+        nonlocal received, errors
+        start = time.time()
+        try:
+            size = call(text)
+        except Exception as e:
+            with lock:
+                errors += 1
+            print(f"[!] {name}: {e}")
+            return
+        with lock:
+            latencies.append(time.time() - start)
+            received += size
+
+    wall_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(task, texts))
+    wall = time.time() - wall_start
+
+    return {
+        "transport": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "throughput_rps": len(latencies) / wall,
+        "bytes_received": received
+    }
+
+
+def rest_caller(host, port, path, params, binary):
+    """Cliente REST con una conexión keep-alive por hilo"""
+    local = threading.local()
+
+    def call(text):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(host, port, timeout=120)
+        body = json.dumps(dict(params, text=text))
+        local.conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = local.conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {data[:200]!r}")
+        if not binary:
+            json.loads(data)
+        return len(data)
+
+    return call
+
+
+def rpc_caller(client, params):
+    def call(text):
+        _, data = client.synthesize(text=text, **params)
+        return len(data)
+
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RPC binario vs REST")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5002, help="Puerto REST")
+    parser.add_argument("--rpc-port", type=int, default=5003, help="Puerto RPC")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--format", default="wav", help="Formato para REST /synthesize y RPC")
+    parser.add_argument("--voice", default="ef_dora")
+    parser.add_argument("--cached", action="store_true", help="Repetir el mismo texto (mide solo el transporte)")
+    parser.add_argument("--json", help="Guardar informe en JSON")
+    args = parser.parse_args()
+
+    params = {"voice": args.voice, "language": "es"}
+    report = []
+
+    # Cada transporte usa textos propios para que ninguno se beneficie de la caché de otro
+    for name, path, binary in (("rest", "/synthesize", True), ("rest_json", "/synthesize_json", False)):
+        texts = [f"{text} ({name})" for text in build_texts(args.requests, args.cached)]
+        request_params = dict(params, format=args.format) if binary else params
+        report.append(run(name, texts, args.concurrency,
+                          rest_caller(args.host, args.port, path, request_params, binary)))
+
+    with RpcClient(args.host, args.rpc_port) as client:
+        texts = [f"{text} (rpc)" for text in build_texts(args.requests, args.cached)]
+        report.append(run("rpc", texts, args.concurrency, rpc_caller(client, dict(params, format=args.format))))
+
+    print()
+    print(f"{'Transporte':<12}{'OK':>6}{'Errores':>9}{'p50':>10}{'p95':>10}{'req/s':>9}{'Recibido':>12}")
+    for row in report:
+        if not row["requests"]:
+            print(f"{row['transport']:<12}{0:>6}{row['errors']:>9}")
+            continue
+        print(f"{row['transport']:<12}{row['requests']:>6}{row['errors']:>9}"
+              f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms"
+              f"{row['throughput_rps']:>9.1f}{row['bytes_received'] / 1e6:>10.2f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[*] Informe guardado en {args.json}")
+
+    return all(row["errors"] == 0 for row in report)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
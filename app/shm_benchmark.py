@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark del canal de audio en memoria compartida frente a HTTP en Kokoro TTS v1.0
+
+Lanza las mismas peticiones por:
+- HTTP /synthesize con format=pcm (el audio viaja en el cuerpo de la respuesta)
+- HTTP /synthesize_json con output=shm (la respuesta solo lleva el handle)
+- RPC synthesize con output=shm (si se indica --rpc-port)
+
+En todos los casos el consumidor recorre las muestras PCM (numpy.frombuffer)
+para medir hasta que el audio está disponible. Se comparan latencia
+(p50/p95), rendimiento y bytes recibidos por el socket. Con --cached se
+repite el mismo texto y se mide solo el transporte.
+
+Ejecución (mismo host, servicio con SHM_RING_SIZE_MB=64):
+    python3 shm_benchmark.py --requests 50 --concurrency 4 --cached
+"""
+
+import sys
+import json
+import argparse
+import threading
+import http.client
+
+import numpy as np
+
+from rpc_benchmark import build_texts, run
+from shm_consumer import ShmAudioConsumer
+
+
+def consume(pcm):
+    """Recorre las muestras como lo haría un servidor de medios (sin copiarlas)"""
+    samples = np.frombuffer(pcm, dtype="<i2")
+    return max(int(samples.max(initial=0)), -int(samples.min(initial=0)))
+
+
+def http_caller(host, port, params):
+    """HTTP /synthesize con una conexión keep-alive por hilo; el PCM llega en el cuerpo"""
+    local = threading.local()
+
+    def call(text):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(host, port, timeout=120)
+        local.conn.request("POST", "/synthesize", body=json.dumps(dict(params, text=text)),
+                           headers={"Content-Type": "application/json"})
+        response = local.conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {data[:200]!r}")
+        consume(data)
+        return len(data)
+
+    return call
+
+
+def shm_caller(host, port, rpc_port, params):
+    """Un consumidor por hilo; devuelve los bytes recibidos por el socket (solo metadatos)"""
+    local = threading.local()
+
+    def call(text):
+        if not hasattr(local, "consumer"):
+            local.consumer = ShmAudioConsumer(host, port, rpc_port)
+        meta, handle = local.consumer.synthesize(text, **params)
+        with local.consumer.view(handle) as pcm:
+            consume(pcm)
+        if not local.consumer.is_valid(handle):
+            raise RuntimeError("Audio sobrescrito durante la lectura")
+        return len(json.dumps(meta))
+
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memoria compartida vs HTTP")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5002, help="Puerto REST")
+    parser.add_argument("--rpc-port", type=int, help="Incluir RPC con output=shm")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--voice", default="ef_dora")
+    parser.add_argument("--cached", action="store_true", help="Repetir el mismo texto (mide solo el transporte)")
+    parser.add_argument("--json", help="Guardar informe en JSON")
+    args = parser.parse_args()
+
+    params = {"voice": args.voice, "language": "es", "format": "pcm"}
+    transports = [("http_pcm", http_caller(args.host, args.port, params)),
+                  ("http_shm", shm_caller(args.host, args.port, None, params))]
+    if args.rpc_port:
+        transports.append(("rpc_shm", shm_caller(args.host, args.port, args.rpc_port, params)))
+
+    # Cada transporte usa textos propios para que ninguno se beneficie de la caché de otro
+    report = []
+    for name, call in transports:
+        texts = [f"{text} ({name})" for text in build_texts(args.requests, args.cached)]
+        report.append(run(name, texts, args.concurrency, call))
+
+    print()
+    print(f"{'Transporte':<12}{'OK':>6}{'Errores':>9}{'p50':>10}{'p95':>10}{'req/s':>9}{'Socket':>12}")
+    for row in report:
+        if not row["requests"]:
+            print(f"{row['transport']:<12}{0:>6}{row['errors']:>9}")
+            continue
+        print(f"{row['transport']:<12}{row['requests']:>6}{row['errors']:>9}"
+              f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms"
+              f"{row['throughput_rps']:>9.1f}{row['bytes_received'] / 1e6:>10.2f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[*] Informe guardado en {args.json}")
+
+    return all(row["errors"] == 0 for row in report)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
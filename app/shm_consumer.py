@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Consumidor de referencia del canal de audio en memoria compartida de Kokoro TTS v1.0
+
+Pide la síntesis con "output": "shm" (por HTTP /synthesize_json o por RPC)
+y lee el audio directamente del buffer circular del servicio, sin que
+viaje por el socket. Debe ejecutarse en el mismo host (o contenedor con
+el mismo /dev/shm) que un servicio arrancado con SHM_RING_SIZE_MB > 0.
+
+Ejecución:
+    python3 shm_consumer.py "Hola, esto es una prueba" --output prueba.wav
+    python3 shm_consumer.py "Hola" --rpc-port 5003 --output prueba.wav
+"""
+
+import sys
+import json
+import wave
+import argparse
+import http.client
+
+from rpc import RpcClient
+from shm_ring import ShmRingReader, ShmRingError
+
+
+class ShmAudioConsumer:
+    """Pide audio con output=shm y lo entrega como memoryview sobre la memoria compartida
+
+    Ejemplo:
+        with ShmAudioConsumer("localhost", 5002) as consumer:
+            meta, handle = consumer.synthesize("Hola mundo", voice="ef_dora")
+            with consumer.view(handle) as pcm:
+                reproducir(pcm, meta["sample_rate"])
+            if not consumer.is_valid(handle):
+                ...  # el servicio sobrescribió el audio durante la lectura
+    """
+
+    def __init__(self, host="localhost", port=5002, rpc_port=None, timeout=120):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.rpc = RpcClient(host, rpc_port, timeout=timeout) if rpc_port else None
+        self.readers = {}
+
+    def synthesize(self, text, **params):
+        """Síntesis en PCM (por defecto) sobre el buffer; devuelve (metadatos, handle)"""
+        params = dict({"format": "pcm"}, **params, text=text, output="shm")
+        if self.rpc:
+            meta, _ = self.rpc.synthesize(**params)
+            return meta, meta["shm"]
+
+        self.conn.request("POST", "/synthesize_json", body=json.dumps(params),
+                          headers={"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        meta = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {meta.get('error')}")
+        return meta, meta["shm"]
+
+    def reader(self, handle):
+        reader = self.readers.get(handle["name"])
+        if reader is None:
+            reader = self.readers[handle["name"]] = ShmRingReader(handle["name"])
+        return reader
+
+    def view(self, handle):
+        """memoryview del audio en la memoria compartida (sin copia)"""
+        return self.reader(handle).view(handle)
+
+    def is_valid(self, handle):
+        return self.reader(handle).is_valid(handle)
+
+    def read(self, handle):
+        """Copia verificada del audio"""
+        return self.reader(handle).read(handle)
+
+    def close(self):
+        self.conn.close()
+        if self.rpc:
+            self.rpc.close()
+        for reader in self.readers.values():
+            reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consumidor del canal de audio en memoria compartida")
+    parser.add_argument("text")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5002, help="Puerto REST")
+    parser.add_argument("--rpc-port", type=int, help="Usar RPC en lugar de HTTP")
+    parser.add_argument("--voice", default="ef_dora")
+    parser.add_argument("--language", default="es")
+    parser.add_argument("--output", help="Guardar el audio en un WAV")
+    args = parser.parse_args()
+
+    with ShmAudioConsumer(args.host, args.port, args.rpc_port) as consumer:
+        meta, handle = consumer.synthesize(args.text, voice=args.voice, language=args.language)
+        print(f"[*] Audio en /dev/shm/{handle['name']}: offset={handle['offset']}, "
+              f"{handle['length']} bytes, {meta['sample_rate']} Hz")
+
+        try:
+            with consumer.view(handle) as pcm:
+                if args.output:
+                    # PCM 16-bit mono: se escribe desde la memoria compartida sin copia intermedia
+                    with wave.open(args.output, "wb") as wav:
+                        wav.setnchannels(1)
+                        wav.setsampwidth(2)
+                        wav.setframerate(meta["sample_rate"])
+                        wav.writeframes(pcm)
+        except ShmRingError as e:
+            print(f"[!] {e}")
+            return False
+
+        if not consumer.is_valid(handle):
+            print("[!] El audio se sobrescribió durante la lectura (buffer demasiado pequeño)")
+            return False
+
+        print(f"[*] {handle['length'] / 2 / meta['sample_rate']:.2f}s de audio leídos"
+              + (f" -> {args.output}" if args.output else ""))
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,159 @@
+"""
+Canal de audio en memoria compartida de Kokoro TTS v1.0
+
+Para consumidores en el mismo host (p. ej. un servidor de medios): el
+servicio escribe el audio de cada síntesis en un buffer circular en
+memoria compartida y la respuesta HTTP/RPC solo lleva un handle con la
+posición. El consumidor lee el audio directamente del segmento, sin
+recibirlo por el socket ni copiarlo.
+
+Distribución del segmento (little-endian):
+
+    magic (8s) | versión (u32) | reservado (u32) | capacidad (u64) | cabeza (u64)
+    datos: `capacidad` bytes
+
+La cabeza es el total de bytes reservados desde el arranque (monótona).
+Cada registro es contiguo y empieza alineado a ALIGN bytes; si no cabe al
+final del buffer se salta al inicio. El escritor avanza la cabeza antes de
+copiar los datos, de modo que un registro sigue siendo válido mientras
+cabeza <= posición + capacidad. El consumidor comprueba la validez después
+de leer (como un seqlock): si el escritor dio la vuelta mientras tanto, el
+audio leído no es fiable.
+
+Este módulo no depende de app.py.
+"""
+
+import struct
+import threading
+from multiprocessing import shared_memory, resource_tracker
+
+MAGIC = b"KOKORING"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+HEAD = struct.Struct("<Q")
+HEAD_OFFSET = 24
+ALIGN = 64
+
+
+class ShmRingError(Exception):
+    """Registro inexistente, demasiado grande o ya sobrescrito"""
+
+
+def align(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+class ShmRingWriter:
+    """Escritor del buffer circular (un único proceso; seguro entre hilos)
+
+    Crea el segmento y falla con ShmRingError si ya existe.
+    """
+
+    def __init__(self, name, size):
+        self.capacity = align(size)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER.size + self.capacity)
+        except FileExistsError:
+            # Nunca se borra un segmento ajeno: puede tener lectores o ser de otro proceso vivo
+            raise ShmRingError(f"El segmento /dev/shm/{name} ya existe (otro proceso o una ejecución "
+                               f"anterior); elimínalo a mano si está huérfano") from None
+        self.name = name
+        self.head = 0
+        self.lock = threading.Lock()
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, 0, self.capacity, 0)
+
+    def write(self, data):
+        """Copia data en el buffer y devuelve su handle (dict serializable en JSON)"""
+        length = len(data)
+        if length > self.capacity:
+            raise ShmRingError(f"Registro demasiado grande para el buffer: {length} > {self.capacity}")
+
+        with self.lock:
+            offset = self.head % self.capacity
+            if offset + length > self.capacity:
+                self.head += self.capacity - offset
+                offset = 0
+            position = self.head
+            self.head = position + align(length)
+            # La cabeza se publica antes de sobrescribir: los lectores detectan el solape
+            HEAD.pack_into(self.shm.buf, HEAD_OFFSET, self.head)
+            start = HEADER.size + offset
+            self.shm.buf[start:start + length] = data
+
+        return {
+            "name": self.name,
+            "offset": start,
+            "length": length,
+            "position": position,
+            "capacity": self.capacity
+        }
+
+    def stats(self):
+        return {"name": self.name, "capacity": self.capacity, "head": self.head}
+
+    def close(self, unlink=True):
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ShmRingReader:
+    """Lector del buffer circular desde otro proceso del mismo host
+
+    Ejemplo:
+        reader = ShmRingReader(handle["name"])
+        with reader.view(handle) as audio:
+            samples = numpy.frombuffer(audio, dtype="<i2")  # sin copia
+            ...
+        if not reader.is_valid(handle):
+            ...  # el escritor sobrescribió el registro durante la lectura
+    """
+
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Sin esto, el resource_tracker de este proceso eliminaría el segmento al salir (Python < 3.13)
+        try:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        magic, version, _, self.capacity, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ShmRingError(f"Segmento {name} no es un buffer de audio de Kokoro (versión {version})")
+        self.name = name
+
+    def head(self):
+        return HEAD.unpack_from(self.shm.buf, HEAD_OFFSET)[0]
+
+    def is_valid(self, handle):
+        """True si el registro no ha sido sobrescrito"""
+        return self.head() <= handle["position"] + self.capacity
+
+    def view(self, handle):
+        """memoryview del registro sobre la memoria compartida (sin copia)
+
+        Hay que liberar la vista (release() o bloque with) antes de close().
+        """
+        if not self.is_valid(handle):
+            raise ShmRingError(f"Registro en la posición {handle['position']} ya sobrescrito")
+        return self.shm.buf[handle["offset"]:handle["offset"] + handle["length"]]
+
+    def read(self, handle):
+        """Copia del registro, verificada tras la lectura"""
+        with self.view(handle) as view:
+            data = bytes(view)
+        if not self.is_valid(handle):
+            raise ShmRingError(f"Registro en la posición {handle['position']} sobrescrito durante la lectura")
+        return data
+
+    def close(self):
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -25,13 +25,21 @@ import os
 import sys
 import time
 import json
+import array
+import shutil
+import tempfile
+import subprocess
 import urllib.request
 import urllib.parse
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Configuración
 BASE_URL = os.getenv('KOKORO_TTS_TEST_URL', 'http://localhost:5002')
+RPC_PORT = int(os.getenv('KOKORO_TTS_RPC_PORT', 0))  # Puerto RPC binario (0 = no probar)
+ADMIN_TOKEN = os.getenv('KOKORO_TTS_ADMIN_TOKEN', '')  # Token de /admin/* (vacío = no probar)
+STORAGE_PATH = os.getenv('KOKORO_TTS_STORAGE_PATH', '')  # STORAGE_DIR del servicio visto por los tests (vacío = no probar prerender)
 TEST_TIMEOUT = 30
 VERBOSE = False
 
@@ -116,8 +124,8 @@ class TestRunner:
         return self.tests_failed == 0
 
 
-def make_request(url, method='GET', data=None, headers=None):
-    """Hacer petición HTTP usando urllib"""
+def make_request(url, method='GET', data=None, headers=None, binary=False):
+    """Hacer petición HTTP usando urllib (binary=True devuelve el contenido sin decodificar)"""
     try:
         if headers is None:
             headers = {}
@@ -134,7 +142,9 @@ def make_request(url, method='GET', data=None, headers=None):
         req = urllib.request.Request(url, data=data, headers=headers, method=method)
         
         with urllib.request.urlopen(req, timeout=TEST_TIMEOUT) as response:
-            content = response.read().decode('utf-8')
+            content = response.read()
+            if not binary:
+                content = content.decode('utf-8')
             return {
                 'status_code': response.getcode(),
                 'content': content,
@@ -144,13 +154,27 @@ def make_request(url, method='GET', data=None, headers=None):
     except urllib.error.HTTPError as e:
         return {
             'status_code': e.code,
-            'content': e.read().decode('utf-8') if e.fp else '',
+            'content': e.read().decode('utf-8', errors='replace') if e.fp else '',
             'headers': dict(e.headers) if e.headers else {}
         }
     except Exception as e:
         raise Exception(f"Request failed: {e}")
 
 
+def admin_headers():
+    """Cabeceras de autenticación de los endpoints /admin/*"""
+    return {'X-Admin-Token': ADMIN_TOKEN}
+
+
+def wait_for_job(job):
+    """Consulta el estado de un trabajo hasta que termine (o venza TEST_TIMEOUT)"""
+    deadline = time.time() + TEST_TIMEOUT
+    while job['status'] not in ('completed', 'failed') and time.time() < deadline:
+        time.sleep(0.5)
+        job = json.loads(make_request(f"{BASE_URL}{job['status_url']}")['content'])
+    return job
+
+
 def test_service_health():
     """Test básico de conectividad y salud del servicio"""
     response = make_request(f"{BASE_URL}/health")
@@ -193,6 +217,47 @@ def test_service_health():
     return True
 
 
+def test_circuit_breakers():
+    """Test estado de los circuit breakers en /health"""
+    response = make_request(f"{BASE_URL}/health")
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error en /health: {response['status_code']}")
+        return False
+    
+    data = json.loads(response['content'])
+    breakers = data.get('circuit_breakers') or {}
+    default = breakers.get(data.get('model_precision'))
+    if not default:
+        if VERBOSE:
+            print(f"❌ /health sin circuit breaker del modelo por defecto: {list(breakers.keys())}")
+        return False
+    
+    for name, breaker in breakers.items():
+        if breaker.get('state') not in ('closed', 'open', 'half_open') or 'consecutive_failures' not in breaker:
+            if VERBOSE:
+                print(f"❌ Estado de circuito inválido ({name}): {breaker}")
+            return False
+    
+    # El estado global refleja el circuito del modelo por defecto
+    expected = {'closed': 'healthy', 'half_open': 'recovering'}.get(default['state'], 'degraded')
+    if data['status'] != expected:
+        if VERBOSE:
+            print(f"❌ status={data['status']} con el circuito {default['state']}")
+        return False
+    
+    if 'fallback' not in data:
+        if VERBOSE:
+            print("❌ /health no informa del motor de fallback")
+        return False
+    
+    if VERBOSE:
+        states = ", ".join(f"{name}={breaker['state']}" for name, breaker in breakers.items())
+        print(f"✅ Circuitos: {states}; estado del servicio: {data['status']}")
+    
+    return True
+
+
 def test_languages_endpoint():
     """Test endpoint de idiomas soportados"""
     response = make_request(f"{BASE_URL}/languages")
@@ -438,6 +503,857 @@ def test_batch_synthesis():
     return True
 
 
+def test_http_caching():
+    """Test ETag, Cache-Control y peticiones condicionales (304) en GET /synthesize"""
+    query = urllib.parse.urlencode({
+        "text": "Prueba de caché HTTP con ETag",
+        "language": "es",
+        "voice": "ef_dora"
+    })
+    url = f"{BASE_URL}/synthesize?{query}"
+    
+    response = make_request(url, binary=True)
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error en GET /synthesize: {response['status_code']}")
+        return False
+    
+    etag = response['headers'].get('ETag')
+    if not etag or 'max-age' not in response['headers'].get('Cache-Control', ''):
+        if VERBOSE:
+            print(f"❌ Cabeceras de caché ausentes: {response['headers']}")
+        return False
+    
+    # La misma petición debe producir el mismo ETag
+    repeated = make_request(url, binary=True)
+    if repeated['headers'].get('ETag') != etag or repeated['content'] != response['content']:
+        if VERBOSE:
+            print("❌ La respuesta no es determinista")
+        return False
+    
+    # Petición condicional: 304 sin cuerpo
+    conditional = make_request(url, headers={'If-None-Match': etag})
+    if conditional['status_code'] != 304:
+        if VERBOSE:
+            print(f"❌ If-None-Match debería dar 304, dio: {conditional['status_code']}")
+        return False
+    
+    # OGG no es byte a byte determinista: su ETag debe ser débil
+    ogg = make_request(f"{url}&format=ogg", binary=True)
+    if ogg['status_code'] != 200 or not ogg['headers'].get('ETag', '').startswith('W/'):
+        if VERBOSE:
+            print(f"❌ format=ogg debería llevar un ETag débil: {ogg['headers'].get('ETag')}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ ETag {etag} estable, 304 en petición condicional, ETag débil para OGG")
+    
+    return True
+
+
+def get_counters():
+    """Contadores de /metrics (dict vacío si no están disponibles)"""
+    response = make_request(f"{BASE_URL}/metrics")
+    if response['status_code'] != 200:
+        return {}
+    return json.loads(response['content']).get('counters', {})
+
+
+def test_request_coalescing():
+    """Test coalescencia: peticiones idénticas simultáneas comparten una única inferencia"""
+    payload = {
+        "text": f"Prueba de coalescencia de peticiones idénticas, ejecución {time.time()}. " * 4,
+        "language": "es",
+        "voice": "ef_dora"
+    }
+    saved_before = get_counters().get('inferences_saved', 0)
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(
+            lambda _: make_request(f"{BASE_URL}/synthesize", method='POST', data=payload, binary=True),
+            range(8)))
+    
+    if any(response['status_code'] != 200 for response in responses):
+        if VERBOSE:
+            print(f"❌ Peticiones concurrentes fallidas: {[r['status_code'] for r in responses]}")
+        return False
+    
+    if len({response['content'] for response in responses}) != 1:
+        if VERBOSE:
+            print("❌ Las peticiones idénticas devolvieron audio distinto")
+        return False
+    
+    saved = get_counters().get('inferences_saved', 0) - saved_before
+    if saved < 1:
+        if VERBOSE:
+            print("❌ inferences_saved no aumentó con 8 peticiones idénticas simultáneas")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ 8 peticiones idénticas simultáneas, {saved} inferencias ahorradas")
+    
+    return True
+
+
+def test_segment_cache():
+    """Test caché de segmentos: textos que comparten frases reutilizan su audio"""
+    run_id = time.time()
+    shared = f"Esta frase se repite en ambos textos, ejecución {run_id}. Y esta también se repite."
+    hits_before = get_counters().get('segment_cache_hits', 0)
+    
+    for ending in ("Primer final distinto.", "Segundo final distinto."):
+        payload = {"text": f"{shared} {ending}", "language": "es", "voice": "ef_dora", "segment_cache": True}
+        response = make_request(f"{BASE_URL}/synthesize", method='POST', data=payload, binary=True)
+        if response['status_code'] != 200:
+            if VERBOSE:
+                print(f"❌ Síntesis con segment_cache falló: {response['status_code']}")
+            return False
+    
+    hits = get_counters().get('segment_cache_hits', 0) - hits_before
+    if hits < 1:
+        if VERBOSE:
+            print("❌ segment_cache_hits no aumentó con frases compartidas")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ {hits} segmentos reutilizados entre dos textos solapados")
+    
+    return True
+
+
+def test_range_artifacts():
+    """Test artefactos largos servidos con HTTP Range"""
+    payload = {
+        "text": "Capítulo uno. Era una mañana tranquila en el pueblo. " * 10,
+        "language": "es",
+        "voice": "ef_dora"
+    }
+    
+    response = make_request(f"{BASE_URL}/artifacts", method='POST', data=payload)
+    if response['status_code'] not in [200, 201]:
+        if VERBOSE:
+            print(f"❌ Error creando artefacto: {response['status_code']}")
+        return False
+    
+    data = json.loads(response['content'])
+    size = data.get('size_bytes', 0)
+    if size <= 100:
+        if VERBOSE:
+            print(f"❌ Tamaño de artefacto inválido: {size}")
+        return False
+    
+    # Petición parcial: solo los primeros 100 bytes
+    partial = make_request(f"{BASE_URL}{data['url']}", headers={'Range': 'bytes=0-99'}, binary=True)
+    if partial['status_code'] != 206 or len(partial['content']) != 100:
+        if VERBOSE:
+            print(f"❌ Range debería dar 206 con 100 bytes, dio: {partial['status_code']}")
+        return False
+    
+    if partial['headers'].get('Content-Range') != f"bytes 0-99/{size}":
+        if VERBOSE:
+            print(f"❌ Content-Range incorrecto: {partial['headers'].get('Content-Range')}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ Artefacto de {size} bytes ({data.get('duration', 0):.1f}s), Range 206 correcto")
+    
+    return True
+
+
+def test_async_jobs():
+    """Test API de trabajos asíncronos (envío, progreso y descarga)"""
+    payload = {
+        "text": "Este es un documento largo de prueba. Tiene varias frases. " * 8,
+        "language": "es",
+        "voice": "ef_dora"
+    }
+    
+    response = make_request(f"{BASE_URL}/jobs", method='POST', data=payload)
+    if response['status_code'] != 202:
+        if VERBOSE:
+            print(f"❌ Envío de trabajo debería dar 202, dio: {response['status_code']}")
+        return False
+    
+    # Consultar progreso hasta que termine
+    job = wait_for_job(json.loads(response['content']))
+    
+    if job['status'] != 'completed':
+        if VERBOSE:
+            print(f"❌ Trabajo no completado: {job['status']} {job.get('error', '')}")
+        return False
+    
+    audio = make_request(f"{BASE_URL}{job['audio_url']}", binary=True)
+    if audio['status_code'] != 200 or len(audio['content']) != job['result']['size_bytes']:
+        if VERBOSE:
+            print(f"❌ Error descargando audio del trabajo: {audio['status_code']}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ Trabajo completado - {job['total_chunks']} fragmentos, {job['result']['duration']:.1f}s de audio")
+    
+    return True
+
+
+def test_job_resume():
+    """Test reanudación de trabajos: solo se sintetizan los fragmentos que faltan en disco"""
+    if not STORAGE_PATH:
+        if VERBOSE:
+            print("⚠️  KOKORO_TTS_STORAGE_PATH no definido, se omite el test de reanudación")
+        return True
+    
+    payload = {
+        "text": f"Documento para reanudar, ejecución {time.time()}. Tiene varias frases de relleno. " * 12,
+        "language": "es",
+        "voice": "ef_dora"
+    }
+    response = make_request(f"{BASE_URL}/jobs", method='POST', data=payload)
+    job = wait_for_job(json.loads(response['content'])) if response['status_code'] == 202 else {}
+    if job.get('status') != 'completed' or job['total_chunks'] < 2:
+        if VERBOSE:
+            print(f"❌ El trabajo inicial no se completó con varios fragmentos: {job.get('status')}")
+        return False
+    
+    # Simular una caída a mitad: falta el último fragmento y el trabajo quedó como fallido
+    job_dir = os.path.join(STORAGE_PATH, 'jobs', job['job_id'])
+    chunk_paths = [os.path.join(job_dir, f"chunk_{index:05d}.wav") for index in range(job['total_chunks'])]
+    os.remove(chunk_paths[-1])
+    kept_mtimes = [os.path.getmtime(path) for path in chunk_paths[:-1]]
+    with open(os.path.join(job_dir, 'job.json')) as f:
+        state = json.load(f)
+    state.update(status='failed', completed_chunks=job['total_chunks'] - 1, error='simulated crash')
+    state.pop('result', None)
+    with open(os.path.join(job_dir, 'job.json'), 'w') as f:
+        json.dump(state, f)
+    
+    synthesized_before = get_counters().get('job_chunks_synthesized', 0)
+    response = make_request(f"{BASE_URL}/jobs/{job['job_id']}/resume", method='POST')
+    job = wait_for_job(json.loads(response['content'])) if response['status_code'] == 202 else {}
+    synthesized = get_counters().get('job_chunks_synthesized', 0) - synthesized_before
+    
+    if job.get('status') != 'completed':
+        if VERBOSE:
+            print(f"❌ El trabajo reanudado no se completó: {job.get('status')} {job.get('error', '')}")
+        return False
+    if synthesized != 1 or [os.path.getmtime(path) for path in chunk_paths[:-1]] != kept_mtimes:
+        if VERBOSE:
+            print(f"❌ La reanudación debería sintetizar solo el fragmento perdido, sintetizó {synthesized}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ Reanudado: 1 de {job['total_chunks']} fragmentos sintetizado, el resto reutilizado de disco")
+    
+    return True
+
+
+def test_phoneme_input():
+    """Test /phonemize y síntesis a partir de fonemas precalculados"""
+    response = make_request(f"{BASE_URL}/phonemize", method='POST',
+                            data={"text": "Hola, esto es una prueba", "language": "es"})
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error en /phonemize: {response['status_code']}")
+        return False
+    
+    phonemes = json.loads(response['content']).get('phonemes')
+    if not phonemes:
+        if VERBOSE:
+            print("❌ /phonemize no devolvió fonemas")
+        return False
+    
+    payload = {"phonemes": phonemes, "language": "es", "voice": "ef_dora"}
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST', data=payload)
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Síntesis con fonemas falló: {response['status_code']}")
+        return False
+    
+    data = json.loads(response['content'])
+    if data.get('audio_duration', 0) <= 0:
+        if VERBOSE:
+            print(f"❌ Duración de audio inválida: {data.get('audio_duration')}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ Fonemas: {phonemes[:40]}... -> {data['audio_duration']:.2f}s de audio")
+    
+    return True
+
+
+def test_postprocess():
+    """Test postproceso del audio: más corto que la salida cruda y opciones inválidas rechazadas"""
+    text = f"Primera frase de la prueba. Segunda frase, ejecución {int(time.time())}."
+    durations = {}
+    for name, postprocess in (("raw", False), ("post", {"normalize": "lufs", "pause_ms": 150})):
+        response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                                data={"text": text, "language": "es", "postprocess": postprocess})
+        if response['status_code'] != 200:
+            if VERBOSE:
+                print(f"❌ Síntesis {name} falló: {response['status_code']}")
+            return False
+        durations[name] = json.loads(response['content'])
+    
+    if 'postprocess_ms' not in durations['post'] or \
+            durations['post']['audio_duration'] > durations['raw']['audio_duration']:
+        if VERBOSE:
+            print(f"❌ Postproceso incorrecto: {durations['raw']['audio_duration']:.2f}s -> "
+                  f"{durations['post']['audio_duration']:.2f}s")
+        return False
+    
+    # Los trabajos también aplican el postproceso (pico a -20 dBFS = 3277 en PCM 16-bit)
+    response = make_request(f"{BASE_URL}/jobs", method='POST',
+                            data={"text": text, "format": "pcm", "postprocess": {"normalize": "peak", "target": -20}})
+    job = wait_for_job(json.loads(response['content'])) if response['status_code'] == 202 else {}
+    if job.get('status') != 'completed':
+        if VERBOSE:
+            print(f"❌ Trabajo con postproceso no completado: {response['status_code']} {job.get('error', '')}")
+        return False
+    samples = array.array('h', make_request(f"{BASE_URL}{job['audio_url']}", binary=True)['content'])
+    peak = max(abs(min(samples)), max(samples))
+    if not 3100 <= peak <= 3450:
+        if VERBOSE:
+            print(f"❌ El trabajo no aplicó la normalización de pico: {peak}")
+        return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": text, "postprocess": {"normalize": "loud"}})
+    if response['status_code'] != 400:
+        if VERBOSE:
+            print(f"❌ Normalización inválida debería dar 400, dio: {response['status_code']}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ {durations['raw']['audio_duration']:.2f}s -> {durations['post']['audio_duration']:.2f}s "
+              f"({durations['post']['postprocess_ms']:.1f} ms de postproceso)")
+    
+    return True
+
+
+def test_pronunciation_lexicon():
+    """Test léxico de pronunciación: la entrada añadida sustituye al G2P y se puede retirar"""
+    if not ADMIN_TOKEN:
+        if VERBOSE:
+            print("⚠️  KOKORO_TTS_ADMIN_TOKEN no definido, se omite el test del léxico")
+        return True
+    
+    response = make_request(f"{BASE_URL}/admin/lexicon", method='POST', data={"entries": {}})
+    if response['status_code'] != 401:
+        if VERBOSE:
+            print(f"❌ /admin/lexicon sin token debería dar 401, dio: {response['status_code']}")
+        return False
+    
+    word = f"Kokorotest{int(time.time())}"
+    phonemes = "kokˈoɾotˈest"
+    
+    response = make_request(f"{BASE_URL}/admin/lexicon", method='POST', headers=admin_headers(),
+                            data={"language": "es", "entries": {word: phonemes}})
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error actualizando léxico: {response['status_code']}")
+        return False
+    version = json.loads(response['content'])['version']
+    
+    try:
+        response = make_request(f"{BASE_URL}/phonemize", method='POST',
+                                data={"text": f"Hola {word}, adiós.", "language": "es"})
+        result = json.loads(response['content']).get('phonemes', '') if response['status_code'] == 200 else ''
+        if phonemes not in result:
+            if VERBOSE:
+                print(f"❌ La entrada del léxico no se aplicó: {result}")
+            return False
+    finally:
+        # Una entrada con fonemas vacíos se elimina del léxico
+        make_request(f"{BASE_URL}/admin/lexicon", method='POST', headers=admin_headers(),
+                     data={"language": "es", "entries": {word: ""}})
+    
+    if VERBOSE:
+        print(f"✅ Léxico {version}: '{word}' -> {result}")
+    
+    return True
+
+
+def test_g2p_workers():
+    """Test G2P de textos largos en paralelo (procesos G2P dedicados)"""
+    run_id = int(time.time())
+    texts = [" ".join(f"Frase {i} del documento {doc}, ejecución {run_id}." for i in range(20))
+             for doc in range(4)]
+    
+    def phonemize(text):
+        return make_request(f"{BASE_URL}/phonemize", method='POST', data={"text": text, "language": "es"})
+    
+    # Cada texto dos veces a la vez: ambas respuestas deben coincidir
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(phonemize, texts + texts))
+    
+    results = []
+    for response in responses:
+        if response['status_code'] != 200:
+            if VERBOSE:
+                print(f"❌ /phonemize concurrente falló: {response['status_code']}")
+            return False
+        results.append(json.loads(response['content']).get('phonemes'))
+    
+    if not all(results) or results[:4] != results[4:]:
+        if VERBOSE:
+            print("❌ Fonemas vacíos o distintos para el mismo texto")
+        return False
+    
+    response = make_request(f"{BASE_URL}/metrics")
+    if response['status_code'] != 200 or 'g2p_workers' not in json.loads(response['content']):
+        if VERBOSE:
+            print("❌ /metrics no incluye g2p_workers")
+        return False
+    
+    if VERBOSE:
+        workers = json.loads(response['content'])['g2p_workers']
+        print(f"✅ 8 peticiones G2P concurrentes coherentes (procesos dedicados: {workers or 'ninguno'})")
+    
+    return True
+
+
+def test_admission_limits():
+    """Test control de admisión: textos demasiado largos (413) y derivación a trabajo asíncrono (202)"""
+    long_text = "Este texto es demasiado largo para una petición interactiva. " * 120
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": long_text, "language": "es"})
+    if response['status_code'] != 413:
+        if VERBOSE:
+            print(f"❌ Texto largo debería dar 413, dio: {response['status_code']}")
+        return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": long_text, "language": "es", "allow_async": True})
+    if response['status_code'] != 202:
+        if VERBOSE:
+            print(f"❌ Con allow_async debería dar 202, dio: {response['status_code']}")
+        return False
+    
+    data = json.loads(response['content'])
+    if 'job_id' not in data or 'estimate' not in data:
+        if VERBOSE:
+            print(f"❌ Respuesta de derivación incompleta: {list(data.keys())}")
+        return False
+    
+    # Las peticiones solo con fonemas también tienen límite de longitud
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"phonemes": "ˈola ˈola. " * 800, "language": "es"})
+    if response['status_code'] != 413:
+        if VERBOSE:
+            print(f"❌ Fonemas demasiado largos deberían dar 413, dio: {response['status_code']}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ 413 sin allow_async; derivado a trabajo {data['job_id']} "
+              f"(estimado {data['estimate']['seconds']:.1f}s)")
+    
+    return True
+
+
+def test_cost_scheduler_metrics():
+    """Test modelo de coste y planificador SJF expuestos en /metrics"""
+    response = make_request(f"{BASE_URL}/metrics")
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error en /metrics: {response['status_code']}")
+        return False
+    before = json.loads(response['content'])
+    
+    required = {
+        'cost_model': ['observations', 'base_seconds', 'seconds_per_phoneme', 'phonemes_per_char', 'samples_per_phoneme'],
+        'scheduler': ['slots', 'active', 'queued']
+    }
+    for section, keys in required.items():
+        missing = [key for key in keys if key not in (before.get(section) or {})]
+        if missing:
+            if VERBOSE:
+                print(f"❌ /metrics.{section} sin campos: {missing}")
+            return False
+    
+    # Una inferencia nueva alimenta el modelo de coste
+    payload = {"text": f"Prueba del modelo de coste, ejecución {time.time()}.", "language": "es"}
+    response = make_request(f"{BASE_URL}/synthesize", method='POST', data=payload, binary=True)
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Síntesis falló: {response['status_code']}")
+        return False
+    
+    after = json.loads(make_request(f"{BASE_URL}/metrics")['content'])
+    if after['cost_model']['observations'] <= before['cost_model']['observations']:
+        if VERBOSE:
+            print("❌ La inferencia no se registró en cost_model.observations")
+        return False
+    
+    if VERBOSE:
+        cost = after['cost_model']
+        print(f"✅ Coste {cost['base_seconds']:.3f}s + {cost['seconds_per_phoneme'] * 1000:.2f}ms/fonema "
+              f"({cost['observations']} observaciones), {after['scheduler']['slots']} slots de inferencia")
+    
+    return True
+
+
+def test_binary_envelopes():
+    """Test sobres binarios de /synthesize_json negociados con Accept"""
+    payload = {"text": "Prueba de sobre binario.", "language": "es"}
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST', data=payload,
+                            headers={'Accept': 'multipart/mixed'}, binary=True)
+    content_type = response['headers'].get('Content-Type', '')
+    if response['status_code'] != 200 or 'boundary=' not in content_type:
+        if VERBOSE:
+            print(f"❌ multipart/mixed no negociado: {response['status_code']} {content_type}")
+        return False
+    
+    boundary = content_type.split('boundary=')[1].encode()
+    parts = [part for part in response['content'].split(b'--' + boundary) if part.strip(b'-\r\n')]
+    metadata = json.loads(parts[0].split(b'\r\n\r\n', 1)[1])
+    audio = parts[1].split(b'\r\n\r\n', 1)[1][:-2]
+    if audio[:4] != b'RIFF' or len(audio) != metadata['audio_size_bytes']:
+        if VERBOSE:
+            print(f"❌ Parte de audio inválida ({len(audio)} bytes, esperados {metadata['audio_size_bytes']})")
+        return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST', data=payload,
+                            headers={'Accept': 'audio/wav'}, binary=True)
+    if response['content'][:4] != b'RIFF' or 'X-Audio-Duration' not in response['headers']:
+        if VERBOSE:
+            print("❌ Audio crudo sin cabecera X-Audio-Duration")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ multipart: {len(audio)} bytes de audio; crudo: {response['headers']['X-Audio-Duration']}s")
+    
+    return True
+
+
+def test_model_routing():
+    """Test registro de modelos: /models y selección de modelo por petición"""
+    response = make_request(f"{BASE_URL}/models")
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ /models respondió {response['status_code']}")
+        return False
+    
+    registry = json.loads(response['content'])
+    default_model = registry['default_model']
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": "Prueba de selección de modelo.", "model": default_model})
+    if response['status_code'] != 200 or json.loads(response['content'])['precision'] != default_model:
+        if VERBOSE:
+            print(f"❌ Síntesis con model={default_model} falló: {response['status_code']}")
+        return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": "Modelo inexistente.", "model": "modelo-inexistente"})
+    if response['status_code'] != 400:
+        if VERBOSE:
+            print(f"❌ Un modelo inexistente debería dar 400, dio: {response['status_code']}")
+        return False
+    
+    # Una variante registrada sin archivo responde 503 en lugar de audio de fallback
+    missing = [name for name, info in registry['models'].items()
+               if not info['available'] and not info['loaded'] and name != default_model]
+    if missing:
+        response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                                data={"text": "Modelo sin archivo.", "model": missing[0]})
+        if response['status_code'] != 503:
+            if VERBOSE:
+                print(f"❌ Un modelo sin archivo ({missing[0]}) debería dar 503, dio: {response['status_code']}")
+            return False
+    
+    if VERBOSE:
+        loaded = [name for name, info in registry['models'].items() if info['loaded']]
+        print(f"✅ {len(registry['models'])} modelos registrados, cargados: {', '.join(loaded)}")
+    
+    return True
+
+
+def test_quantize_variants():
+    """Test quantize_model.py: solo genera las variantes pedidas y rechaza las desconocidas"""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            "MODEL_PATH": os.path.join(directory, "kokoro.onnx"),
+            "MODEL_PATH_INT8": os.path.join(directory, "kokoro.int8.onnx"),
+            "MODEL_PATH_FP16": os.path.join(directory, "kokoro.fp16.onnx")
+        }
+        
+        result = run_app_script('quantize_model.py', 'quantize', env=env)
+        if "ModuleNotFoundError" in result.stderr:
+            if VERBOSE:
+                print(f"⚠️  Dependencias de quantize_model.py no instaladas, se omite el test: {result.stderr.strip().splitlines()[-1]}")
+            return True
+        if result.returncode != 1 or "Modelo fuente no encontrado" not in result.stdout:
+            if VERBOSE:
+                print(f"❌ Sin modelo fuente debería fallar, dio {result.returncode}: {result.stdout.strip()}")
+            return False
+        
+        # Con el modelo y la variante int8 ya existentes no se convierte nada (ni se toca fp16)
+        for path in (env["MODEL_PATH"], env["MODEL_PATH_INT8"]):
+            with open(path, 'wb') as f:
+                f.write(b"onnx")
+        result = run_app_script('quantize_model.py', 'quantize', '--variants', 'int8', env=env)
+        if result.returncode != 0 or "int8: ya existe" not in result.stdout or "fp16" in result.stdout:
+            if VERBOSE:
+                print(f"❌ Selección de variantes incorrecta ({result.returncode}): {result.stdout.strip()}")
+            return False
+        
+        result = run_app_script('quantize_model.py', 'quantize', '--variants', 'int4', env=env)
+        if result.returncode != 2 or "invalid choice" not in result.stderr:
+            if VERBOSE:
+                print(f"❌ Una variante desconocida debería rechazarse, dio {result.returncode}")
+            return False
+    
+    if VERBOSE:
+        print("✅ Variante int8 seleccionada sin tocar fp16; int4 rechazada")
+    
+    return True
+
+
+def test_hot_reload():
+    """Test recarga en caliente: el modelo se recarga y el servicio sigue sintetizando"""
+    if not ADMIN_TOKEN:
+        if VERBOSE:
+            print("⚠️  KOKORO_TTS_ADMIN_TOKEN no definido, se omite el test de recarga")
+        return True
+    
+    response = make_request(f"{BASE_URL}/admin/reload", method='POST', data={"wait": True})
+    if response['status_code'] != 401:
+        if VERBOSE:
+            print(f"❌ /admin/reload sin token debería dar 401, dio: {response['status_code']}")
+        return False
+    
+    response = make_request(f"{BASE_URL}/admin/reload", method='POST', headers=admin_headers(), data={"wait": True})
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Recarga fallida: {response['status_code']} {response['content'][:200]}")
+        return False
+    
+    reloads = json.loads(response['content'])['reloads']
+    if not reloads or any(result['status'] != 'loaded' for result in reloads.values()):
+        if VERBOSE:
+            print(f"❌ Estado de recarga inesperado: {reloads}")
+        return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": "Después de recargar el modelo.", "language": "es"})
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Síntesis tras la recarga falló: {response['status_code']}")
+        return False
+    
+    if VERBOSE:
+        for precision, result in reloads.items():
+            print(f"✅ {precision} recargado en {result['elapsed']:.1f}s")
+    
+    return True
+
+
+def run_app_script(name, *args, env=None):
+    """Ejecuta un script de app/ en un subproceso con el mismo intérprete"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', name)
+    return subprocess.run([sys.executable, script, *args], capture_output=True, text=True,
+                          timeout=TEST_TIMEOUT * 4, env=dict(os.environ, **(env or {})))
+
+
+def run_prerender(manifest, output_dir):
+    """Ejecuta prerender.py en un subproceso y devuelve (código de salida, resumen final)"""
+    result = run_app_script('prerender.py', manifest, '--output-dir', output_dir, '--workers', '1')
+    summary = {}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(':')
+        if name in ('Renderizados', 'Omitidos', 'Fallos'):
+            summary[name] = int(value)
+    return result.returncode, summary
+
+
+def test_prerender_warm_cache():
+    """Test prerender.py: la reejecución omite lo renderizado y el índice se importa como caché caliente"""
+    if not (STORAGE_PATH and ADMIN_TOKEN):
+        if VERBOSE:
+            print("⚠️  KOKORO_TTS_STORAGE_PATH o KOKORO_TTS_ADMIN_TOKEN no definidos, se omite el test de prerender")
+        return True
+    
+    run_id = int(time.time())
+    items = [{"text": f"Locución prerenderizada {n}, ejecución {run_id}.", "language": "es",
+              "voice": "ef_dora", "output": f"menu/item{n}"} for n in range(2)]
+    directory = f"prerender-test-{run_id}"
+    output_dir = os.path.join(STORAGE_PATH, directory)
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    
+    try:
+        # Primera ejecución: todo pendiente; la segunda no debe renderizar nada
+        for expected in ({'Renderizados': 2, 'Omitidos': 0}, {'Renderizados': 0, 'Omitidos': 2}):
+            returncode, summary = run_prerender(f.name, output_dir)
+            if returncode != 0 or any(summary.get(name) != value for name, value in expected.items()):
+                if VERBOSE:
+                    print(f"❌ prerender.py dio {returncode} {summary}, esperado {expected}")
+                return False
+        
+        response = make_request(f"{BASE_URL}/admin/warm_cache", method='POST', headers=admin_headers(),
+                                data={"directory": directory})
+        if response['status_code'] != 200 or json.loads(response['content'])['loaded'] != 2:
+            if VERBOSE:
+                print(f"❌ Importación de la caché caliente: {response['status_code']} {response['content'][:200]}")
+            return False
+        
+        hits_before = get_counters().get('warm_cache_hits', 0)
+        payload = {k: v for k, v in items[0].items() if k != 'output'}
+        response = make_request(f"{BASE_URL}/synthesize", method='POST', data=payload, binary=True)
+        hits = get_counters().get('warm_cache_hits', 0) - hits_before
+        if response['status_code'] != 200 or hits != 1:
+            if VERBOSE:
+                print(f"❌ La petición no se sirvió de la caché caliente: {response['status_code']}, {hits} aciertos")
+            return False
+        
+        # Un directorio fuera de STORAGE_DIR se rechaza
+        response = make_request(f"{BASE_URL}/admin/warm_cache", method='POST', headers=admin_headers(),
+                                data={"directory": "../"})
+        if response['status_code'] != 400:
+            if VERBOSE:
+                print(f"❌ Directorio fuera de STORAGE_DIR debería dar 400, dio: {response['status_code']}")
+            return False
+    finally:
+        os.unlink(f.name)
+        shutil.rmtree(output_dir, ignore_errors=True)
+    
+    if VERBOSE:
+        print(f"✅ 2 locuciones prerenderizadas, reejecución incremental e importación en {directory}")
+    
+    return True
+
+
+def test_gateway_affinity():
+    """Test gateway: la misma síntesis se enruta siempre a la misma réplica"""
+    health = json.loads(make_request(f"{BASE_URL}/health")['content'])
+    if health.get('mode') != 'gateway':
+        if VERBOSE:
+            print("⚠️  El servicio no es un gateway, se omite el test de afinidad")
+        return True
+    
+    replicas = set()
+    for _ in range(3):
+        response = make_request(f"{BASE_URL}/synthesize", method='POST', binary=True,
+                                data={"text": "Prueba de afinidad del gateway.", "language": "es"})
+        if response['status_code'] != 200:
+            if VERBOSE:
+                print(f"❌ Síntesis a través del gateway falló: {response['status_code']}")
+            return False
+        replicas.add(response['headers'].get('X-Kokoro-Replica'))
+        if response['headers'].get('Content-Type') != 'audio/wav':
+            if VERBOSE:
+                print(f"❌ Content-Type reenviado incorrecto: {response['headers'].get('Content-Type')}")
+            return False
+    
+    if len(replicas) != 1:
+        if VERBOSE:
+            print(f"❌ La misma petición llegó a varias réplicas: {replicas}")
+        return False
+    
+    # Los ids de trabajos llevan la réplica propietaria: su estado se consulta en ella
+    response = make_request(f"{BASE_URL}/jobs", method='POST', data={"text": "Trabajo a través del gateway."})
+    job = json.loads(response['content']) if response['status_code'] in (200, 202) else {}
+    if '.' not in job.get('job_id', '') or not job.get('status_url', '').endswith(job['job_id']):
+        if VERBOSE:
+            print(f"❌ Id de trabajo sin réplica propietaria: {response['status_code']} {job}")
+        return False
+    status = make_request(f"{BASE_URL}{job['status_url']}")
+    if status['status_code'] != 200 or status['headers'].get('X-Kokoro-Replica') != response['headers'].get('X-Kokoro-Replica'):
+        if VERBOSE:
+            print(f"❌ Estado del trabajo no servido por su réplica: {status['status_code']}")
+        return False
+    
+    if VERBOSE:
+        print(f"✅ Peticiones repetidas enrutadas a {replicas.pop()} "
+              f"({health['replicas_healthy']}/{health['replicas_total']} réplicas sanas)")
+    
+    return True
+
+
+def test_rpc_interface():
+    """Test interfaz RPC binaria: synthesize, streaming y lotes sobre una conexión"""
+    if not RPC_PORT:
+        if VERBOSE:
+            print("⚠️  KOKORO_TTS_RPC_PORT no definido, se omite el test RPC")
+        return True
+    
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+    from rpc import RpcClient
+    
+    host = urllib.parse.urlparse(BASE_URL).hostname
+    with RpcClient(host, RPC_PORT, timeout=TEST_TIMEOUT) as client:
+        meta, audio = client.synthesize(text="Hola desde la interfaz binaria.", language="es", format="pcm")
+        if len(audio) != round(meta['duration'] * meta['sample_rate']) * 2:
+            if VERBOSE:
+                print(f"❌ Tamaño PCM inesperado: {len(audio)} bytes para {meta['duration']:.2f}s")
+            return False
+        
+        chunks = list(client.synthesize_stream(text="Primera frase. Segunda frase. Tercera frase.", format="pcm"))
+        if len(chunks) != 3 or [meta['index'] for meta, _ in chunks] != [0, 1, 2]:
+            if VERBOSE:
+                print(f"❌ El streaming debería devolver un fragmento por frase (3), devolvió {len(chunks)}")
+            return False
+        
+        results = client.batch(["Uno.", "Dos."], language="es", format="wav")
+        if any(audio[:4] != b'RIFF' for _, audio in results):
+            if VERBOSE:
+                print("❌ El lote no devolvió audio WAV")
+            return False
+    
+    if VERBOSE:
+        print(f"✅ RPC: {len(audio)} bytes PCM, {len(chunks)} fragmentos en streaming, lote de {len(results)}")
+    
+    return True
+
+
+def test_shm_output():
+    """Test salida por memoria compartida: la respuesta lleva solo el handle del audio"""
+    # Los endpoints que devuelven el audio en el cuerpo rechazan output=shm en lugar de ignorarlo
+    for endpoint in ("/synthesize", "/artifacts", "/jobs"):
+        response = make_request(f"{BASE_URL}{endpoint}", method='POST',
+                                data={"text": "Hola.", "output": "shm"}, binary=True)
+        if response['status_code'] != 400:
+            if VERBOSE:
+                print(f"❌ {endpoint} con output=shm debería dar 400, dio: {response['status_code']}")
+            return False
+    
+    response = make_request(f"{BASE_URL}/synthesize_json", method='POST',
+                            data={"text": "Hola desde la memoria compartida.", "format": "pcm", "output": "shm"})
+    if response['status_code'] == 400 and 'disabled' in response['content']:
+        if VERBOSE:
+            print("⚠️  SHM_RING_SIZE_MB=0 en el servicio, se omite el test de memoria compartida")
+        return True
+    if response['status_code'] != 200:
+        if VERBOSE:
+            print(f"❌ Error con output=shm: {response['status_code']}")
+        return False
+    
+    data = json.loads(response['content'])
+    handle = data.get('shm') or {}
+    expected = round(data['audio_duration'] * data['sample_rate']) * 2
+    if handle.get('length') != expected or 'audio' in data:
+        if VERBOSE:
+            print(f"❌ Handle inesperado: {handle} (esperados {expected} bytes)")
+        return False
+    
+    # El audio solo se puede leer en el mismo host que el servicio
+    if os.path.exists(f"/dev/shm/{handle['name']}"):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+        from shm_ring import ShmRingReader
+        with ShmRingReader(handle['name']) as reader:
+            audio = reader.read(handle)
+        if len(audio) != expected:
+            if VERBOSE:
+                print(f"❌ Lectura de memoria compartida incompleta: {len(audio)} bytes")
+            return False
+    
+    if VERBOSE:
+        print(f"✅ Handle /dev/shm/{handle['name']} offset={handle['offset']} ({handle['length']} bytes)")
+    
+    return True
+
+
 def check_service_availability():
     """Verificar si el servicio está disponible"""
     try:
@@ -477,6 +1393,7 @@ def main():
     
     # Tests básicos
     runner.run_test("Conectividad y salud del servicio", test_service_health)
+    runner.run_test("Circuit breakers en /health", test_circuit_breakers)
     runner.run_test("Endpoint de idiomas", test_languages_endpoint)
     runner.run_test("Endpoint de voces", test_voices_endpoint)
     runner.run_test("Síntesis básica", test_basic_synthesis)
@@ -485,6 +1402,26 @@ def main():
     # Tests de funcionalidad
     runner.run_test("Diferentes voces", test_different_voices)
     runner.run_test("Síntesis por lotes", test_batch_synthesis)
+    runner.run_test("Caché HTTP (ETag/304)", test_http_caching)
+    runner.run_test("Coalescencia de peticiones", test_request_coalescing)
+    runner.run_test("Caché de segmentos", test_segment_cache)
+    runner.run_test("Artefactos con HTTP Range", test_range_artifacts)
+    runner.run_test("Trabajos asíncronos", test_async_jobs)
+    runner.run_test("Reanudación de trabajos", test_job_resume)
+    runner.run_test("Entrada de fonemas", test_phoneme_input)
+    runner.run_test("G2P concurrente", test_g2p_workers)
+    runner.run_test("Léxico de pronunciación", test_pronunciation_lexicon)
+    runner.run_test("Postproceso del audio", test_postprocess)
+    runner.run_test("Control de admisión", test_admission_limits)
+    runner.run_test("Modelo de coste y planificador", test_cost_scheduler_metrics)
+    runner.run_test("Sobres binarios de /synthesize_json", test_binary_envelopes)
+    runner.run_test("Registro de modelos", test_model_routing)
+    runner.run_test("Variantes de quantize_model.py", test_quantize_variants)
+    runner.run_test("Recarga en caliente del modelo", test_hot_reload)
+    runner.run_test("Prerenderizado y caché caliente", test_prerender_warm_cache)
+    runner.run_test("Afinidad del gateway", test_gateway_affinity)
+    runner.run_test("Interfaz RPC binaria", test_rpc_interface)
+    runner.run_test("Salida por memoria compartida", test_shm_output)
     
     # Resumen final
     success = runner.print_summary()
@@ -506,6 +1443,9 @@ if __name__ == '__main__':
     parser.add_argument('--url', default=BASE_URL, help='URL del servicio Kokoro TTS')
     parser.add_argument('--timeout', type=int, default=TEST_TIMEOUT, help='Timeout para requests (segundos)')
     parser.add_argument('--verbose', '-v', action='store_true', help='Modo verboso con detalles')
+    parser.add_argument('--rpc-port', type=int, default=RPC_PORT, help='Puerto RPC binario (0 = no probar)')
+    parser.add_argument('--admin-token', default=ADMIN_TOKEN, help='Token de /admin/* (vacío = no probar)')
+    parser.add_argument('--storage-path', default=STORAGE_PATH, help='STORAGE_DIR del servicio visto por los tests (vacío = no probar prerender)')
     
     args = parser.parse_args()
     
@@ -513,6 +1453,9 @@ if __name__ == '__main__':
     BASE_URL = args.url
     TEST_TIMEOUT = args.timeout
     VERBOSE = args.verbose
+    RPC_PORT = args.rpc_port
+    ADMIN_TOKEN = args.admin_token
+    STORAGE_PATH = args.storage_path
     
     success = main()
     sys.exit(0 if success else 1) 
\ No newline at end of file